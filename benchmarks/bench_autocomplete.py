@@ -0,0 +1,76 @@
+# benchmarks/bench_autocomplete.py
+"""
+Đo autocomplete của /music play trên danh mục TRACKS có `--tracks` bài: độ trễ khi gõ dở từng từ (tuần tự và
+`--concurrency` người gõ cùng lúc), so với hạn 3 giây của Discord. Sau đó so sánh lệnh play bằng tên bài đã có
+trong cache (trúng danh mục, không gọi yt-dlp) với lệnh play bằng tên chưa biết (phải tìm trên YouTube).
+Chạy: python benchmarks/bench_autocomplete.py [--tracks 20000] [--queries 500] [--concurrency 50]
+"""
+
+import argparse
+import asyncio
+import os
+import random
+import tempfile
+import time
+
+import fakes
+
+WORDS = ['miku', 'senbonzakura', 'tell', 'your', 'world', 'melt', 'rolling', 'girl', 'ghost', 'rule', 'unknown', 'mother', 'love', 'is', 'war',
+         'tình', 'yêu', 'màu', 'nắng', 'mưa', 'hồng', 'đêm', 'trăng', 'sài', 'gòn', 'remix', 'live', 'cover', 'acoustic', 'ver']
+
+def percentiles(values: list[float]) -> str:
+    values = sorted(values); pick = lambda p: values[min(len(values) - 1, int(p * len(values)))] * 1000
+    return f"p50={pick(0.5):7.2f}ms  p95={pick(0.95):7.2f}ms  p99={pick(0.99):7.2f}ms  max={values[-1] * 1000:7.2f}ms  (n={len(values)})"
+
+def partial_query(rng: random.Random, title: str) -> str:
+    """Như người dùng đang gõ: vài từ đầu của tên bài, từ cuối gõ dở."""
+    words = title.split()[:rng.randint(1, 3)]; words[-1] = words[-1][:rng.randint(1, len(words[-1]))]
+    return ' '.join(words)
+
+async def run(args, music, extractor: fakes.FakeExtractor):
+    rng = random.Random(7); bot = fakes.FakeBot(); cog = music.MainCog(bot); bot.cog = cog
+    guild = bot.add_guild(1000); ctx = fakes.FakeContext(guild)
+    titles = [' '.join(rng.choice(WORDS) for _ in range(rng.randint(2, 6))) + f" {index}" for index in range(args.tracks)]
+    started = time.perf_counter()
+    for offset in range(0, args.tracks, 500):
+        music.TRACKS.remember([{'id': f"idx{index:07d}", 'url': f"https://www.youtube.com/watch?v=idx{index:07d}", 'title': titles[index], 'uploader': 'Fake Producer', 'duration': 200}
+                               for index in range(offset, min(args.tracks, offset + 500))], played=rng.random() < 0.3)
+    await music.TRACKS.flush()
+    print(f"\n=== Danh mục {args.tracks} bài (nạp trong {time.perf_counter() - started:.2f}s, FTS5 {'có' if music.TRACKS.fts else 'không'}) ===")
+
+    queries = [partial_query(rng, rng.choice(titles)) for _ in range(args.queries)]; latencies = []; results = 0
+    for query in queries:
+        t = time.perf_counter(); choices = await cog.play_autocomplete(None, query); latencies.append(time.perf_counter() - t); results += len(choices)
+    print(f"Autocomplete tuần tự  : {percentiles(latencies)} | trung bình {results / len(queries):.1f} gợi ý")
+    latencies = []
+    async def timed(query):
+        t = time.perf_counter(); await cog.play_autocomplete(None, query); latencies.append(time.perf_counter() - t)
+    await asyncio.gather(*(timed(rng.choice(queries)) for _ in range(args.concurrency)))
+    print(f"{args.concurrency} người gõ cùng lúc  : {percentiles(latencies)}")
+
+    # Lệnh play bằng tên: bài đã phát (có trong cache) so với tên chưa biết
+    await cog._play_logic(ctx, extractor.url(0)); await asyncio.sleep(0.5)
+    calls = dict(extractor.calls); t = time.perf_counter(); await cog._play_logic(ctx, extractor.info(extractor.track_id(0))['title'])
+    known = time.perf_counter() - t; known_calls = {k: extractor.calls[k] - calls[k] for k in calls}
+    calls = dict(extractor.calls); t = time.perf_counter(); await cog._play_logic(ctx, "một bài chưa ai nghe")
+    unknown = time.perf_counter() - t; unknown_calls = {k: extractor.calls[k] - calls[k] for k in calls}
+    print(f"play <tên bài đã biết>: {known * 1000:7.1f}ms, yt-dlp {known_calls}")
+    print(f"play <tên chưa biết>  : {unknown * 1000:7.1f}ms, yt-dlp {unknown_calls} (còn phải chọn trong bảng kết quả)")
+    print(f"Danh mục              : {music.TRACKS.stats()}")
+    for state in list(cog.states.values()): await state.cleanup()
+    await asyncio.sleep(0.1); await music.TRACKS.close(); await cog.session.close(); music.EXTRACTOR.shutdown()
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--tracks', type=int, default=20000); parser.add_argument('--queries', type=int, default=500)
+    parser.add_argument('--concurrency', type=int, default=50)
+    args = parser.parse_args()
+    with tempfile.TemporaryDirectory() as directory:
+        fakes.setup_environment(os.path.join(directory, 'cache'), fake_ffmpeg=True, MIKU_TRACK_INDEX_SIZE=str(args.tracks * 2))
+        os.makedirs(os.path.join(directory, 'cache')); fakes.install_fake_ffmpeg()
+        from cogs import music
+        extractor = fakes.FakeExtractor(os.path.join(directory, 'source'), 2, 3.0, 0.2, 0.3, 0.4); extractor.install(music)
+        asyncio.run(run(args, music, extractor))
+
+if __name__ == '__main__':
+    main()
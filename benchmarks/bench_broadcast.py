@@ -0,0 +1,68 @@
+# benchmarks/bench_broadcast.py
+"""
+So sánh nhiều guild nghe cùng một URL: mỗi guild tự phát (`play`, mỗi guild một FFmpeg + bộ mã hóa Opus)
+với radio phát chung (`radio`, một Broadcast cho tất cả). Các guild vào lần lượt cách nhau `--stagger` giây
+để kiểm tra người vào sau nghe ở vị trí trực tiếp. Luôn dùng FFmpeg giả (WavOpusAudio) để đếm số luồng mã hóa.
+Chạy: python benchmarks/bench_broadcast.py [--guilds 50] [--seconds 10] [--stagger 0.05]
+"""
+
+import argparse
+import asyncio
+import os
+import resource
+import tempfile
+import time
+
+import fakes
+
+def cpu_seconds() -> float:
+    own = resource.getrusage(resource.RUSAGE_SELF); return own.ru_utime + own.ru_stime
+
+async def run_mode(args, music, extractor: fakes.FakeExtractor, radio: bool):
+    bot = fakes.FakeBot(); cog = music.MainCog(bot); bot.cog = cog; url = extractor.url(0)
+    guilds = [bot.add_guild(1000 + index) for index in range(args.guilds)]
+    opened_before = fakes.WavOpusAudio.opened; encoded_before = fakes.WavOpusAudio.encoded
+    # Tải sẵn bài vào cache để cả hai chế độ cùng phát từ file
+    warm = await music.Song.resolve(url, guilds[0].member)
+    if warm: await warm.ensure_downloaded(); warm.cleanup()
+    cpu_before = cpu_seconds(); started = time.perf_counter()
+    for guild in guilds:
+        ctx = fakes.FakeContext(guild)
+        await (cog._radio_logic(ctx, url) if radio else cog._play_logic(ctx, url))
+        await asyncio.sleep(args.stagger)
+    await asyncio.sleep(args.seconds)
+    lags = [state.current_source.original.lag for state in cog.states.values() if radio and state.current_source]
+    positions = [state.position() for state in cog.states.values() if state.current_source]; open_broadcasts = len(music.BROADCASTS)
+    wall = time.perf_counter() - started; cpu = cpu_seconds() - cpu_before
+    for state in list(cog.states.values()): await state.cleanup()
+    await asyncio.sleep(0.2); await cog.session.close()
+
+    print(f"\n--- {'Radio phát chung' if radio else 'Mỗi guild tự phát'} ({args.guilds} guild) ---")
+    print(f"Luồng FFmpeg đã mở   : {fakes.WavOpusAudio.opened - opened_before}")
+    print(f"Frame đã mã hóa      : {fakes.WavOpusAudio.encoded - encoded_before} (trong {wall:.1f}s)")
+    print(f"CPU                  : {cpu / wall * 100:.1f}% một nhân")
+    if positions: print(f"Vị trí đang nghe     : {min(positions):.1f}s .. {max(positions):.1f}s (tính từ lúc mỗi guild bắt đầu nghe)")
+    if lags: print(f"Trễ so với trực tiếp : tối đa {max(lags) * 1000:.0f}ms, trung bình {sum(lags) / len(lags) * 1000:.0f}ms | nguồn chung đang mở {open_broadcasts}")
+
+async def run(args, music, extractor):
+    print(f"=== {args.guilds} guild cùng nghe một URL trong {args.seconds:.0f}s ===")
+    music.OPUS_PASSTHROUGH = True # Chế độ tự phát cũng xuất Opus để chỉ khác nhau ở việc dùng chung hay không
+    await run_mode(args, music, extractor, radio=False)
+    await run_mode(args, music, extractor, radio=True)
+    music.EXTRACTOR.shutdown()
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--guilds', type=int, default=50); parser.add_argument('--seconds', type=float, default=10.0, help="Thời gian nghe sau khi guild cuối vào")
+    parser.add_argument('--stagger', type=float, default=0.05, help="Khoảng cách giữa hai guild vào nghe")
+    args = parser.parse_args()
+    with tempfile.TemporaryDirectory() as directory:
+        fakes.setup_environment(os.path.join(directory, 'cache'), fake_ffmpeg=True, MIKU_GAPLESS='0', MIKU_EXTRACT_MAX_PENDING=str(args.guilds * 2))
+        os.makedirs(os.path.join(directory, 'cache')); fakes.install_fake_ffmpeg()
+        from cogs import music
+        track_seconds = args.seconds + args.guilds * args.stagger + 10 # Đủ dài để không guild nào nghe hết bài
+        extractor = fakes.FakeExtractor(os.path.join(directory, 'source'), 1, track_seconds, 0.05, 0.1); extractor.install(music)
+        asyncio.run(run(args, music, extractor))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,49 @@
+# benchmarks/bench_chat.py
+"""
+Kiểm tra quản lý phiên trò chuyện với model Gemini giả: lịch sử gửi kèm mỗi tin nhắn không phình mãi,
+tin nhắn cùng guild gửi dồn dập được xử lý lần lượt, và số phiên được giữ không vượt MIKU_CHAT_MAX_SESSIONS.
+Chạy: python benchmarks/bench_chat.py [--guilds 50] [--messages 100] [--max-sessions 40] [--delay 0.01]
+"""
+
+import argparse
+import asyncio
+import os
+import tempfile
+import time
+
+import fakes
+
+async def run(args, music):
+    bot = fakes.FakeBot(); cog = music.MainCog(bot); bot.cog = cog
+    model = cog.genai_model = cog.chat_sessions.model = fakes.FakeGenerativeModel(args.delay)
+    guilds = [bot.add_guild(1000 + index) for index in range(args.guilds)]; started = time.perf_counter()
+
+    async def chat(guild):
+        ctx = fakes.FakeContext(guild)
+        # Gửi theo từng đợt `burst` tin nhắn cùng lúc để thử việc xếp hàng trong một guild
+        for offset in range(0, args.messages, args.burst):
+            await asyncio.gather(*(cog._chat_logic(ctx, message=f"Tin nhắn số {offset + index} " + "leek " * 20) for index in range(min(args.burst, args.messages - offset))))
+    await asyncio.gather(*(chat(guild) for guild in guilds))
+    elapsed = time.perf_counter() - started; await asyncio.sleep(args.delay * 2) # Chờ các lần tóm tắt chạy nền
+
+    sizes = model.history_sizes; quarter = max(1, len(sizes) // 4)
+    print(f"\n=== {args.guilds} guild x {args.messages} tin nhắn, ngân sách {music.CHAT_MAX_TOKENS} token ===")
+    print(f"Thời gian              : {elapsed:.2f}s, {model.calls} lần gọi model (gồm cả tóm tắt)")
+    print(f"Lịch sử gửi kèm (ký tự): 1/4 đầu tối đa {max(sizes[:quarter])}, 1/4 cuối tối đa {max(sizes[-quarter:])}, lớn nhất {max(sizes)}")
+    print(f"Phiên đang giữ         : {len(cog.chat_sessions)} (giới hạn {music.CHAT_MAX_SESSIONS}) | {cog.chat_sessions.stats()}")
+    await cog.session.close()
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--guilds', type=int, default=50); parser.add_argument('--messages', type=int, default=100, help="Số tin nhắn mỗi guild")
+    parser.add_argument('--burst', type=int, default=5, help="Số tin nhắn gửi cùng lúc trong một guild")
+    parser.add_argument('--max-tokens', type=int, default=2000); parser.add_argument('--max-sessions', type=int, default=40)
+    parser.add_argument('--delay', type=float, default=0.01, help="Thời gian trả lời của model giả")
+    args = parser.parse_args()
+    with tempfile.TemporaryDirectory() as directory:
+        fakes.setup_environment(os.path.join(directory, 'cache'), fake_ffmpeg=True, MIKU_CHAT_MAX_TOKENS=str(args.max_tokens), MIKU_CHAT_MAX_SESSIONS=str(args.max_sessions))
+        from cogs import music
+        asyncio.run(run(args, music))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,110 @@
+# benchmarks/bench_load.py
+"""
+Chạy thử tải MainCog + GuildState.player_loop với hàng trăm guild giả, không cần token hay mạng.
+Đo: thời gian từ lệnh play tới âm thanh đầu tiên, khoảng lặng khi chuyển bài, CPU cho mỗi luồng phát,
+bộ nhớ cho mỗi guild và độ trễ các thao tác hàng đợi (move/remove/xem hàng đợi).
+Nếu không có `ffmpeg` (hoặc dùng --fake-ffmpeg), file WAV được đọc thẳng bằng Python thay cho FFmpegPCMAudio.
+Chạy: python benchmarks/bench_load.py [--guilds 200] [--songs 3] [--track-seconds 3] [--speed 1] [--gapless 0|1] [--crossfade 0]
+"""
+
+import argparse
+import asyncio
+import logging
+import os
+import resource
+import shutil
+import tempfile
+import time
+
+import fakes
+
+def percentiles(values: list[float], scale: float = 1000.0, unit: str = 'ms') -> str:
+    if not values: return "không có dữ liệu"
+    values = sorted(values); pick = lambda p: values[min(len(values) - 1, int(p * len(values)))] * scale
+    return f"p50={pick(0.5):8.2f}{unit}  p95={pick(0.95):8.2f}{unit}  p99={pick(0.99):8.2f}{unit}  max={values[-1] * scale:8.2f}{unit}  (n={len(values)})"
+
+def rss_bytes() -> int:
+    try:
+        with open('/proc/self/statm') as f: return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except OSError: return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+def cpu_seconds() -> float:
+    own = resource.getrusage(resource.RUSAGE_SELF); children = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return own.ru_utime + own.ru_stime + children.ru_utime + children.ru_stime
+
+async def run(args, music, extractor: fakes.FakeExtractor):
+    bot = fakes.FakeBot(speed=args.speed, connect_delay=args.connect_delay); cog = music.MainCog(bot); bot.cog = cog
+    guilds = [bot.add_guild(1000 + index) for index in range(args.guilds)]; contexts = {guild.id: fakes.FakeContext(guild) for guild in guilds}
+    recorder = bot.recorder; rss_before = rss_bytes(); cpu_before = cpu_seconds(); started_at: dict[int, float] = {}
+
+    async def start_guild(index: int, guild):
+        ctx = contexts[guild.id]; started_at[guild.id] = time.perf_counter()
+        await cog._play_logic(ctx, extractor.url(index))
+        for song in range(1, args.songs): await cog._play_logic(ctx, extractor.url(index + song))
+    wall_started = time.perf_counter()
+    await asyncio.gather(*(start_guild(index, guild) for index, guild in enumerate(guilds)))
+    rss_loaded = rss_bytes()
+
+    # Thao tác hàng đợi trong lúc đang phát, đo ngay trên event loop
+    queue_ops = {'queue_embed': [], 'move': [], 'remove': []}
+    for guild in guilds:
+        state = cog.states.get(guild.id); ctx = contexts[guild.id]
+        if not state: continue
+        extras = [music.Song(extractor.info(extractor.track_id(0)), guild.member) for _ in range(args.extra_queue)]
+        for song in extras: state.queue.put_nowait(song)
+        size = state.queue.qsize()
+        if size < 2: continue
+        t = time.perf_counter(); state._create_queue_embed(max(1, size // 10)); queue_ops['queue_embed'].append(time.perf_counter() - t)
+        t = time.perf_counter(); await cog._move_logic(ctx, size, 1); queue_ops['move'].append(time.perf_counter() - t)
+        t = time.perf_counter(); await cog._remove_logic(ctx, size); queue_ops['remove'].append(time.perf_counter() - t)
+        # Bỏ các bài thêm vào để đo, giữ nguyên các bài thật sự cần phát
+        extra_ids = set(map(id, extras))
+        for song in state.queue.clear():
+            if id(song) not in extra_ids: state.queue.put_nowait(song)
+        state.refresh_preroll() # Sửa hàng đợi trực tiếp nên phải tự báo cho phần gapless
+
+    deadline = time.perf_counter() + args.timeout
+    while time.perf_counter() < deadline:
+        if all(recorder.tracks_finished.get(guild.id, 0) >= args.songs for guild in guilds): break
+        await asyncio.sleep(0.2)
+    wall = time.perf_counter() - wall_started; cpu = cpu_seconds() - cpu_before
+    for state in list(cog.states.values()): await state.cleanup()
+    await asyncio.sleep(0.1); await cog.session.close(); music.EXTRACTOR.shutdown()
+
+    ttfa = [recorder.first_audio_at[gid] - started_at[gid] for gid in recorder.first_audio_at]
+    audio_seconds = recorder.frames * 0.02; finished = sum(min(args.songs, recorder.tracks_finished.get(guild.id, 0)) for guild in guilds)
+    print(f"\n=== {args.guilds} guild, {args.songs} bài/guild, bài dài {args.track_seconds}s, tốc độ x{args.speed}, {'FFmpeg giả' if args.fake_ffmpeg else 'FFmpeg thật'}, gapless {'bật' if args.gapless else 'tắt'} ===")
+    print(f"Hoàn thành            : {finished}/{args.guilds * args.songs} bài trong {wall:.1f}s")
+    print(f"Tới âm thanh đầu tiên : {percentiles(ttfa)}")
+    print(f"Khoảng lặng chuyển bài: {percentiles(recorder.gaps)}  | nối liền mạch {int(music.SONG_EVENTS.value('gapless'))} lần")
+    if audio_seconds: print(f"CPU mỗi luồng phát    : {cpu / audio_seconds * 1000:.2f}ms CPU cho mỗi giây âm thanh ({cpu / audio_seconds * 100:.2f}% một nhân)")
+    print(f"Bộ nhớ mỗi guild      : {(rss_loaded - rss_before) / max(1, args.guilds) / 1024:.1f} KiB (RSS tăng khi {args.guilds} guild đã có hàng đợi)")
+    for name, values in queue_ops.items(): print(f"Hàng đợi {name:<13}: {percentiles(values, 1e6, 'µs')}")
+    print(f"yt-dlp giả            : {extractor.calls}  | cache âm thanh trúng {music.AUDIO_CACHE.hits}, trượt {music.AUDIO_CACHE.misses}")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--guilds', type=int, default=200); parser.add_argument('--songs', type=int, default=3, help="Số bài mỗi guild phát")
+    parser.add_argument('--tracks', type=int, default=20, help="Số bài khác nhau (các guild dùng chung cache)")
+    parser.add_argument('--track-seconds', type=float, default=3.0); parser.add_argument('--speed', type=float, default=1.0, help="Đọc frame nhanh gấp bao nhiêu lần thời gian thực")
+    parser.add_argument('--info-delay', type=float, default=0.2); parser.add_argument('--download-delay', type=float, default=0.5); parser.add_argument('--connect-delay', type=float, default=0.05)
+    parser.add_argument('--extra-queue', type=int, default=100, help="Số bài thêm vào mỗi hàng đợi để đo thao tác hàng đợi")
+    parser.add_argument('--timeout', type=float, default=300); parser.add_argument('--fake-ffmpeg', action='store_true', help="Không dùng ffmpeg kể cả khi có")
+    parser.add_argument('--ffmpeg-startup', type=float, default=0.08, help="Thời gian FFmpeg giả khởi động trước frame đầu tiên")
+    parser.add_argument('--gapless', type=int, choices=(0, 1), default=1, help="Mở sẵn bài kế tiếp và nối liền mạch (MIKU_GAPLESS)")
+    parser.add_argument('--crossfade', type=float, default=0.0, help="Số giây trộn chồng hai bài (MIKU_CROSSFADE, chỉ với PCM)")
+    parser.add_argument('--verbose', action='store_true')
+    args = parser.parse_args()
+    args.fake_ffmpeg = args.fake_ffmpeg or not shutil.which('ffmpeg')
+    logging.basicConfig(level=logging.INFO if args.verbose else logging.WARNING)
+    with tempfile.TemporaryDirectory() as directory:
+        fakes.setup_environment(os.path.join(directory, 'cache'), args.fake_ffmpeg, MIKU_EXTRACT_MAX_PENDING=str(args.guilds * args.songs * 2), MIKU_EXTRACT_MAX_PENDING_PER_GUILD=str(args.songs * 2 + 2),
+                                MIKU_GAPLESS=str(args.gapless), MIKU_CROSSFADE=str(args.crossfade))
+        os.makedirs(os.path.join(directory, 'cache'))
+        if args.fake_ffmpeg: fakes.install_fake_ffmpeg(args.ffmpeg_startup)
+        from cogs import music
+        extractor = fakes.FakeExtractor(os.path.join(directory, 'source'), args.tracks, args.track_seconds, args.info_delay, args.download_delay); extractor.install(music)
+        asyncio.run(run(args, music, extractor))
+
+if __name__ == '__main__':
+    main()
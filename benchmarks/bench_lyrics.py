@@ -0,0 +1,41 @@
+# benchmarks/bench_lyrics.py
+"""
+Kiểm tra cache lời bài hát với model Gemini giả: cả kênh cùng hỏi lời một bài thì chỉ có một lần gọi model,
+lần hỏi sau lấy từ đĩa, và kết quả "không tìm thấy" cũng được nhớ.
+Chạy: python benchmarks/bench_lyrics.py [--listeners 50] [--songs 5] [--delay 1.0]
+"""
+
+import argparse
+import asyncio
+import os
+import tempfile
+import time
+
+import fakes
+
+async def run(args, music):
+    bot = fakes.FakeBot(); cog = music.MainCog(bot); bot.cog = cog; model = cog.genai_model = fakes.FakeGenerativeModel(args.delay)
+    guild = bot.add_guild(1000); state = cog.get_guild_state(guild.id); contexts = [fakes.FakeContext(guild) for _ in range(args.listeners)]
+    titles = [f"Song {index}" for index in range(args.songs)] + ["Unknown song"]
+    for round_name in ("lần đầu (cache trống)", "lần hai (từ cache)"):
+        calls_before = model.calls; started = time.perf_counter()
+        for title in titles:
+            state.current_song = music.Song({'id': title, 'title': title, 'uploader': 'Fake Artist - Topic'}, guild.member)
+            await asyncio.gather(*(cog._lyrics_logic(ctx) for ctx in contexts))
+        elapsed = time.perf_counter() - started
+        print(f"{round_name:<22}: {len(titles) * args.listeners} yêu cầu, {model.calls - calls_before} lần gọi model, {elapsed:.2f}s")
+    print(f"Thống kê cache       : {music.LYRICS.stats()}")
+    state.current_song = None; await music.LYRICS.close(); await cog.session.close()
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--listeners', type=int, default=50, help="Số người cùng hỏi lời một bài")
+    parser.add_argument('--songs', type=int, default=5); parser.add_argument('--delay', type=float, default=1.0, help="Thời gian trả lời của model giả")
+    args = parser.parse_args()
+    with tempfile.TemporaryDirectory() as directory:
+        fakes.setup_environment(os.path.join(directory, 'cache'), fake_ffmpeg=True)
+        from cogs import music
+        asyncio.run(run(args, music))
+
+if __name__ == '__main__':
+    main()
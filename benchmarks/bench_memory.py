@@ -0,0 +1,70 @@
+# benchmarks/bench_memory.py
+"""
+Đo bộ nhớ của hàng đợi: `--guilds` guild, mỗi guild `--queue` bài, mỗi bài tạo từ một info dict cỡ thật của yt-dlp
+(formats, thumbnails, mô tả...). So sánh Song hiện tại (chỉ giữ vài trường) với cách cũ giữ nguyên info dict.
+Cách cũ chỉ đo trên `--legacy-sample` bài rồi nhân lên, vì giữ 100.000 info dict cần vài GB.
+Chạy: python benchmarks/bench_memory.py [--guilds 100] [--queue 1000] [--legacy-sample 2000] (mất khoảng 1-2 phút vì tracemalloc)
+"""
+
+import argparse
+import gc
+import os
+import tempfile
+import time
+import tracemalloc
+
+import fakes
+
+def make_info(index: int) -> dict:
+    """Info dict giống kết quả extract_info của yt-dlp cho một video YouTube (rút gọn so với thật)."""
+    video_id = f"v{index:010d}"; base = f"https://rr{index % 9}---sn-ab5l6nzr.googlevideo.com/videoplayback?expire=1700000000&ei={video_id}&ip=203.0.113.7"
+    formats = [{'format_id': str(139 + n), 'format_note': f"{48 * (n + 1)}k", 'ext': 'webm' if n % 2 else 'm4a', 'acodec': 'opus' if n % 2 else 'mp4a.40.2',
+                'vcodec': 'none', 'abr': 48.0 * (n + 1), 'asr': 48000, 'audio_channels': 2, 'filesize': 1_000_000 + n * 4321 + index,
+                'url': f"{base}&itag={139 + n}&source=youtube&requiressl=yes&mime=audio%2Fwebm&gir=yes&clen={1_000_000 + n}" + "&sig=" + "x" * 180,
+                'protocol': 'https', 'container': 'webm_dash', 'http_headers': {'User-Agent': 'Mozilla/5.0', 'Accept': '*/*', 'Accept-Language': 'en-us'},
+                'downloader_options': {'http_chunk_size': 10485760}, 'quality': float(n), 'has_drm': False} for n in range(18)]
+    thumbnails = [{'url': f"https://i.ytimg.com/vi/{video_id}/{name}.jpg", 'preference': -n, 'id': str(n), 'height': 90 * (n % 4 + 1), 'width': 120 * (n % 4 + 1)}
+                  for n, name in enumerate(('default', 'mqdefault', 'hqdefault', 'sddefault', 'maxresdefault') * 8)]
+    return {'id': video_id, 'title': f"【初音ミク】Bài hát số {index}", 'uploader': 'Fake Producer - Topic', 'channel_id': 'UC' + 'a' * 22,
+            'duration': 180 + index % 120, 'view_count': index * 17, 'like_count': index, 'webpage_url': f"https://www.youtube.com/watch?v={video_id}",
+            'thumbnail': f"https://i.ytimg.com/vi/{video_id}/maxresdefault.jpg", 'description': "Lời bài hát và thông tin phát hành. " * 30,
+            'tags': [f"vocaloid{n}" for n in range(15)], 'categories': ['Music'], 'formats': formats, 'thumbnails': thumbnails,
+            'url': formats[-1]['url'], 'acodec': 'opus', 'ext': 'webm', 'http_headers': formats[-1]['http_headers'], 'automatic_captions': {}, 'subtitles': {}}
+
+def measure(build) -> tuple[int, float, object]:
+    gc.collect(); tracemalloc.start(); started = time.perf_counter()
+    kept = build(); elapsed = time.perf_counter() - started
+    gc.collect(); current, _ = tracemalloc.get_traced_memory(); tracemalloc.stop()
+    return current, elapsed, kept
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--guilds', type=int, default=100); parser.add_argument('--queue', type=int, default=1000, help="Số bài mỗi guild")
+    parser.add_argument('--legacy-sample', type=int, default=2000, help="Số bài dùng để đo cách cũ")
+    args = parser.parse_args()
+    with tempfile.TemporaryDirectory() as directory:
+        fakes.setup_environment(os.path.join(directory, 'cache'), fake_ffmpeg=True)
+        from cogs import music
+
+        class LegacySong(music.Song):
+            """Mô phỏng Song cũ: có __dict__ và giữ nguyên info dict."""
+            def __init__(self, data, requester):
+                super().__init__(data, requester); self.data = data
+
+        guilds = [fakes.FakeGuild(None, 1000 + index) for index in range(args.guilds)]
+        total = args.guilds * args.queue; sample = min(args.legacy_sample, total)
+        compact, compact_time, queues = measure(lambda: [[music.Song(make_info(g * args.queue + i), guild.member) for i in range(args.queue)] for g, guild in enumerate(guilds)])
+        del queues
+        legacy, legacy_time, kept = measure(lambda: [LegacySong(make_info(i), guilds[i % len(guilds)].member) for i in range(sample)])
+        del kept
+        info_size, _, _ = measure(lambda: make_info(0))
+
+    per_compact = compact / total; per_legacy = legacy / sample
+    print(f"\n=== {args.guilds} guild x {args.queue} bài ({total} bài) ===")
+    print(f"Một info dict của yt-dlp   : ~{info_size / 1024:.1f} KiB")
+    print(f"Song gọn (__slots__)        : {per_compact:,.0f} B/bài, tổng {compact / 2**20:,.1f} MiB, tạo trong {compact_time:.2f}s")
+    print(f"Song cũ (giữ info dict)     : {per_legacy:,.0f} B/bài, ước tính {per_legacy * total / 2**20:,.1f} MiB (đo trên {sample} bài, {legacy_time:.2f}s)")
+    print(f"Tiết kiệm                   : {per_legacy / per_compact:.1f}x")
+
+if __name__ == '__main__':
+    main()
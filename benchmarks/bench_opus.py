@@ -0,0 +1,81 @@
+# benchmarks/bench_opus.py
+"""
+So sánh CPU cho mỗi luồng phát giữa đường PCM cũ (FFmpegPCMAudio + PCMVolumeTransformer + mã hóa Opus trong bot)
+và đường Opus (FFmpegOpusAudio copy nguyên gói, hoặc FFmpeg tự áp âm lượng) khi nhiều guild phát cùng lúc.
+Cần có `ffmpeg` trong PATH. Thư viện libopus là tùy chọn: nếu thiếu, đường PCM chỉ đo phần giải mã và nhân âm lượng.
+Chạy: python benchmarks/bench_opus.py [--guilds 50] [--seconds 30] [--realtime]
+"""
+
+import argparse
+import os
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+import discord
+from discord import opus
+
+FRAME_SECONDS = 0.02
+
+def make_sample(directory: str, seconds: int) -> tuple[str, str]:
+    """Tạo một file AAC (.m4a) và một file Opus (.opus) có cùng nội dung."""
+    m4a_path = os.path.join(directory, 'sample.m4a'); opus_path = os.path.join(directory, 'sample.opus')
+    tone = ['-f', 'lavfi', '-i', f'sine=frequency=440:duration={seconds}', '-f', 'lavfi', '-i', f'anoisesrc=d={seconds}:a=0.05', '-filter_complex', 'amix=inputs=2', '-ac', '2', '-ar', '48000']
+    subprocess.run(['ffmpeg', '-y', '-loglevel', 'error', *tone, '-c:a', 'aac', m4a_path], check=True)
+    subprocess.run(['ffmpeg', '-y', '-loglevel', 'error', '-i', m4a_path, '-c:a', 'libopus', '-b:a', '128k', opus_path], check=True)
+    return m4a_path, opus_path
+
+def build_source(mode: str, m4a_path: str, opus_path: str) -> discord.AudioSource:
+    if mode == 'pcm': return discord.PCMVolumeTransformer(discord.FFmpegPCMAudio(m4a_path, options='-vn'), volume=0.5)
+    if mode == 'opus-copy': return discord.FFmpegOpusAudio(opus_path, codec='copy', options='-vn')
+    return discord.FFmpegOpusAudio(opus_path, options='-vn -filter:a volume=0.500')
+
+def consume(source: discord.AudioSource, realtime: bool, frames: list):
+    """Đọc frame như AudioPlayer của discord.py: mã hóa Opus trong process nếu nguồn là PCM."""
+    encoder = opus.Encoder() if not source.is_opus() and opus.is_loaded() else None
+    next_at = time.perf_counter(); count = 0
+    while True:
+        data = source.read()
+        if not data: break
+        if encoder: encoder.encode(data, encoder.SAMPLES_PER_FRAME)
+        count += 1
+        if realtime:
+            next_at += FRAME_SECONDS; delay = next_at - time.perf_counter()
+            if delay > 0: time.sleep(delay)
+    source.cleanup(); frames.append(count)
+
+def cpu_times() -> tuple[float, float]:
+    own = resource.getrusage(resource.RUSAGE_SELF); children = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return own.ru_utime + own.ru_stime, children.ru_utime + children.ru_stime
+
+def run_mode(mode: str, guilds: int, realtime: bool, m4a_path: str, opus_path: str):
+    own_before, children_before = cpu_times(); wall_before = time.perf_counter(); frames = []
+    threads = [threading.Thread(target=consume, args=(build_source(mode, m4a_path, opus_path), realtime, frames)) for _ in range(guilds)]
+    for thread in threads: thread.start()
+    for thread in threads: thread.join()
+    own_after, children_after = cpu_times()
+    audio_minutes = sum(frames) * FRAME_SECONDS / 60
+    own = (own_after - own_before) / audio_minutes; children = (children_after - children_before) / audio_minutes
+    print(f"{mode:<12} guilds={guilds:<4} wall={time.perf_counter() - wall_before:7.2f}s  CPU bot={own:6.3f}s  CPU ffmpeg={children:6.3f}s  tổng={own + children:6.3f}s  (mỗi phút audio của một luồng)")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--guilds', type=int, default=50); parser.add_argument('--seconds', type=int, default=30)
+    parser.add_argument('--realtime', action='store_true', help="Đọc frame theo nhịp 20ms như khi phát thật")
+    parser.add_argument('--modes', nargs='+', default=['pcm', 'opus-copy', 'opus-volume'])
+    args = parser.parse_args()
+    if not shutil.which('ffmpeg'): sys.exit("Cần có ffmpeg trong PATH để chạy benchmark này.")
+    if not opus.is_loaded():
+        try: opus._load_default()
+        except Exception: pass
+    if not opus.is_loaded(): print("Cảnh báo: không tìm thấy libopus, đường PCM sẽ không tính chi phí mã hóa Opus.")
+    with tempfile.TemporaryDirectory() as directory:
+        m4a_path, opus_path = make_sample(directory, args.seconds)
+        for mode in args.modes: run_mode(mode, args.guilds, args.realtime, m4a_path, opus_path)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,66 @@
+# benchmarks/bench_queue.py
+"""
+So sánh độ trễ thao tác hàng đợi: SongQueue mới và cách cũ (rút hết asyncio.Queue rồi nạp lại).
+Chạy: python benchmarks/bench_queue.py [--sizes 100 1000 10000] [--rounds 200]
+"""
+
+import argparse
+import asyncio
+import os
+import random
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from utils.song_queue import SongQueue
+
+async def legacy_remove(queue: asyncio.Queue, index: int):
+    items = list(queue._queue); items.pop(index)
+    while not queue.empty(): queue.get_nowait()
+    for item in items: await queue.put(item)
+
+async def legacy_shuffle(queue: asyncio.Queue):
+    items = list(queue._queue); random.shuffle(items)
+    while not queue.empty(): queue.get_nowait()
+    for item in items: await queue.put(item)
+
+async def measure(func, rounds: int) -> tuple[float, float]:
+    """Trả về (trung vị, p99) tính bằng micro giây."""
+    samples = []
+    for _ in range(rounds):
+        start = time.perf_counter(); await func(); samples.append((time.perf_counter() - start) * 1e6)
+    samples.sort()
+    return statistics.median(samples), samples[min(len(samples) - 1, int(len(samples) * 0.99))]
+
+async def bench_size(size: int, rounds: int):
+    new_queue = SongQueue(); legacy_queue = asyncio.Queue()
+    for i in range(size): new_queue.put_nowait(i); await legacy_queue.put(i)
+    async def new_append_pop(): new_queue.put_nowait(-1); await new_queue.get()
+    async def new_remove(): new_queue.remove(random.randrange(len(new_queue))); new_queue.put_nowait(-1)
+    async def new_move(): new_queue.move(random.randrange(len(new_queue)), 0)
+    async def new_shuffle(): new_queue.shuffle()
+    async def new_page(): new_queue.slice(size // 2, size // 2 + 10)
+    async def legacy_remove_op(): await legacy_remove(legacy_queue, random.randrange(legacy_queue.qsize())); await legacy_queue.put(-1)
+    async def legacy_shuffle_op(): await legacy_shuffle(legacy_queue)
+    async def legacy_page(): list(legacy_queue._queue)[size // 2:size // 2 + 10]
+    cases = [
+        ("append+pop", new_append_pop, None), ("remove(i)", new_remove, legacy_remove_op),
+        ("move(i, 0)", new_move, None), ("shuffle", new_shuffle, legacy_shuffle_op), ("page slice", new_page, legacy_page),
+    ]
+    for name, new_func, legacy_func in cases:
+        new_median, new_p99 = await measure(new_func, rounds)
+        line = f"{size:>7} {name:<12} SongQueue p50={new_median:10.1f}us p99={new_p99:10.1f}us"
+        if legacy_func:
+            legacy_median, legacy_p99 = await measure(legacy_func, rounds)
+            line += f" | cũ p50={legacy_median:10.1f}us p99={legacy_p99:10.1f}us"
+        print(line)
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', type=int, nargs='+', default=[100, 1000, 10000]); parser.add_argument('--rounds', type=int, default=200)
+    args = parser.parse_args()
+    for size in args.sizes: await bench_size(size, args.rounds)
+
+if __name__ == '__main__':
+    asyncio.run(main())
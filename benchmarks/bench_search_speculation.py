@@ -0,0 +1,71 @@
+# benchmarks/bench_search_speculation.py
+"""
+Đo việc tải trước kết quả tìm kiếm: `--guilds` người dùng lần lượt (cách nhau `--arrival` giây) gõ `play <tên bài>`, suy nghĩ `--think` giây rồi chọn một kết quả
+(phần lớn chọn một trong hai kết quả đầu). So sánh thời gian từ lúc chọn tới khi nghe được âm thanh khi tắt và bật tải trước,
+kèm tỉ lệ trúng, số lượt tải bỏ đi và dung lượng cache còn lại sau khi đóng các bảng.
+Chạy: python benchmarks/bench_search_speculation.py [--guilds 10] [--arrival 1] [--concurrency 2] [--think 1,4] [--download-delay 1.5]
+"""
+
+import argparse
+import asyncio
+import os
+import random
+import tempfile
+import time
+
+import fakes
+
+RESULTS = ('started', 'skipped', 'hit', 'partial', 'miss', 'wasted')
+
+def pick_index(rng: random.Random) -> int:
+    roll = rng.random(); return 0 if roll < 0.6 else 1 if roll < 0.85 else rng.randint(2, 6)
+
+async def user(cog, music, guild, query: str, rng: random.Random, think: tuple[float, float], picked_at: dict, delay: float):
+    await asyncio.sleep(delay); ctx = fakes.FakeContext(guild); await cog._play_logic(ctx, query); view = guild.text_channel.last_message.view # Bảng kết quả là tin nhắn cuối
+    await asyncio.sleep(rng.uniform(*think))
+    picked_at[guild.id] = time.perf_counter(); await view.select_callback(fakes.FakeInteraction(guild, [str(pick_index(rng))]))
+
+async def run_mode(args, music, speculate: int):
+    music.SEARCH_SPECULATE = speculate; rng = random.Random(11)
+    bot = fakes.FakeBot(); cog = music.MainCog(bot); bot.cog = cog
+    before = {result: music.SPECULATION.value(result) for result in RESULTS}; picked_at = {}
+    guilds = [bot.add_guild(1000 + index) for index in range(args.guilds)]
+    await asyncio.gather(*(user(cog, music, guild, f"bài hát {speculate} {guild.id}", rng, args.think, picked_at, index * args.arrival) for index, guild in enumerate(guilds)))
+    deadline = time.perf_counter() + 30
+    while len(bot.recorder.first_audio_at) < len(guilds) and time.perf_counter() < deadline: await asyncio.sleep(0.05)
+    waits = sorted(bot.recorder.first_audio_at[g.id] - picked_at[g.id] for g in guilds if g.id in bot.recorder.first_audio_at)
+    counts = {result: int(music.SPECULATION.value(result) - before[result]) for result in RESULTS}
+    for state in list(cog.states.values()): await state.cleanup()
+    await asyncio.sleep(0.2)
+    cached = len(music.AUDIO_CACHE); cache_bytes = music.AUDIO_CACHE.stats()['bytes']
+    for video_id in list(music.AUDIO_CACHE._entries): music.AUDIO_CACHE.discard(video_id) # Chế độ sau bắt đầu với cache trống
+    await cog.session.close()
+
+    picks = counts['hit'] + counts['partial'] + counts['miss']; pick = lambda p: waits[min(len(waits) - 1, int(p * len(waits)))] * 1000
+    print(f"\n--- Tải trước {speculate} kết quả đầu ---" if speculate else "\n--- Không tải trước ---")
+    print(f"Chọn bài -> nghe được: p50={pick(0.5):7.0f}ms  p95={pick(0.95):7.0f}ms  max={waits[-1] * 1000:7.0f}ms  (n={len(waits)})")
+    if speculate:
+        print(f"Tải trước            : {counts['started']} lượt, bỏ qua {counts['skipped']} | khi chọn: hit {counts['hit']}, partial {counts['partial']}, miss {counts['miss']} "
+              f"(tỉ lệ trúng {counts['hit'] / max(1, picks):.0%}) | tải bỏ đi {counts['wasted']}")
+    print(f"Cache sau khi dọn    : {cached} file, {cache_bytes / 2**20:.1f} MiB | dung lượng còn giữ chỗ {music.SearchView.speculative_bytes} B")
+
+async def run(args, music):
+    print(f"=== {args.guilds} người tìm bài (cách nhau {args.arrival:.1f}s), suy nghĩ {args.think[0]:.0f}-{args.think[1]:.0f}s, tải mỗi bài {args.download_delay:.1f}s ===")
+    await run_mode(args, music, 0); await run_mode(args, music, args.speculate)
+    music.EXTRACTOR.shutdown()
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--guilds', type=int, default=10); parser.add_argument('--arrival', type=float, default=1.0); parser.add_argument('--concurrency', type=int, default=2, help="MIKU_SEARCH_SPECULATE_CONCURRENCY"); parser.add_argument('--speculate', type=int, default=2)
+    parser.add_argument('--think', type=lambda v: tuple(float(x) for x in v.split(',')), default=(1.0, 4.0), help="Khoảng thời gian suy nghĩ (giây), vd: 1,4")
+    parser.add_argument('--download-delay', type=float, default=1.5); parser.add_argument('--tracks', type=int, default=150)
+    args = parser.parse_args()
+    with tempfile.TemporaryDirectory() as directory:
+        fakes.setup_environment(os.path.join(directory, 'cache'), fake_ffmpeg=True, MIKU_GAPLESS='0', MIKU_SEARCH_SPECULATE_CONCURRENCY=str(args.concurrency), MIKU_EXTRACT_MAX_PENDING=str(args.guilds * 8))
+        os.makedirs(os.path.join(directory, 'cache')); fakes.install_fake_ffmpeg()
+        from cogs import music
+        extractor = fakes.FakeExtractor(os.path.join(directory, 'source'), args.tracks, 2.0, 0.3, args.download_delay, 0.4); extractor.install(music)
+        asyncio.run(run(args, music))
+
+if __name__ == '__main__':
+    main()
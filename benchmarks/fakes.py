@@ -0,0 +1,284 @@
+# benchmarks/fakes.py
+"""
+Các đối tượng giả để chạy MainCog/GuildState mà không cần token Discord hay mạng:
+yt-dlp giả phục vụ file WAV tự sinh (có độ trễ cấu hình được), VoiceClient giả đọc frame theo nhịp 20ms,
+và (khi không có ffmpeg) các nguồn đọc thẳng file WAV thay cho FFmpegPCMAudio/FFmpegOpusAudio.
+Gọi `setup_environment()` TRƯỚC khi import cogs.music vì cog đọc cấu hình từ biến môi trường lúc import.
+"""
+
+import asyncio
+import contextlib
+import math
+import os
+import re
+import shlex
+import shutil
+import struct
+import sys
+import threading
+import time
+import wave
+import zlib
+from typing import Callable, Optional
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import discord
+from discord import opus
+
+SAMPLE_RATE = 48000
+FRAME_SAMPLES = 960 # 20ms, đúng như discord.py
+FRAME_BYTES = FRAME_SAMPLES * 2 * 2
+
+def setup_environment(cache_dir: str, fake_ffmpeg: bool, **overrides: str):
+    """Cấu hình cog cho benchmark: cache riêng, không lưu phiên, không phân tích độ to (cần ffmpeg)."""
+    env = {'MIKU_CACHE_DIR': cache_dir, 'MIKU_STATE_DIR': os.path.join(os.path.dirname(cache_dir), 'state'), 'MIKU_SESSION_PERSIST': '0', 'MIKU_LOUDNESS': '0', 'MIKU_METRICS_PORT': '0', 'MIKU_PLAYBACK_MODE': 'download'}
+    if fake_ffmpeg: env['MIKU_OPUS_PASSTHROUGH'] = '0' # Nguồn giả chỉ xuất PCM
+    env.update(overrides); os.environ.update(env)
+
+def make_wav(path: str, seconds: float, frequency: float = 440.0):
+    """Sinh file WAV 48kHz stereo 16-bit (định dạng mà nguồn PCM giả đọc được)."""
+    frame = bytearray()
+    period = int(SAMPLE_RATE / frequency) or 1
+    for i in range(period):
+        sample = int(8000 * math.sin(2 * math.pi * i / period)); frame += struct.pack('<hh', sample, sample)
+    total = int(seconds * SAMPLE_RATE); data = bytes(frame) * (total // period + 1)
+    with wave.open(path, 'wb') as wf:
+        wf.setnchannels(2); wf.setsampwidth(2); wf.setframerate(SAMPLE_RATE); wf.writeframes(data[:total * 4])
+
+# === yt-dlp giả ===
+class FakeExtractor:
+    """Thay `utils.ytdl.extract_info`. Chạy trên thread của scheduler như thật, `time.sleep` mô phỏng thời gian chờ mạng."""
+    def __init__(self, source_dir: str, tracks: int = 20, track_seconds: float = 3.0, info_delay: float = 0.2, download_delay: float = 0.5, search_delay: float = 0.4):
+        self.source_dir = source_dir; self.tracks = tracks; self.track_seconds = track_seconds
+        self.info_delay = info_delay; self.download_delay = download_delay; self.search_delay = search_delay
+        self.calls = {'info': 0, 'download': 0, 'search': 0}; self._lock = threading.Lock()
+        os.makedirs(source_dir, exist_ok=True)
+        for index in range(tracks): make_wav(self.source_path(self.track_id(index)), track_seconds, 220 + 20 * index)
+
+    @staticmethod
+    def track_id(index: int) -> str: return f"fake{index:07d}"
+    def url(self, index: int) -> str: return f"https://www.youtube.com/watch?v={self.track_id(index % self.tracks)}"
+    def source_path(self, video_id: str) -> str: return os.path.join(self.source_dir, f"{video_id}.wav")
+
+    def info(self, video_id: str) -> dict:
+        return {'id': video_id, 'title': f"Fake track {video_id}", 'duration': self.track_seconds, 'uploader': 'Fake Uploader', 'thumbnail': None,
+                'webpage_url': f"https://www.youtube.com/watch?v={video_id}", 'url': self.source_path(video_id), 'acodec': 'pcm_s16le', 'ext': 'wav', 'http_headers': {}}
+
+    def extract_info(self, options: dict, url: str, download: bool = False) -> Optional[dict]:
+        match = re.search(r'v=([\w-]+)', url)
+        if not match:
+            with self._lock: self.calls['search'] += 1
+            time.sleep(self.search_delay)
+            return {'entries': [self.info(self.track_id((abs(hash(url)) + i) % self.tracks)) for i in range(7)]}
+        data = self.info(match.group(1))
+        with self._lock: self.calls['download' if download else 'info'] += 1
+        time.sleep(self.download_delay if download else self.info_delay)
+        if download:
+            target = options['outtmpl'] % {'id': data['id'], 'ext': 'wav'}
+            shutil.copyfile(data['url'], target); data['_filename'] = target
+        return data
+
+    def install(self, music_module):
+        music_module.ytdl.extract_info = self.extract_info
+
+# === FFmpeg giả ===
+class WavPCMAudio(discord.AudioSource):
+    """
+    Đọc file WAV theo từng frame 20ms, nhận cùng tham số với FFmpegPCMAudio (chỉ dùng `-ss`).
+    `startup_delay` giả lập thời gian FFmpeg khởi động trước khi ra frame đầu tiên.
+    """
+    startup_delay = 0.0
+    def __init__(self, source: str, *, before_options: Optional[str] = None, options: Optional[str] = None, **kwargs):
+        args = shlex.split(before_options or ''); start_at = float(args[args.index('-ss') + 1]) if '-ss' in args else 0.0
+        self._wave = wave.open(source, 'rb'); self._wave.setpos(min(self._wave.getnframes(), int(start_at * SAMPLE_RATE))); self._started = False
+    def read(self) -> bytes:
+        if not self._started: self._started = True; time.sleep(self.startup_delay)
+        data = self._wave.readframes(FRAME_SAMPLES)
+        return data if len(data) == FRAME_BYTES else b''
+    def is_opus(self) -> bool: return False
+    def cleanup(self):
+        if self._wave: self._wave.close(); self._wave = None
+
+class WavOpusAudio(WavPCMAudio):
+    """
+    Thay FFmpegOpusAudio: đọc WAV rồi mã hóa từng frame như FFmpeg. Không có libopus thì nén zlib để giả lập chi phí mã hóa.
+    `opened` và `encoded` đếm số luồng FFmpeg đã mở và số frame đã mã hóa (trên mọi luồng).
+    """
+    opened = 0; encoded = 0; _lock = threading.Lock()
+    def __init__(self, source: str, **kwargs):
+        super().__init__(source, **kwargs); self._encoder = opus.Encoder() if opus.is_loaded() else None
+        with WavOpusAudio._lock: WavOpusAudio.opened += 1
+    def read(self) -> bytes:
+        data = super().read()
+        if not data: return b''
+        with WavOpusAudio._lock: WavOpusAudio.encoded += 1
+        return self._encoder.encode(data, self._encoder.SAMPLES_PER_FRAME) if self._encoder else zlib.compress(data, 6)
+    def is_opus(self) -> bool: return True
+
+def install_fake_ffmpeg(startup_delay: float = 0.0):
+    WavPCMAudio.startup_delay = startup_delay; discord.FFmpegPCMAudio = WavPCMAudio; discord.FFmpegOpusAudio = WavOpusAudio
+
+# === Discord giả ===
+class PlaybackRecorder:
+    """Ghi lại mốc thời gian frame đầu/cuối của từng bài để tính thời gian tới âm thanh đầu tiên và khoảng lặng khi chuyển bài."""
+    def __init__(self):
+        self.first_audio_at: dict[int, float] = {}; self.gaps: list[float] = []; self.frames = 0; self.tracks_finished: dict[int, int] = {}
+        self._last_end: dict[int, float] = {}; self._lock = threading.Lock()
+    def on_first_frame(self, guild_id: int, now: float):
+        with self._lock:
+            self.first_audio_at.setdefault(guild_id, now)
+            ended = self._last_end.pop(guild_id, None)
+            if ended is not None: self.gaps.append(now - ended)
+    def on_track_end(self, guild_id: int, now: float, natural: bool, frames: int):
+        with self._lock:
+            self.frames += frames
+            if natural: self._last_end[guild_id] = now; self.tracks_finished[guild_id] = self.tracks_finished.get(guild_id, 0) + 1
+            else: self._last_end.pop(guild_id, None) # Bỏ qua/tua không tính là khoảng lặng giữa hai bài
+
+class _FakePlayer(threading.Thread):
+    def __init__(self, client: 'FakeVoiceClient', source: discord.AudioSource, after: Optional[Callable]):
+        super().__init__(daemon=True, name=f"fake-voice-{client.guild.id}")
+        self.client = client; self.source = source; self.after = after; self.end = threading.Event(); self.resumed = threading.Event(); self.resumed.set()
+    def run(self):
+        client = self.client; recorder = client.recorder; speed = client.speed; error = None; frames = 0; natural = False
+        encoder = opus.Encoder() if opus.is_loaded() and not self.source.is_opus() else None
+        next_at = time.perf_counter()
+        try:
+            while not self.end.is_set():
+                if not self.resumed.is_set():
+                    self.resumed.wait(); next_at = time.perf_counter(); continue
+                track = getattr(self.source, 'current', None); read_at = time.perf_counter(); data = self.source.read()
+                if not data: natural = True; self.end.set(); break # AudioPlayer cũng tự stop() khi hết dữ liệu
+                if track is not None and self.source.current is not track:
+                    # TrackChain (gapless) đã nối sang bài mới trong lần read() này: khoảng lặng chính là thời gian của lần read() đó
+                    recorder.on_track_end(client.guild.id, read_at, True, frames); frames = 0
+                if frames == 0: recorder.on_first_frame(client.guild.id, time.perf_counter())
+                if encoder: encoder.encode(data, encoder.SAMPLES_PER_FRAME) # Như AudioPlayer của discord.py
+                frames += 1; next_at += 0.02 / speed; delay = next_at - time.perf_counter()
+                if delay > 0: self.end.wait(delay)
+        except Exception as e: error = e
+        finally:
+            recorder.on_track_end(client.guild.id, time.perf_counter(), natural, frames); self.source.cleanup()
+            if self.after: self.after(error)
+    def is_playing(self) -> bool: return self.resumed.is_set() and not self.end.is_set()
+
+class FakeVoiceClient:
+    """Giống VoiceClient ở những gì GuildState dùng: play/stop/pause/resume và trạng thái kết nối."""
+    def __init__(self, channel: 'FakeVoiceChannel', recorder: PlaybackRecorder, speed: float = 1.0):
+        self.channel = channel; self.guild = channel.guild; self.recorder = recorder; self.speed = speed
+        self._player: _FakePlayer | None = None; self._connected = True
+    def is_connected(self) -> bool: return self._connected
+    def is_playing(self) -> bool: return self._player is not None and self._player.is_playing()
+    def is_paused(self) -> bool: return self._player is not None and not self._player.end.is_set() and not self._player.resumed.is_set()
+    def play(self, source: discord.AudioSource, *, after: Optional[Callable] = None, **kwargs):
+        if self.is_playing(): raise discord.ClientException('Already playing audio.')
+        self._player = _FakePlayer(self, source, after); self._player.start()
+    def stop(self):
+        if self._player: self._player.end.set(); self._player.resumed.set(); self._player = None
+    def pause(self):
+        if self._player: self._player.resumed.clear()
+    def resume(self):
+        if self._player: self._player.resumed.set()
+    async def move_to(self, channel): self.channel = channel
+    async def disconnect(self, *, force: bool = False):
+        self.stop(); self._connected = False
+        if self.guild.voice_client is self: self.guild.voice_client = None
+        if self in self.guild.bot.voice_clients: self.guild.bot.voice_clients.remove(self)
+
+class FakeMessage:
+    _next_id = 1
+    def __init__(self, channel: 'FakeTextChannel', content=None, embed=None, view=None):
+        self.id = FakeMessage._next_id; FakeMessage._next_id += 1; self.channel = channel; self.content = content; self.embed = embed; self.view = view
+    async def edit(self, **kwargs): self.channel.edits += 1
+    async def delete(self): self.channel.deletes += 1
+    async def add_reaction(self, emoji): pass
+    async def remove_reaction(self, emoji, member): pass
+
+class FakeTextChannel:
+    def __init__(self, guild: 'FakeGuild'):
+        self.guild = guild; self.id = guild.id * 10 + 1; self.last_message_id = None; self.last_message = None; self.sends = 0; self.edits = 0; self.deletes = 0
+    async def send(self, content=None, *, embed=None, view=None, **kwargs) -> FakeMessage:
+        message = FakeMessage(self, content, embed, view); self.last_message_id = message.id; self.last_message = message; self.sends += 1; return message
+
+class FakeVoiceChannel:
+    def __init__(self, guild: 'FakeGuild'):
+        self.guild = guild; self.id = guild.id * 10 + 2; self.name = f"voice{guild.id}"; self.members = []
+    async def connect(self, **kwargs) -> FakeVoiceClient:
+        await asyncio.sleep(self.guild.bot.connect_delay)
+        client = FakeVoiceClient(self, self.guild.bot.recorder, self.guild.bot.speed)
+        self.guild.voice_client = client; self.guild.bot.voice_clients.append(client); return client
+
+class FakeMember(discord.Member):
+    """discord.Member thật (để các kiểm tra isinstance trong cog vẫn đúng) nhưng không cần dữ liệu từ gateway."""
+    def __init__(self, guild: 'FakeGuild', user_id: int, voice_channel: FakeVoiceChannel):
+        self.guild = guild; self._fake_id = user_id; self._fake_voice = type('VoiceState', (), {'channel': voice_channel})()
+    @property
+    def id(self) -> int: return self._fake_id
+    @property
+    def mention(self) -> str: return f"<@{self._fake_id}>"
+    @property
+    def display_name(self) -> str: return f"user{self._fake_id}"
+    @property
+    def voice(self): return self._fake_voice
+    @property
+    def display_avatar(self): return type('Asset', (), {'url': ''})()
+
+class FakeGuild:
+    def __init__(self, bot: 'FakeBot', guild_id: int):
+        self.bot = bot; self.id = guild_id; self.name = f"guild{guild_id}"; self.voice_client = None
+        self.text_channel = FakeTextChannel(self); self.voice_channel = FakeVoiceChannel(self)
+        self.me = self.member = FakeMember(self, guild_id * 100, self.voice_channel)
+    def get_member(self, user_id: int): return self.member if user_id == self.member.id else None
+    def get_channel(self, channel_id: int):
+        return {self.text_channel.id: self.text_channel, self.voice_channel.id: self.voice_channel}.get(channel_id)
+
+class FakeContext:
+    """Đủ cho các hàm `_xxx_logic` của MainCog: không phải Context hay Interaction nên phản hồi đi qua `ctx.send`."""
+    def __init__(self, guild: FakeGuild):
+        self.guild = guild; self.author = self.user = guild.member; self.channel = guild.text_channel; self.message = FakeMessage(guild.text_channel)
+    async def send(self, *args, **kwargs): return await self.channel.send(*args, **kwargs)
+    def typing(self): return contextlib.nullcontext()
+
+class FakeInteraction:
+    """Đủ cho callback của các View (vd: chọn một mục trong SearchView): người bấm, guild và giá trị đã chọn."""
+    def __init__(self, guild: FakeGuild, values: list[str] = ()):
+        self.guild = guild; self.guild_id = guild.id; self.user = guild.member; self.data = {'values': list(values)}
+        self.response = type('Response', (), {'defer': staticmethod(lambda *a, **k: asyncio.sleep(0)), 'send_message': staticmethod(lambda *a, **k: asyncio.sleep(0))})()
+
+class FakeBot:
+    """Những gì GuildState/MainCog cần từ commands.Bot."""
+    def __init__(self, speed: float = 1.0, connect_delay: float = 0.05):
+        self.loop = asyncio.get_running_loop(); self.speed = speed; self.connect_delay = connect_delay; self.recorder = PlaybackRecorder()
+        self.user = type('User', (), {'name': 'Miku', 'display_avatar': type('Asset', (), {'url': ''})()})()
+        self.voice_clients: list[FakeVoiceClient] = []; self.guilds: dict[int, FakeGuild] = {}; self.cog = None; self.latency = 0.0
+    async def wait_until_ready(self): return
+    def is_closed(self) -> bool: return False
+    def get_guild(self, guild_id: int): return self.guilds.get(guild_id)
+    def add_guild(self, guild_id: int) -> FakeGuild:
+        guild = self.guilds[guild_id] = FakeGuild(self, guild_id); return guild
+    def dispatch(self, event: str, *args):
+        listener = getattr(self.cog, f"on_{event}", None)
+        if listener: asyncio.ensure_future(listener(*args))
+
+# === Gemini giả ===
+class FakeResponse:
+    def __init__(self, text: str): self.text = text
+
+class FakeGenerativeModel:
+    """Thay `genai.GenerativeModel`: trả lời sau `delay` giây và đếm số lần gọi. Tiêu đề có chữ "unknown" thì trả lời "không tìm thấy"."""
+    def __init__(self, delay: float = 1.0):
+        self.delay = delay; self.calls = 0; self.history_sizes: list[int] = []
+    async def generate_content_async(self, prompt: str) -> FakeResponse:
+        self.calls += 1; await asyncio.sleep(self.delay)
+        if 'unknown' in prompt.lower(): return FakeResponse("I'm sorry, I cannot find the lyrics for this song.")
+        return FakeResponse(f"La la la ({len(prompt)})\n" * 20)
+    def start_chat(self, history: list[dict]) -> 'FakeChatSession': return FakeChatSession(self, history)
+
+class FakeChatSession:
+    """Thay `genai.ChatSession`: ghi lại kích thước lịch sử được gửi kèm mỗi tin nhắn."""
+    def __init__(self, model: FakeGenerativeModel, history: list[dict]): self.model = model; self.history = history
+    async def send_message_async(self, message: str) -> FakeResponse:
+        self.model.calls += 1; self.model.history_sizes.append(sum(len(part) for entry in self.history for part in entry['parts']))
+        await asyncio.sleep(self.model.delay)
+        return FakeResponse(f"Miku trả lời: {message} (´• ω •`) ♡ " * 3)
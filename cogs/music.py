@@ -4,90 +4,294 @@ import discord
 from discord import app_commands
 from discord.ext import commands
 import asyncio
-import yt_dlp
+import audioop # discord.py cũng dùng để chỉnh âm lượng PCM (gói audioop-lts từ Python 3.13)
 import functools
+import json
 from enum import Enum
 import math
 import logging
 import os
-import random
+import shlex
+import threading
+import time
 import aiohttp
 import re
-from typing import Union, Optional
+from typing import Callable, Union, Optional
 import google.generativeai as genai
+from utils.audio_cache import AudioCache, extract_video_id
+from utils.broadcast import BroadcastHub
+from utils.chat_sessions import ChatSessionManager
+from utils import loudness
+from utils.lyrics_store import LyricsStore
+from utils import metrics
+from utils.prefetch import Prefetcher
+from utils.render import RenderScheduler
+from utils.song_queue import SongQueue
+from utils.ttl_cache import TTLCache
+from utils import ytdl
+from utils.scheduler import ExtractionScheduler, Priority, SchedulerBusy
+from utils.session_store import SessionStore
+from utils.timers import TimerWheel
+from utils.track_index import TrackIndex
 
 # === CONSTANTS & HELPERS ===
 log = logging.getLogger(__name__)
 AnyContext = Union[commands.Context, discord.Interaction]
+CACHE_DIR = os.getenv('MIKU_CACHE_DIR', 'cache') # Mỗi worker trong chế độ cluster dùng một thư mục riêng
+STATE_DIR = os.getenv('MIKU_STATE_DIR', 'data') # Dữ liệu cần giữ qua các lần khởi động; không để trong CACHE_DIR vì AudioCache xóa mọi file lạ ở đó
 YTDL_SEARCH_OPTIONS = {'format':'bestaudio/best','noplaylist':True,'nocheckcertificate':True,'ignoreerrors':False,'logtostderr':False,'quiet':True,'no_warnings':True,'default_search':'ytsearch7','source_address':'0.0.0.0','extract_flat':'search'}
-YTDL_DOWNLOAD_OPTIONS = {'format':'bestaudio[ext=m4a]/bestaudio/best','outtmpl':'cache/%(id)s.%(ext)s','restrictfilenames':True,'noplaylist':True,'nocheckcertificate':True,'ignoreerrors':False,'logtostderr':False,'quiet':True,'no_warnings':True,'source_address':'0.0.0.0','cachedir':False}
+YTDL_DOWNLOAD_OPTIONS = {'format':'bestaudio[ext=m4a]/bestaudio/best','outtmpl':os.path.join(CACHE_DIR, '%(id)s.%(ext)s'),'restrictfilenames':True,'noplaylist':True,'nocheckcertificate':True,'ignoreerrors':False,'logtostderr':False,'quiet':True,'no_warnings':True,'source_address':'0.0.0.0','cachedir':False}
+OPUS_PASSTHROUGH = os.getenv('MIKU_OPUS_PASSTHROUGH', '1') == '1'
+if OPUS_PASSTHROUGH:
+    # Ưu tiên nguồn Opus có sẵn; nếu không có thì chuyển một lần sang .opus lúc tải, để khi phát chỉ cần copy gói Opus
+    YTDL_DOWNLOAD_OPTIONS = {**YTDL_DOWNLOAD_OPTIONS, 'format':'bestaudio[acodec=opus]/bestaudio[ext=webm]/bestaudio[ext=m4a]/bestaudio/best', 'postprocessors':[{'key':'FFmpegExtractAudio','preferredcodec':'opus'}]}
+DEFAULT_VOLUME = int(os.getenv('MIKU_DEFAULT_VOLUME', '50')) / 100
+YTDL_STREAM_OPTIONS = {'format':'bestaudio/best','noplaylist':True,'nocheckcertificate':True,'ignoreerrors':False,'logtostderr':False,'quiet':True,'no_warnings':True,'source_address':'0.0.0.0','cachedir':False}
+YTDL_PLAYLIST_OPTIONS = {'extract_flat':'in_playlist','noplaylist':False,'nocheckcertificate':True,'ignoreerrors':True,'logtostderr':False,'quiet':True,'no_warnings':True,'source_address':'0.0.0.0','cachedir':False}
 FFMPEG_OPTIONS = {'before_options':'','options':'-vn'}
+FFMPEG_STREAM_BEFORE_OPTIONS = '-reconnect 1 -reconnect_streamed 1 -reconnect_on_network_error 1 -reconnect_delay_max 5'
+STREAM_BY_DEFAULT = os.getenv('MIKU_PLAYBACK_MODE', 'download').lower() == 'stream'
+STREAM_URL_TTL = 3600 # Link media trực tiếp của YouTube hết hạn sau vài giờ, lấy lại sớm cho an toàn
+CACHE_MAX_BYTES = int(os.getenv('MIKU_CACHE_MAX_MB', '2048')) * 1024 * 1024
+LOUDNESS_ENABLED = os.getenv('MIKU_LOUDNESS', '1') == '1'
+LOUDNESS = loudness.LoudnessAnalyzer(float(os.getenv('MIKU_LOUDNESS_TARGET', '-14')), float(os.getenv('MIKU_LOUDNESS_MAX_GAIN', '12')))
+AUDIO_CACHE = AudioCache(CACHE_DIR, CACHE_MAX_BYTES, sidecar_suffixes=(loudness.SIDECAR_SUFFIX,), on_remove=LOUDNESS.forget)
+SEARCH_CACHE = TTLCache(int(os.getenv('MIKU_SEARCH_CACHE_SIZE', '512')), float(os.getenv('MIKU_SEARCH_CACHE_TTL', '600')))
+EXTRACTOR = ExtractionScheduler(int(os.getenv('MIKU_EXTRACT_WORKERS', '4')), int(os.getenv('MIKU_EXTRACT_MAX_PENDING', '64')), int(os.getenv('MIKU_EXTRACT_MAX_PENDING_PER_GUILD', '8')), use_processes=os.getenv('MIKU_EXTRACT_PROCESSES', '0') == '1')
+PLAYLIST_PAGE_SIZE = 25
+PLAYLIST_MAX_TRACKS = int(os.getenv('MIKU_PLAYLIST_MAX_TRACKS', '500'))
+UNAVAILABLE_TITLES = ('[Private video]', '[Deleted video]')
+PREFETCH_DEPTH = int(os.getenv('MIKU_PREFETCH_DEPTH', '2'))
+PREFETCH_SEMAPHORE = asyncio.Semaphore(int(os.getenv('MIKU_PREFETCH_CONCURRENCY', '4')))
+SESSIONS = SessionStore(os.path.join(STATE_DIR, 'sessions.sqlite3'), max_age=float(os.getenv('MIKU_SESSION_MAX_AGE', '86400'))) if os.getenv('MIKU_SESSION_PERSIST', '1') == '1' else None
+NOW_PLAYING_MIN_INTERVAL = float(os.getenv('MIKU_NOW_PLAYING_INTERVAL', '2')) # Tối thiểu giữa hai lần sửa bảng Now Playing của một guild
+CHAT_MAX_TOKENS = int(os.getenv('MIKU_CHAT_MAX_TOKENS', '2000')) # Ngân sách lịch sử trò chuyện mỗi guild (ước lượng), không tính persona
+CHAT_TTL = float(os.getenv('MIKU_CHAT_TTL', '1800'))
+CHAT_MAX_SESSIONS = int(os.getenv('MIKU_CHAT_MAX_SESSIONS', '500'))
+CHAT_SUMMARIZE = os.getenv('MIKU_CHAT_SUMMARIZE', '1') == '1'
+LYRICS = LyricsStore(os.path.join(STATE_DIR, 'lyrics.sqlite3'), int(os.getenv('MIKU_LYRICS_CACHE_SIZE', '2000')), float(os.getenv('MIKU_LYRICS_NOT_FOUND_TTL', '21600')))
+TRACKS = TrackIndex(os.path.join(STATE_DIR, 'tracks.sqlite3'), int(os.getenv('MIKU_TRACK_INDEX_SIZE', '20000'))) # Danh mục bài đã biết cho autocomplete
+AUTOCOMPLETE_TIMEOUT = 2.0 # Discord chỉ chờ autocomplete 3 giây
+TIMERS = TimerWheel() # Mọi hạn chờ theo guild dùng chung một task đánh thức
+ALONE_TIMEOUT = float(os.getenv('MIKU_ALONE_TIMEOUT', '900')) # Giây ở một mình trong kênh thoại trước khi tự rời đi
+IDLE_TIMEOUT = float(os.getenv('MIKU_IDLE_TIMEOUT', '300')) # Giây hàng đợi trống trước khi tự ngắt kết nối
+SEARCH_VIEW_TIMEOUT = 180.0
+SEARCH_SPECULATE = int(os.getenv('MIKU_SEARCH_SPECULATE', '2')) # Số kết quả đầu được tải trước trong lúc bảng tìm kiếm đang mở (0 = tắt)
+SPECULATE_SEMAPHORE = asyncio.Semaphore(int(os.getenv('MIKU_SEARCH_SPECULATE_CONCURRENCY', '2')))
+SPECULATE_MAX_BYTES = int(os.getenv('MIKU_SEARCH_SPECULATE_MB', '200')) * 1024 * 1024 # Tổng dung lượng tải trước của mọi bảng tìm kiếm đang mở
+SPECULATE_MAX_SECONDS = 900 # Bài dài hơn (mix, livestream) không được tải trước
+SPECULATE_BYTES_PER_SECOND = 24 * 1024 # Ước lượng dung lượng theo thời lượng (~192 kbps) để giữ chỗ trước khi tải
+SPECULATE_MIN_IDLE_WORKERS = int(os.getenv('MIKU_SEARCH_SPECULATE_MIN_IDLE', '3')) # Số worker yt-dlp phải đang rảnh thì mới tải trước (chừa chỗ cho yêu cầu tương tác)
+GAPLESS = os.getenv('MIKU_GAPLESS', '1') == '1' # Mở sẵn bài kế tiếp và chuyển bài ngay trong luồng audio
+GAPLESS_PREROLL = float(os.getenv('MIKU_GAPLESS_PREROLL', '5')) # Mở sẵn bài kế tiếp khi bài hiện tại còn bấy nhiêu giây
+CROSSFADE_SECONDS = float(os.getenv('MIKU_CROSSFADE', '0')) # Chỉ dùng được khi phát PCM (MIKU_OPUS_PASSTHROUGH=0)
+BROADCASTS = BroadcastHub(float(os.getenv('MIKU_BROADCAST_BUFFER', '10'))) # Các guild nghe cùng một radio dùng chung một FFmpeg và bộ mã hóa
+SESSION_CHECKPOINT_INTERVAL = 15 # Giây giữa hai lần lưu vị trí phát của các guild đang phát
+RESUME_WAIT = 2.0 # Lệnh đầu tiên sau khởi động chờ phiên cũ vào lại kênh thoại tối đa bấy nhiêu giây (Discord chờ phản hồi 3 giây)
+METRICS_PORT = int(os.getenv('MIKU_METRICS_PORT', '0')) # 0 = tắt endpoint /metrics
+METRICS_HOST = os.getenv('MIKU_METRICS_HOST', '127.0.0.1')
+STAGE_SECONDS = metrics.REGISTRY.histogram('miku_stage_seconds', 'Thời gian của từng giai đoạn (search, resolve, download, voice_connect, play_command, prepare, ffmpeg_spawn, preroll, song_start, seek)', ('stage',))
+SONG_EVENTS = metrics.REGISTRY.counter('miku_song_events', 'Số sự kiện phát nhạc theo loại (started, gapless, failed, stream_failed)', ('event',))
+SPECULATION = metrics.REGISTRY.counter('miku_search_speculation', 'Tải trước kết quả tìm kiếm (started, skipped; khi chọn: hit, partial, miss; wasted = tải trước mà không được chọn)', ('result',))
 class LoopMode(Enum): OFF = 0; SONG = 1; QUEUE = 2
 
 # === DATA CLASSES ===
+SONG_INFO_FIELDS = ('id', 'webpage_url', 'url', 'title', 'duration', 'uploader', 'thumbnail')
+def compact_info(data: dict) -> dict:
+    """Chỉ giữ các trường Song dùng từ info dict của yt-dlp (bỏ formats, thumbnails, headers... vốn chiếm hàng chục KB)."""
+    return {key: data[key] for key in SONG_INFO_FIELDS if data.get(key) is not None}
+
 class Song:
-    """Đại diện cho một bài hát."""
+    """
+    Đại diện cho một bài hát. `filepath` là None cho tới khi file đã có trong cache.
+    Chỉ giữ vài trường cần dùng chứ không giữ cả info dict của yt-dlp; khi cần đầy đủ thì gọi `fetch_info()`.
+    """
+    __slots__ = ('requester', 'url', 'title', 'thumbnail', 'duration', 'uploader', 'filepath', 'id', 'guild_id', '_download_task',
+                 'stream', 'stream_url', 'stream_headers', 'stream_codec', 'stream_resolved_at', 'resume_at', 'radio')
     def __init__(self, data, requester: discord.Member | discord.User):
-        self.requester = requester; self.data = data; self.url = data.get('webpage_url') or data.get('url')
+        self.requester = requester; self.url = data.get('webpage_url') or data.get('url')
         self.title = data.get('title'); self.thumbnail = data.get('thumbnail'); self.duration = data.get('duration')
-        self.uploader = data.get('uploader'); self.filepath = None; self.id = data.get('id')
+        self.uploader = data.get('uploader'); self.filepath: str | None = None; self.id = data.get('id'); self._download_task: asyncio.Task | None = None
+        self.guild_id = requester.guild.id if isinstance(requester, discord.Member) else 0
+        self.stream = STREAM_BY_DEFAULT; self.stream_url: str | None = None; self.stream_headers: dict | None = None; self.stream_codec: str | None = None; self.stream_resolved_at = 0.0
+        self.resume_at = 0.0; self.radio = False # Radio: phát chung với các guild khác, ai vào sau thì nghe từ vị trí trực tiếp
+    @property
+    def is_opus(self) -> bool:
+        """Nguồn phát đã là Opus thì có thể gửi thẳng cho Discord mà không cần mã hóa lại."""
+        return self.filepath.endswith('.opus') if self.filepath else self.stream_codec == 'opus'
+    @property
+    def is_ready(self) -> bool: return bool(self.filepath) or (self.stream and self._stream_fresh())
+    def _stream_fresh(self) -> bool: return bool(self.stream_url) and time.monotonic() - self.stream_resolved_at < STREAM_URL_TTL
+    def _set_stream(self, data: dict):
+        self.stream_url = data.get('url'); self.stream_headers = data.get('http_headers') or None; self.stream_codec = data.get('acodec'); self.stream_resolved_at = time.monotonic()
     def format_duration(self):
         if self.duration is None: return "N/A"
         m, s = divmod(self.duration, 60); h, m = divmod(m, 60)
         return f"{int(h):02d}:{int(m):02d}:{int(s):02d}" if h > 0 else f"{int(m):02d}:{int(s):02d}"
     def cleanup(self):
-        if self.filepath and os.path.exists(self.filepath):
-            try: os.remove(self.filepath); log.info(f"Đã xóa file cache: {self.filepath}")
-            except OSError as e: log.error(f"Lỗi khi xóa file cache {self.filepath}: {e}")
+        # File thuộc về cache dùng chung, chỉ trả lại tham chiếu; AUDIO_CACHE sẽ tự xóa theo LRU khi cần.
+        if self._download_task and not self._download_task.done(): self._download_task.cancel()
+        if self.filepath: AUDIO_CACHE.release(self.id); self.filepath = None
+    def _attach(self, entry: dict):
+        """Gắn file trong cache vào bài hát (entry đã được giữ tham chiếu) và bổ sung metadata còn thiếu."""
+        self.filepath = entry['path']; self.id = entry['id']
+        self.title = self.title or entry.get('title'); self.uploader = self.uploader or entry.get('uploader')
+        self.duration = self.duration or entry.get('duration'); self.thumbnail = self.thumbnail or entry.get('thumbnail')
+    async def ensure_ready(self, priority: Priority = Priority.INTERACTIVE) -> bool:
+        """Chuẩn bị bài hát để phát: lấy link stream nếu ở chế độ stream, nếu thất bại thì quay về tải file."""
+        if self.stream and not self.filepath:
+            if await self.ensure_stream(priority): return True
+            log.warning(f"Không lấy được link stream cho '{self.title}', chuyển sang tải về."); self.stream = False
+        return await self.ensure_downloaded(priority)
+    async def fetch_info(self, priority: Priority = Priority.INTERACTIVE) -> Optional[dict]:
+        """Lấy lại info dict đầy đủ từ yt-dlp (không lưu vào bài hát)."""
+        data = await EXTRACTOR.run(self.guild_id, priority, ytdl.extract_info, YTDL_STREAM_OPTIONS, self.url)
+        if data and 'entries' in data: data = data['entries'][0]
+        return data
+    async def ensure_stream(self, priority: Priority = Priority.INTERACTIVE) -> bool:
+        """Lấy (hoặc làm mới) link media trực tiếp để FFmpeg đọc thẳng mà không cần tải file."""
+        if self._stream_fresh(): return True
+        try:
+            data = await self.fetch_info(priority)
+            if not data or not data.get('url'): return False
+            self._set_stream(data); self.duration = self.duration or data.get('duration'); self.thumbnail = self.thumbnail or data.get('thumbnail'); return True
+        except SchedulerBusy: raise
+        except Exception as e: log.error(f"Lỗi yt-dlp khi LẤY LINK STREAM '{self.url}': {e}", exc_info=True); return False
+    async def ensure_downloaded(self, priority: Priority = Priority.INTERACTIVE) -> bool:
+        """Đảm bảo file đã được tải về. Các lần gọi đồng thời (prefetcher và player loop) dùng chung một lượt tải."""
+        if self.filepath: return True
+        # Lượt tải trước đó đã xong mà chưa có file nghĩa là đã thất bại hoặc bị hủy, thử lại
+        if self._download_task is None or self._download_task.done():
+            self._download_task = asyncio.create_task(self._download(priority))
+        elif priority == Priority.INTERACTIVE: EXTRACTOR.promote(('download', self.url)) # Lượt tải nền (tải trước) còn xếp hàng thì cho lên trước
+        try: return await asyncio.shield(self._download_task)
+        except asyncio.CancelledError:
+            if self._download_task.cancelled(): return False
+            raise
+    async def _download(self, priority: Priority) -> bool:
+        try:
+            with STAGE_SECONDS.time('download'): entry = await AUDIO_CACHE.fetch(self.id, functools.partial(_download_audio, self.url, self.guild_id, priority))
+            if not entry: return False
+            self._attach(entry); return True # Phân tích độ to do nơi phát bài gửi đi, để lượt tải trước bị bỏ không tốn một lần chạy loudnorm
+        except SchedulerBusy: raise
+        except Exception as e: log.error(f"Lỗi yt-dlp khi TẢI VỀ '{self.url}': {e}", exc_info=True); return False
+    def to_index(self) -> dict:
+        return {'id': self.id, 'url': self.url, 'title': self.title, 'uploader': self.uploader, 'duration': self.duration, 'thumbnail': self.thumbnail}
+    def to_snapshot(self) -> list:
+        """Dạng gọn để lưu phiên: chỉ những gì cần để tạo lại bài hát, link stream và file sẽ được lấy lại khi phát."""
+        return [self.id, self.url, self.title, self.duration, self.uploader, self.thumbnail, self.requester.id, self.stream, self.radio]
+    @classmethod
+    def from_snapshot(cls, snapshot: list, guild: discord.Guild):
+        video_id, url, title, duration, uploader, thumbnail, requester_id, stream, *rest = snapshot # Phiên lưu từ bản cũ không có cờ radio
+        song = cls({'id': video_id, 'webpage_url': url, 'title': title, 'duration': duration, 'uploader': uploader, 'thumbnail': thumbnail}, guild.get_member(requester_id) or guild.me)
+        song.stream = stream; song.radio = bool(rest and rest[0]); return song
     @classmethod
     async def search_only(cls, query: str, requester: discord.Member | discord.User):
-        loop = asyncio.get_running_loop(); partial = functools.partial(yt_dlp.YoutubeDL(YTDL_SEARCH_OPTIONS).extract_info, query, download=False)
-        try:
-            data = await loop.run_in_executor(None, partial);
-            if not data or 'entries' not in data or not data['entries']: return []
-            return [cls(entry, requester) for entry in data['entries']]
-        except Exception as e: log.error(f"Lỗi yt-dlp khi TÌM KIẾM '{query}': {e}", exc_info=True); return []
+        key = ytdl.normalize_query(query); entries = SEARCH_CACHE.get(key)
+        if entries is None:
+            guild_id = requester.guild.id if isinstance(requester, discord.Member) else 0
+            try:
+                with STAGE_SECONDS.time('search'): data = await EXTRACTOR.run(guild_id, Priority.INTERACTIVE, ytdl.extract_info, YTDL_SEARCH_OPTIONS, query)
+                if not data or 'entries' not in data or not data['entries']: return []
+                entries = [compact_info(entry) for entry in data['entries'] if entry]; SEARCH_CACHE.set(key, entries)
+            except SchedulerBusy: raise
+            except Exception as e: log.error(f"Lỗi yt-dlp khi TÌM KIẾM '{query}': {e}", exc_info=True); return []
+            songs = [cls(entry, requester) for entry in entries]; TRACKS.remember([song.to_index() for song in songs]); return songs
+        return [cls(entry, requester) for entry in entries]
     @classmethod
-    async def from_url_and_download(cls, url: str, requester: discord.Member | discord.User):
-        loop = asyncio.get_running_loop(); ytdl = yt_dlp.YoutubeDL(YTDL_DOWNLOAD_OPTIONS)
-        partial = functools.partial(ytdl.extract_info, url, download=True)
+    async def resolve(cls, url: str, requester: discord.Member | discord.User):
+        """Chỉ lấy metadata (không tải file). Nếu bài đã có trong cache hoặc trong danh mục TRACKS thì không cần gọi yt-dlp."""
+        video_id = extract_video_id(url); entry = AUDIO_CACHE.get(video_id)
+        if entry:
+            AUDIO_CACHE.acquire(entry['id']); song = cls({**entry, 'webpage_url': entry.get('webpage_url') or url}, requester); song._attach(entry); return song
+        # Link stream (hoặc file) sẽ được lấy khi bài sắp phát, như với bài thêm từ playlist
+        track = await TRACKS.get(video_id)
+        if track: return cls({**track, 'webpage_url': track['url']}, requester)
+        guild_id = requester.guild.id if isinstance(requester, discord.Member) else 0
         try:
-            data = await loop.run_in_executor(None, partial);
+            with STAGE_SECONDS.time('resolve'): data = await EXTRACTOR.run(guild_id, Priority.INTERACTIVE, ytdl.extract_info, YTDL_DOWNLOAD_OPTIONS, url)
             if not data: return None
             if 'entries' in data: data = data['entries'][0]
-            song = cls(data, requester); song.filepath = ytdl.prepare_filename(data); return song
-        except Exception as e: log.error(f"Lỗi yt-dlp khi TẢI VỀ '{url}': {e}", exc_info=True); return None
+            song = cls(data, requester); song._set_stream(data); TRACKS.remember([song.to_index()]); return song
+        except SchedulerBusy: raise
+        except Exception as e: log.error(f"Lỗi yt-dlp khi LẤY THÔNG TIN '{url}': {e}", exc_info=True); return None
+
+def _adopt_download(data: Optional[dict]):
+    """Lượt tải bị hủy khi yt-dlp đã chạy vẫn ghi file ra đĩa: giao file cho AUDIO_CACHE thay vì để mồ côi tới lần khởi động sau."""
+    if data and data.get('_filename'): AUDIO_CACHE.adopt(data.get('id'), data['_filename'], data)
+
+async def _download_audio(url: str, guild_id: int, priority: Priority) -> Optional[tuple[str, dict]]:
+    """Tải file về thư mục cache. Trả về (đường dẫn, info dict) cho AudioCache."""
+    data = await EXTRACTOR.run(guild_id, priority, ytdl.extract_info, YTDL_DOWNLOAD_OPTIONS, url, True, on_abandoned=_adopt_download, tag=('download', url))
+    if not data: return None
+    return data['_filename'], data
 
 class SearchView(discord.ui.View):
-    """Giao diện cho kết quả tìm kiếm."""
+    """
+    Giao diện cho kết quả tìm kiếm. Trong lúc người dùng đang chọn, SEARCH_SPECULATE kết quả đầu được tải trước
+    ở độ ưu tiên BACKGROUND (giới hạn số lượt tải đồng thời và tổng dung lượng); bài không được chọn bị hủy và xóa khỏi cache.
+    """
+    speculative_bytes = 0 # Dung lượng đang giữ chỗ cho việc tải trước của mọi bảng
     def __init__(self, *, music_cog, ctx: AnyContext, results: list[Song]):
-        super().__init__(timeout=180.0);self.music_cog=music_cog;self.ctx=ctx;self.requester=ctx.author if isinstance(ctx,commands.Context)else ctx.user;self.results=results;self.current_page=1;self.songs_per_page=5;self.total_pages=math.ceil(len(self.results)/self.songs_per_page);self.message=None;self.update_components()
+        super().__init__(timeout=None);self.timer_key=('search',id(self));self.speculative:dict[int,asyncio.Task]={};self.speculating:set[int]=set();self.fresh:set[int]=set();self.reserved:dict[int,int]={};self.ended=False;self.picked=None;self.music_cog=music_cog;self.ctx=ctx;self.requester=ctx.author if isinstance(ctx,commands.Context)else ctx.user;self.results=results;self.current_page=1;self.songs_per_page=5;self.total_pages=math.ceil(len(self.results)/self.songs_per_page);self.message=None;self.update_components()
     async def on_timeout(self):
         if self.message:
             try:await self.message.edit(content="Hết thời gian tìm kiếm.",embed=None,view=None)
             except discord.NotFound:pass
         self.stop()
+    async def interaction_check(self,interaction:discord.Interaction)->bool:
+        TIMERS.schedule(self.timer_key,SEARCH_VIEW_TIMEOUT,self.on_timeout);return True # Có tương tác thì gia hạn như timeout của View
+    def stop(self):TIMERS.cancel(self.timer_key);self._end_speculation();super().stop()
     async def start(self):
-        embed=self.create_page_embed()
+        embed=self.create_page_embed();TIMERS.schedule(self.timer_key,SEARCH_VIEW_TIMEOUT,self.on_timeout) # Hết hạn qua TIMERS thay vì mỗi View một task riêng
         if isinstance(self.ctx, discord.Interaction):
             if self.ctx.response.is_done():self.message=await self.ctx.followup.send(embed=embed,view=self,ephemeral=True)
             else:await self.ctx.response.send_message(embed=embed,view=self,ephemeral=True);self.message=await self.ctx.original_response()
         else:self.message=await self.ctx.send(embed=embed,view=self)
+        if not self.is_finished():self._speculate()
+    def _speculate(self):
+        for index,song in enumerate(self.results[:SEARCH_SPECULATE]):
+            estimate=0 if song.stream else int((song.duration or 0)*SPECULATE_BYTES_PER_SECOND) # Chế độ stream chỉ lấy link, không tốn đĩa
+            if not song.stream and(not song.duration or song.duration>SPECULATE_MAX_SECONDS or SearchView.speculative_bytes+estimate>SPECULATE_MAX_BYTES):SPECULATION.inc('skipped');continue
+            SearchView.speculative_bytes+=estimate;self.reserved[index]=estimate;self.speculative[index]=asyncio.create_task(self._speculate_one(index,song))
+    async def _speculate_one(self,index:int,song:Song):
+        async with SPECULATE_SEMAPHORE:
+            # Chỉ tải trước khi yt-dlp còn dư worker: lượt tải bị hủy vẫn giữ worker tới khi chạy xong, không được lấn chỗ của người đang chờ
+            if EXTRACTOR.idle<SPECULATE_MIN_IDLE_WORKERS:SPECULATION.inc('skipped');return
+            self.speculating.add(index);SPECULATION.inc('started')
+            if not song.stream and AUDIO_CACHE.get(song.id) is None:self.fresh.add(index) # Chỉ xóa file do chính bảng này tải về
+            try:await song.ensure_ready(Priority.BACKGROUND)
+            except SchedulerBusy:pass
+            finally:
+                if self.ended and song is not self.picked:self._drop(index,song) # Bảng đã đóng trong lúc tải: dọn ngay khi xong, vẫn trong chỗ của semaphore
+    def _release(self,index:int):SearchView.speculative_bytes-=self.reserved.pop(index,0)
+    def _drop(self,index:int,song:Song):
+        self._release(index);song.cleanup()
+        if index in self.speculating:SPECULATION.inc('wasted')
+        if index in self.fresh:AUDIO_CACHE.discard(song.id)
+    def _end_speculation(self):
+        """Bài được chọn giữ lượt tải đang chạy (player loop dùng chung); bài chưa bắt đầu tải thì để player loop tải ở độ ưu tiên cao.
+        Bài khác đang tải dở được chạy nốt rồi tự xóa (hủy không dừng được yt-dlp, chỉ làm lượt tải thoát khỏi giới hạn của SPECULATE_SEMAPHORE); còn lại bị hủy và xóa ngay."""
+        self.ended=True
+        for index,task in self.speculative.items():
+            song=self.results[index]
+            if song is self.picked:
+                self._release(index)
+                if index not in self.speculating:task.cancel()
+                continue
+            if index in self.speculating and not task.done():continue
+            task.cancel();self._drop(index,song)
+        self.speculative.clear()
     def update_components(self):self.prev_page_button.disabled=self.current_page==1;self.next_page_button.disabled=self.current_page>=self.total_pages;self.clear_items();self.add_item(self.create_select_menu());self.add_item(self.prev_page_button);self.add_item(self.next_page_button);self.add_item(self.cancel_button)
     def create_page_embed(self)->discord.Embed:start_index=(self.current_page-1)*self.songs_per_page;end_index=start_index+self.songs_per_page;page_results=self.results[start_index:end_index];description="".join(f"`{i+1}.` [{s.title}]({s.url})\n`{s.uploader or 'N/A'} - {s.format_duration()}`\n\n"for i,s in enumerate(page_results,start=start_index));embed=discord.Embed(title=f"🔎 Kết quả tìm kiếm (Trang {self.current_page}/{self.total_pages})",description=description,color=discord.Color.blue());embed.set_footer(text=f"Yêu cầu bởi {self.requester.display_name}",icon_url=self.requester.display_avatar.url);return embed
     def create_select_menu(self)->discord.ui.Select:start_index=(self.current_page-1)*self.songs_per_page;end_index=start_index+self.songs_per_page;options=[discord.SelectOption(label=f"{i+1}. {s.title[:80]}",value=str(i))for i,s in enumerate(self.results[start_index:end_index],start=start_index)];select=discord.ui.Select(placeholder="Chọn một bài hát để thêm...",options=options,custom_id="search_select_menu");select.callback=self.select_callback;return select
     async def select_callback(self,interaction:discord.Interaction):
         if interaction.user.id!=self.requester.id:return await interaction.response.send_message("Bạn không phải người yêu cầu!",ephemeral=True)
-        await interaction.response.defer();await self.message.edit(content="⏳ Đang tải bài hát bạn chọn...",embed=None,view=None)
-        selected_song=await Song.from_url_and_download(self.results[int(interaction.data["values"][0])].url,self.requester)
-        if selected_song:
-            state=self.music_cog.get_guild_state(interaction.guild_id)
-            await state.queue.put(selected_song)
-            if state.player_task is None or state.player_task.done():
-                state.player_task=asyncio.create_task(state.player_loop())
-            await self.message.edit(content=f"✅ Đã thêm **{selected_song.title}** vào hàng đợi.")
-        else:
-            await self.message.edit(content=f"❌ Rất tiếc, đã có lỗi khi tải về bài hát này.")
+        await interaction.response.defer()
+        index=int(interaction.data["values"][0]);selected_song=self.results[index];selected_song.requester=self.requester;self.picked=selected_song
+        SPECULATION.inc(('hit' if selected_song.is_ready else 'partial')if index in self.speculating else 'miss')
+        state=self.music_cog.get_guild_state(interaction.guild_id);await state.enqueue(selected_song)
+        await self.message.edit(content=f"✅ Đã thêm **{selected_song.title}** vào hàng đợi.",embed=None,view=None)
         self.stop()
     @discord.ui.button(label="Trước",style=discord.ButtonStyle.secondary,emoji="⬅️")
     async def prev_page_button(self,interaction:discord.Interaction,button:discord.ui.Button):
@@ -102,13 +306,318 @@ class SearchView(discord.ui.View):
         if interaction.user.id!=self.requester.id:return await interaction.response.send_message("Bạn không phải người yêu cầu!",ephemeral=True)
         await self.message.edit(content="Đã hủy tìm kiếm.",embed=None,view=None);self.stop()
 
+class PlaybackSource(discord.AudioSource):
+    """Bọc nguồn phát (PCM hoặc Opus) và đếm số frame đã phát, để biết vị trí hiện tại kể cả khi tạm dừng hay tua."""
+    def __init__(self, original: discord.AudioSource, start_at: float = 0.0):
+        self.original = original; self.start_at = start_at; self.frames = 0; self._prerolled: bytes | None = None
+    def preroll(self) -> bool:
+        """Đọc sẵn frame đầu (gọi trong thread): chờ FFmpeg khởi động xong trước khi tới lượt bài này."""
+        self._prerolled = self.original.read(); return bool(self._prerolled)
+    def read(self) -> bytes:
+        if self._prerolled is not None: data = self._prerolled; self._prerolled = None
+        else: data = self.original.read()
+        if data: self.frames += 1
+        return data
+    def is_opus(self) -> bool: return self.original.is_opus()
+    def cleanup(self): self.original.cleanup()
+    @property
+    def adjustable(self) -> bool:
+        """Nguồn PCM chỉnh âm lượng ngay được; nguồn Opus cần khởi động lại FFmpeg với bộ lọc mới."""
+        return isinstance(self.original, discord.PCMVolumeTransformer)
+    @property
+    def position(self) -> float: return self.start_at + self.frames * 0.02 # Mỗi frame của discord.py dài 20ms
+
+class TrackChain(discord.AudioSource):
+    """
+    Nguồn duy nhất giao cho voice client ở chế độ gapless. Khi bài hiện tại hết, bài kế tiếp (đã mở và đọc sẵn) được nối vào
+    ngay trong cùng lần `read()` của luồng audio, nên không có khoảng lặng hay vòng gọi mạng nào giữa hai bài.
+    `on_switch(old, new)` được gọi trên luồng audio; việc dọn nguồn cũ và cập nhật trạng thái để player loop làm sau đó.
+    Với nguồn PCM có thể trộn chồng (crossfade) phần cuối bài cũ với phần đầu bài mới, bắt đầu từ giây `fade_at`.
+    """
+    def __init__(self, current: PlaybackSource, on_switch: Callable[[PlaybackSource, PlaybackSource], None]):
+        self.current = current; self.on_switch = on_switch; self._lock = threading.Lock(); self.closed = False
+        self.pending: PlaybackSource | None = None; self.min_position = 0.0; self.fade_at: float | None = None; self.fade_seconds = 0.0
+
+    def queue_next(self, expected: PlaybackSource, source: PlaybackSource, min_position: float = 0.0, fade_at: float | None = None, fade_seconds: float = 0.0) -> bool:
+        """Hẹn bài kế tiếp. Bài cũ kết thúc trước `min_position` (stream bị ngắt) thì không nối, để player loop xử lý như cũ."""
+        with self._lock:
+            if self.closed or self.current is not expected or self.pending is not None: return False
+            self.min_position = min_position; self.fade_at = fade_at if fade_seconds > 0 and not source.is_opus() and not expected.is_opus() else None; self.fade_seconds = fade_seconds
+            self.pending = source; return True
+
+    def drop_next(self, expected: PlaybackSource) -> bool:
+        """Bỏ bài đã hẹn. Trả về False nếu luồng audio đã kịp chuyển sang bài đó."""
+        with self._lock:
+            if self.pending is not expected: return False
+            self.pending = None; self.fade_at = None
+        expected.cleanup(); return True
+
+    def _adopt(self, pending: PlaybackSource) -> bool:
+        with self._lock:
+            if self.pending is not pending: return False
+            old = self.current; self.current = pending; self.pending = None; self.fade_at = None
+        self.on_switch(old, pending); return True
+
+    def read(self) -> bytes:
+        current = self.current; data = current.read(); pending = self.pending
+        if pending is None: return data
+        if not data: return pending.read() if current.position >= self.min_position and self._adopt(pending) else b''
+        fade_at = self.fade_at
+        if fade_at is None or current.position < fade_at: return data
+        incoming = pending.read()
+        if len(incoming) != len(data): self.fade_at = None; return data
+        fade_out = 1.0 - (current.position - fade_at) / self.fade_seconds
+        # Trộn xong mà bài cũ vẫn còn (thời lượng trong metadata ngắn hơn thực tế) thì bỏ phần còn lại của bài cũ
+        if fade_out <= 0.0: return incoming if self._adopt(pending) else data
+        return audioop.add(audioop.mul(data, 2, fade_out), audioop.mul(incoming, 2, 1.0 - fade_out), 2)
+
+    def is_opus(self) -> bool: return self.current.is_opus()
+    def cleanup(self):
+        with self._lock: self.closed = True; pending = self.pending; self.pending = None
+        self.current.cleanup()
+        if pending: pending.cleanup()
+
+class _ChannelContext:
+    """Thay cho ctx khi phiên được khôi phục sau khởi động lại: GuildState chỉ cần kênh để gửi tin nhắn."""
+    __slots__ = ('channel',)
+    def __init__(self, channel): self.channel = channel
+
 class GuildState:
     """Quản lý trạng thái của từng server."""
     def __init__(self, bot: commands.Bot, guild_id: int):
-        self.bot = bot; self.guild_id = guild_id; self.queue = asyncio.Queue[Song](); self.voice_client: discord.VoiceClient | None = None
+        self.bot = bot; self.guild_id = guild_id; self.queue = SongQueue[Song](); self.voice_client: discord.VoiceClient | None = None
         self.now_playing_message: discord.Message | None = None; self.current_song: Song | None = None; self.loop_mode = LoopMode.OFF
-        self.player_task: asyncio.Task | None = None; self.last_ctx: AnyContext | None = None; self.song_finished_event = asyncio.Event()
-        self.volume = 0.5; self.is_seeking = False
+        self.player_task: asyncio.Task | None = None; self.waiting_for_song = False; self.last_ctx: AnyContext | None = None; self.song_finished_event = asyncio.Event()
+        self.volume = DEFAULT_VOLUME; self.is_seeking = False; self.skip_requested = False
+        self.current_source: PlaybackSource | None = None; self.playback_error: Exception | None = None
+        self.chain: TrackChain | None = None; self.preroll: tuple[PlaybackSource, Song] | None = None; self.preroll_task: asyncio.Task | None = None; self.handoff: tuple[PlaybackSource, Song | None] | None = None
+        self.playlist_task: asyncio.Task | None = None; self.song_taken_event = asyncio.Event()
+        self.prefetcher = Prefetcher(guild_id, lambda n: self.queue.slice(0, n), PREFETCH_DEPTH, PREFETCH_SEMAPHORE)
+        self.connect_lock = asyncio.Lock(); self.resume_task: asyncio.Task | None = None
+        self.now_playing_renderer = RenderScheduler(self._render_now_playing, min_interval=NOW_PLAYING_MIN_INTERVAL)
+        self.now_playing_digest: str | None = None; self._control_view: discord.ui.View | None = None
+
+    async def connect(self, channel: discord.VoiceChannel):
+        """Vào (hoặc chuyển sang) kênh thoại. Dùng khóa để lệnh play và việc khôi phục phiên không cùng kết nối một lúc."""
+        async with self.connect_lock:
+            if not self.voice_client or not self.voice_client.is_connected(): self.voice_client = await channel.connect()
+            elif self.voice_client.channel != channel: await self.voice_client.move_to(channel)
+
+    async def enqueue(self, song: Song):
+        """Thêm bài vào hàng đợi, tải trước trong nền và khởi động player loop nếu cần."""
+        await self.queue.put(song); self.prefetcher.kick(); self.refresh_preroll(); self.save()
+        if self.player_task is None or self.player_task.done(): self.player_task = asyncio.create_task(self.player_loop())
+
+    def snapshot(self) -> dict | None:
+        """Trạng thái gọn của phiên để lưu. None nghĩa là không còn gì để khôi phục."""
+        if not self.current_song and self.queue.empty(): return None
+        return {
+            'voice': self.voice_client.channel.id if self.voice_client and self.voice_client.channel else None,
+            'text': self.last_ctx.channel.id if self.last_ctx and self.last_ctx.channel else None,
+            'loop': self.loop_mode.value, 'volume': self.volume, 'position': round(self.position(), 1),
+            'current': self.current_song.to_snapshot() if self.current_song else None, 'queue': [song.to_snapshot() for song in self.queue]
+        }
+
+    def save(self):
+        """Hẹn lưu phiên; SessionStore gộp nhiều thay đổi liên tiếp thành một lần ghi."""
+        if SESSIONS: SESSIONS.mark_dirty(self.guild_id, self.snapshot)
+
+    def restore(self, snapshot: dict):
+        """Nạp lại hàng đợi đã lưu (bài đang phát dở đứng đầu, phát tiếp từ vị trí cũ) rồi vào lại kênh thoại trong nền."""
+        guild = self.bot.get_guild(self.guild_id)
+        if not guild: return
+        self.loop_mode = LoopMode(snapshot.get('loop', 0)); self.volume = snapshot.get('volume', DEFAULT_VOLUME)
+        text_channel = guild.get_channel(snapshot.get('text') or 0)
+        if text_channel and not self.last_ctx: self.last_ctx = _ChannelContext(text_channel)
+        current = snapshot.get('current'); songs = []
+        for item in ([current] if current else []) + (snapshot.get('queue') or []):
+            try: songs.append(Song.from_snapshot(item, guild))
+            except (TypeError, ValueError): continue
+        if current and songs: songs[0].resume_at = float(snapshot.get('position') or 0)
+        for song in songs: self.queue.put_nowait(song)
+        log.info(f"Guild {self.guild_id}: Khôi phục {len(songs)} bài từ phiên trước.")
+        self.resume_task = asyncio.create_task(self.resume(guild.get_channel(snapshot.get('voice') or 0)))
+
+    @property
+    def resuming(self) -> bool: return self.resume_task is not None and not self.resume_task.done()
+
+    async def settle(self):
+        """Chờ phiên vừa khôi phục vào lại kênh thoại (tối đa RESUME_WAIT giây), để lệnh vừa gọi thấy đúng trạng thái."""
+        if not self.resuming: return
+        try: await asyncio.wait_for(asyncio.shield(self.resume_task), RESUME_WAIT)
+        except (asyncio.TimeoutError, asyncio.CancelledError): pass
+
+    async def resume(self, channel: Optional[discord.VoiceChannel]):
+        if self.queue.empty(): return
+        if isinstance(channel, discord.VoiceChannel):
+            try: await self.connect(channel)
+            except Exception as e: log.warning(f"Guild {self.guild_id}: Không thể vào lại kênh thoại {channel.id}: {e}")
+        # Không vào được kênh thoại thì giữ hàng đợi, lệnh play tiếp theo sẽ khởi động player loop
+        if not self.voice_client or not self.voice_client.is_connected(): return
+        self.prefetcher.kick()
+        if self.player_task is None or self.player_task.done(): self.player_task = asyncio.create_task(self.player_loop())
+
+    @staticmethod
+    def playlist_songs(data: Optional[dict], requester: discord.Member | discord.User, stream: Optional[bool]) -> list[Song]:
+        songs = []
+        for entry in (data or {}).get('entries') or []:
+            if not entry or entry.get('title') in UNAVAILABLE_TITLES: continue
+            song = Song(entry, requester)
+            if stream is not None: song.stream = stream
+            songs.append(song)
+        TRACKS.remember([song.to_index() for song in songs]); return songs
+
+    async def feed_playlist(self, url: str, requester: discord.Member | discord.User, stream: Optional[bool], next_index: int, added: int):
+        """Nạp dần phần còn lại của playlist. Chỉ lấy trang tiếp theo khi hàng đợi sắp hết để bộ nhớ luôn có giới hạn."""
+        try:
+            while added < PLAYLIST_MAX_TRACKS:
+                while self.queue.qsize() >= PLAYLIST_PAGE_SIZE:
+                    self.song_taken_event.clear(); await self.song_taken_event.wait()
+                end = min(next_index + PLAYLIST_PAGE_SIZE, next_index + PLAYLIST_MAX_TRACKS - added) - 1
+                try: data = await EXTRACTOR.run(self.guild_id, Priority.BACKGROUND, ytdl.extract_playlist_page, YTDL_PLAYLIST_OPTIONS, url, next_index, end)
+                except SchedulerBusy: await asyncio.sleep(5); continue
+                songs = self.playlist_songs(data, requester, stream)
+                for song in songs: await self.enqueue(song)
+                added += len(songs); log.info(f"Guild {self.guild_id}: Đã nạp thêm {len(songs)} bài từ playlist (tổng {added}).")
+                if len((data or {}).get('entries') or []) < end - next_index + 1: break
+                next_index = end + 1
+        except Exception as e: log.error(f"Lỗi khi nạp playlist '{url}' cho guild {self.guild_id}:", exc_info=e)
+
+    def effective_volume(self, song: Song) -> float:
+        """Âm lượng người dùng chọn nhân với gain chuẩn hóa độ to của bài (nếu đã phân tích xong)."""
+        return self.volume * (LOUDNESS.gain_factor(song.filepath) if LOUDNESS_ENABLED else 1.0)
+
+    @staticmethod
+    def _ffmpeg_input(song: Song, start_at: float = 0.0) -> tuple[str, str]:
+        """Đầu vào và before_options cho FFmpeg: ưu tiên file trong cache, nếu không có thì đọc thẳng từ link stream."""
+        before_options = f"-ss {start_at}" if start_at else ''
+        if song.filepath: return song.filepath, before_options
+        before_options = f"{before_options} {FFMPEG_STREAM_BEFORE_OPTIONS}"
+        if song.stream_headers: before_options += " -headers " + shlex.quote(''.join(f"{k}: {v}\r\n" for k, v in song.stream_headers.items()))
+        return song.stream_url, before_options.strip()
+
+    @classmethod
+    def _create_opus_source(cls, song: Song, volume: float, start_at: float = 0.0) -> discord.FFmpegOpusAudio:
+        """FFmpeg xuất thẳng gói Opus. Chỉ copy nguyên gói khi nguồn đã là Opus và âm lượng thực (âm lượng người dùng nhân gain chuẩn hóa) xấp xỉ 1.0."""
+        source_input, before_options = cls._ffmpeg_input(song, start_at); passthrough = song.is_opus and abs(volume - 1.0) < 0.005
+        options = FFMPEG_OPTIONS['options'] if passthrough else f"{FFMPEG_OPTIONS['options']} -filter:a volume={volume:.3f}"
+        return discord.FFmpegOpusAudio(source_input, codec='copy' if passthrough else None, before_options=before_options, options=options)
+
+    def _create_source(self, song: Song, start_at: float = 0.0) -> PlaybackSource:
+        """
+        Tạo nguồn phát. Ở chế độ Opus, bot không phải giải mã, nhân âm lượng và mã hóa lại từng frame trên luồng audio.
+        Bài radio không mở FFmpeg riêng mà nghe chung Broadcast của bài đó (vào từ vị trí trực tiếp, không tua được).
+        Cùng một luồng Opus được gửi cho mọi guild nên radio chỉ áp chuẩn hóa độ to, không áp âm lượng riêng của guild.
+        """
+        if song.radio:
+            gain = LOUDNESS.gain_factor(song.filepath) if LOUDNESS_ENABLED else 1.0
+            return PlaybackSource(BROADCASTS.subscribe(('radio', song.id or song.url), functools.partial(self._create_opus_source, song, gain)))
+        volume = self.effective_volume(song)
+        if not OPUS_PASSTHROUGH:
+            source_input, before_options = self._ffmpeg_input(song, start_at)
+            return PlaybackSource(discord.PCMVolumeTransformer(discord.FFmpegPCMAudio(source_input, before_options=before_options, options=FFMPEG_OPTIONS['options']), volume=volume), start_at)
+        return PlaybackSource(self._create_opus_source(song, volume, start_at), start_at)
+
+    def _start_playback(self, song: Song, start_at: float = 0.0):
+        with STAGE_SECONDS.time('ffmpeg_spawn'): self.current_source = self._create_source(song, start_at)
+        self.playback_error = None; self.preroll = None
+        def after(error):
+            self.playback_error = error; self.bot.loop.call_soon_threadsafe(self.song_finished_event.set)
+        if not GAPLESS: return self.voice_client.play(self.current_source, after=after)
+        self.chain = TrackChain(self.current_source, self._on_track_switch); self.voice_client.play(self.chain, after=after)
+        self._schedule_preroll(song, start_at)
+
+    # --- Gapless: mở sẵn bài kế tiếp và để TrackChain nối vào ngay trong luồng audio ---
+    def _next_song(self) -> Song | None:
+        if self.loop_mode == LoopMode.SONG: return self.current_song
+        return self.queue.peek(0) or (self.current_song if self.loop_mode == LoopMode.QUEUE else None)
+
+    def _schedule_preroll(self, song: Song, start_at: float = 0.0):
+        if song.duration: TIMERS.schedule(('preroll', self.guild_id), max(0.0, song.duration - start_at - GAPLESS_PREROLL - CROSSFADE_SECONDS), self._preroll_next)
+
+    async def _preroll_next(self):
+        chain = self.chain; current = self.current_source; playing = self.current_song
+        while True:
+            song = self._next_song()
+            if not song or not chain or chain.closed or chain.current is not current or chain.pending: return
+            try:
+                if not await song.ensure_ready(Priority.BACKGROUND): return
+            except SchedulerBusy: return TIMERS.schedule(('preroll', self.guild_id), 3, self._preroll_next) # Scheduler đang đầy, thử lại sau
+            if chain is not self.chain or chain.current is not current: return # Đã đổi bài trong lúc chờ tải
+            if song is self._next_song(): break # Hàng đợi đổi trong lúc chờ tải thì chuẩn bị bài mới đứng đầu
+        if LOUDNESS_ENABLED: LOUDNESS.submit(song.filepath)
+        source = self._create_source(song)
+        try:
+            with STAGE_SECONDS.time('preroll'): ready = await asyncio.to_thread(source.preroll)
+        except BaseException: source.cleanup(); raise
+        # Stream của bài đang phát bị ngắt sớm thì không nối bài mới, để player loop chuyển sang tải về như cũ
+        min_position = playing.duration - 5 if playing.stream and not playing.filepath and not playing.radio and playing.duration else 0.0
+        fade_at = playing.duration - CROSSFADE_SECONDS if CROSSFADE_SECONDS > 0 and playing.duration else None
+        if not ready or not chain.queue_next(current, source, min_position, fade_at, CROSSFADE_SECONDS): source.cleanup(); return
+        self.preroll = (source, song)
+
+    def refresh_preroll(self, force: bool = False):
+        """Hàng đợi, chế độ lặp hay âm lượng thay đổi: bỏ bài đã mở sẵn nếu không còn đúng, và mở lại nếu đã tới lúc."""
+        chain = self.chain
+        if not chain or chain.closed: return
+        if self.preroll:
+            if not force and self.preroll[1] is self._next_song(): return
+            if not chain.drop_next(self.preroll[0]): return # Luồng audio đã chuyển sang bài đó
+            self.preroll = None
+        # Đã qua lúc mở sẵn (hạn chờ đã chạy) thì mở ngay, không đợi tick kế tiếp của TIMERS
+        if ('preroll', self.guild_id) not in TIMERS and self.current_song and self.current_song.duration and (self.preroll_task is None or self.preroll_task.done()):
+            self.preroll_task = asyncio.create_task(self._preroll_next())
+
+    def _on_track_switch(self, old: PlaybackSource, new: PlaybackSource):
+        # Chạy trên luồng audio: chỉ chuyển việc sang event loop
+        self.bot.loop.call_soon_threadsafe(self._track_switched, old, new)
+
+    def _track_switched(self, old: PlaybackSource, new: PlaybackSource):
+        song = self.preroll[1] if self.preroll and self.preroll[0] is new else None
+        self.handoff = (new, song); self.preroll = None; self.song_finished_event.set()
+        self.bot.loop.run_in_executor(None, old.cleanup) # Dừng FFmpeg của bài cũ ngoài event loop
+
+    def _adopt_handoff(self, source: PlaybackSource, song: Song | None) -> bool:
+        """Nhận bài mà TrackChain đã nối vào. Nếu bài đó vừa bị xóa khỏi hàng đợi thì dừng lại và phát như bình thường."""
+        index = next((i for i, queued in enumerate(self.queue) if queued is song), None) if song else None
+        if index is not None: self.queue.remove(index); self.current_song = song; self.song_taken_event.set(); self.save()
+        elif song is None or song is not self.current_song:
+            if self.voice_client and (self.voice_client.is_playing() or self.voice_client.is_paused()): self.is_seeking = True; self.voice_client.stop() # Bỏ qua sự kiện kết thúc của chain cũ
+            return False
+        self.current_source = source; return True
+
+    async def _wait_for_song_end(self):
+        # Lệnh tua dừng nguồn cũ rồi phát nguồn mới, nên bỏ qua sự kiện kết thúc của nguồn cũ
+        while True:
+            await self.song_finished_event.wait(); self.song_finished_event.clear()
+            if not self.is_seeking: return
+            self.is_seeking = False
+
+    def _stream_failed(self) -> bool:
+        """Stream bị ngắt giữa chừng: FFmpeg báo lỗi hoặc kết thúc sớm mà không phải do người dùng bỏ qua."""
+        song = self.current_song
+        if not song.stream or song.filepath or song.radio or self.skip_requested or not self.voice_client or not self.voice_client.is_connected(): return False
+        return self.playback_error is not None or (song.duration is not None and self.current_source.position < song.duration - 5)
+
+    def position(self) -> float: return self.current_source.position if self.current_source else 0.0
+
+    def skip(self): self.skip_requested = True; self.voice_client.stop()
+
+    async def set_volume(self, volume: float):
+        self.volume = volume; source = self.current_source; self.save()
+        if not source or not self.voice_client or not (self.voice_client.is_playing() or self.voice_client.is_paused()): return
+        self.refresh_preroll(force=True) # Bài đã mở sẵn mang âm lượng cũ
+        if source.adjustable: source.original.volume = self.effective_volume(self.current_song); return
+        was_paused = self.voice_client.is_paused()
+        if await self.seek(source.position) and was_paused: self.voice_client.pause()
+
+    async def seek(self, seconds: float) -> bool:
+        song = self.current_song
+        if song.radio: return False # Radio luôn phát ở vị trí trực tiếp
+        try:
+            if not song.filepath and not await song.ensure_stream(): return False
+        except SchedulerBusy: return False
+        self.is_seeking = True; self.voice_client.stop(); self._start_playback(song, seconds); self.save(); return True
 
     async def player_loop(self):
         await self.bot.wait_until_ready()
@@ -123,31 +632,57 @@ class GuildState:
                 elif self.loop_mode != LoopMode.SONG:
                     previous_song.cleanup()
             
-            # Lấy bài hát tiếp theo
-            try:
-                # Nếu không lặp lại bài hát, lấy bài mới từ hàng đợi
-                if self.loop_mode != LoopMode.SONG:
-                    self.current_song = await asyncio.wait_for(self.queue.get(), timeout=300)
-                # Nếu lặp lại, self.current_song vẫn giữ nguyên
-            except asyncio.TimeoutError:
-                log.info(f"Guild {self.guild_id} không hoạt động trong 5 phút, bắt đầu dọn dẹp.")
-                if self.last_ctx and self.last_ctx.channel:
-                    try: await self.last_ctx.channel.send("😴 Đã tự động ngắt kết nối do không hoạt động.")
-                    except discord.Forbidden: pass
-                return await self.cleanup()
+            # Lấy bài hát tiếp theo: bài TrackChain đã nối vào (gapless), hoặc lấy từ hàng đợi
+            # Nếu không lặp lại bài hát, lấy bài mới từ hàng đợi; trống quá IDLE_TIMEOUT thì _idle_timeout dọn dẹp (và hủy luôn task này)
+            handoff = self.handoff; self.handoff = None
+            if handoff and not self._adopt_handoff(*handoff): handoff = None
+            if not handoff and (self.loop_mode != LoopMode.SONG or self.current_song is None):
+                if self.queue.empty(): TIMERS.schedule(('idle', self.guild_id), IDLE_TIMEOUT, self._idle_timeout)
+                self.waiting_for_song = True
+                try: self.current_song = await self.queue.get()
+                finally: self.waiting_for_song = False; TIMERS.cancel(('idle', self.guild_id))
+                self.song_taken_event.set(); self.save()
+            taken_at = time.perf_counter()
+            # Nếu lặp lại, self.current_song vẫn giữ nguyên
 
             # Phát bài hát mới
             try:
-                log.info(f"Guild {self.guild_id}: Lấy bài hát '{self.current_song.title}' từ hàng đợi.")
-                await self.update_now_playing_message(new_song=True)
-                source = discord.PCMVolumeTransformer(discord.FFmpegPCMAudio(self.current_song.filepath,**FFMPEG_OPTIONS),volume=self.volume)
-                self.voice_client.play(source,after=lambda e:self.bot.loop.call_soon_threadsafe(self.song_finished_event.set))
-                await self.song_finished_event.wait()
-                
-                # Bỏ qua logic sau khi phát xong nếu đang seek
-                if self.is_seeking:
-                    self.is_seeking = False
-                    continue
+                if handoff:
+                    log.info(f"Guild {self.guild_id}: Đã chuyển liền mạch sang '{self.current_song.title}'.")
+                    self.prefetcher.kick(); self.skip_requested = False; self.current_song.resume_at = 0.0
+                    await self.update_now_playing_message(new_song=True); self._schedule_preroll(self.current_song)
+                    SONG_EVENTS.inc('started'); SONG_EVENTS.inc('gapless'); TRACKS.remember([self.current_song.to_index()], played=True)
+                else:
+                    log.info(f"Guild {self.guild_id}: Lấy bài hát '{self.current_song.title}' từ hàng đợi.")
+                    self.prefetcher.kick()
+                    with STAGE_SECONDS.time('prepare'):
+                        while True:
+                            try: ready = await self.current_song.ensure_ready(); break
+                            except SchedulerBusy: await asyncio.sleep(3) # Scheduler đang đầy, bài sắp phát thì chờ chứ không bỏ qua
+                    if not ready:
+                        SONG_EVENTS.inc('failed')
+                        if self.last_ctx and self.last_ctx.channel:
+                            try: await self.last_ctx.channel.send(f"❌ Không thể tải về **{self.current_song.title}**, bỏ qua bài này.")
+                            except discord.Forbidden: pass
+                        self.current_song.cleanup(); self.current_song = None
+                        if self.queue.empty(): return await self.cleanup()
+                        continue
+                    self.skip_requested = False
+                    if LOUDNESS_ENABLED: LOUDNESS.submit(self.current_song.filepath) # Chỉ phân tích bài thật sự được phát; kết quả dùng cho lần phát sau và khi đổi âm lượng/tua
+                    await self.update_now_playing_message(new_song=True)
+                    start_at = self.current_song.resume_at; self.current_song.resume_at = 0.0
+                    self._start_playback(self.current_song, start_at)
+                    STAGE_SECONDS.observe(time.perf_counter() - taken_at, 'song_start'); SONG_EVENTS.inc('started'); TRACKS.remember([self.current_song.to_index()], played=True)
+                await self._wait_for_song_end()
+
+                # Stream bị ngắt: tải file về rồi phát tiếp từ vị trí cũ (bài đã được nối liền mạch sang bài sau thì không)
+                if not self.handoff and self._stream_failed():
+                    SONG_EVENTS.inc('stream_failed'); resume_at = int(self.position()); log.warning(f"Guild {self.guild_id}: Stream '{self.current_song.title}' bị ngắt ở giây {resume_at}, chuyển sang tải về.")
+                    self.current_song.stream = False
+                    try: downloaded = await self.current_song.ensure_downloaded()
+                    except SchedulerBusy: downloaded = False
+                    if downloaded:
+                        self._start_playback(self.current_song, resume_at); await self._wait_for_song_end()
 
                 log.info(f"Guild {self.guild_id}: Sự kiện kết thúc bài hát '{self.current_song.title}' được kích hoạt.")
             except Exception as e:
@@ -166,54 +701,76 @@ class GuildState:
                 return await self.cleanup()
 
     async def update_now_playing_message(self,new_song=False):
+        """Hẹn cập nhật bảng Now Playing; nhiều thay đổi liên tiếp được gộp thành một lần sửa. `new_song` đưa bảng xuống cuối kênh nếu cần."""
+        self.now_playing_renderer.request(reposition=new_song)
+    @property
+    def control_view(self)->discord.ui.View:
+        if self._control_view is None:self._control_view=self.create_control_view()
+        return self._control_view
+    async def _render_now_playing(self,reposition:bool):
         if not self.last_ctx:return
-        if not self.current_song and self.now_playing_message:
-            try:await self.now_playing_message.delete()
-            except discord.NotFound:pass
-            self.now_playing_message=None;return
-        if not self.current_song:return
-        embed=self.create_now_playing_embed();view=self.create_control_view()
-        if new_song and self.now_playing_message:
-            try:await self.now_playing_message.delete()
-            except discord.NotFound:pass
-            self.now_playing_message=None
-        if self.now_playing_message:
-            try:await self.now_playing_message.edit(embed=embed,view=view);return
+        message=self.now_playing_message
+        if not self.current_song:
+            if message:
+                try:await message.delete()
+                except discord.NotFound:pass
+                self.now_playing_message=None;self.now_playing_digest=None
+            return
+        embed=self.create_now_playing_embed();digest=json.dumps(embed.to_dict(),sort_keys=True);channel=self.last_ctx.channel
+        # Chỉ gửi lại khi bảng cũ đã bị tin nhắn khác đẩy lên hoặc nằm ở kênh khác; còn lại thì sửa tại chỗ
+        if message and reposition and(message.channel.id!=channel.id or getattr(channel,'last_message_id',None)!=message.id):
+            try:await message.delete()
+            except discord.HTTPException:pass
+            message=self.now_playing_message=None
+        if message:
+            if digest==self.now_playing_digest:return # Nội dung không đổi, không tốn request
+            try:await message.edit(embed=embed);self.now_playing_digest=digest;return
             except discord.NotFound:self.now_playing_message=None
-        if not self.now_playing_message:
-            try:self.now_playing_message=await self.last_ctx.channel.send(embed=embed,view=view)
-            except(discord.Forbidden,discord.HTTPException)as e:log.warning(f"Không thể gửi/cập nhật tin nhắn Now Playing: {e}");self.now_playing_message=None
-    def create_now_playing_embed(self)->discord.Embed:song=self.current_song;embed=discord.Embed(title=song.title,url=song.url,color=0x39d0d6);embed.set_author(name=f"Đang phát 🎵 (Âm lượng: {int(self.volume*100)}%)",icon_url=self.bot.user.display_avatar.url);embed.set_thumbnail(url=song.thumbnail);embed.add_field(name="Nghệ sĩ",value=song.uploader or 'N/A',inline=True);embed.add_field(name="Thời lượng",value=song.format_duration(),inline=True);embed.add_field(name="Yêu cầu bởi",value=song.requester.mention,inline=True);loop_status={LoopMode.OFF:"Tắt",LoopMode.SONG:"🔁 Bài hát",LoopMode.QUEUE:"🔁 Hàng đợi"};next_song_title="Không có" if self.queue.empty()else self.queue._queue[0].title[:50]+"...";total_songs=self.queue.qsize()+(1 if self.current_song else 0);embed.set_footer(text=f"Tiếp theo: {next_song_title} | Lặp: {loop_status[self.loop_mode]} | Tổng cộng: {total_songs} bài");return embed
+        try:self.now_playing_message=await channel.send(embed=embed,view=self.control_view);self.now_playing_digest=digest
+        except(discord.Forbidden,discord.HTTPException)as e:log.warning(f"Không thể gửi/cập nhật tin nhắn Now Playing: {e}");self.now_playing_message=None
+    def create_now_playing_embed(self)->discord.Embed:song=self.current_song;embed=discord.Embed(title=song.title,url=song.url,color=0x39d0d6);embed.set_author(name=f"Đang phát 🎵 (Âm lượng: {int(self.volume*100)}%)",icon_url=self.bot.user.display_avatar.url);embed.set_thumbnail(url=song.thumbnail);embed.add_field(name="Nghệ sĩ",value=song.uploader or 'N/A',inline=True);embed.add_field(name="Thời lượng",value=song.format_duration(),inline=True);embed.add_field(name="Yêu cầu bởi",value=song.requester.mention,inline=True);loop_status={LoopMode.OFF:"Tắt",LoopMode.SONG:"🔁 Bài hát",LoopMode.QUEUE:"🔁 Hàng đợi"};next_song_title="Không có" if self.queue.empty()else self.queue.peek().title[:50]+"...";total_songs=self.queue.qsize()+(1 if self.current_song else 0);embed.set_footer(text=f"Tiếp theo: {next_song_title} | Lặp: {loop_status[self.loop_mode]} | Tổng cộng: {total_songs} bài");return embed
     def create_control_view(self)->discord.ui.View:view=discord.ui.View(timeout=None);pause_resume_btn=discord.ui.Button(emoji="⏯️",style=discord.ButtonStyle.secondary,custom_id=f"ctrl_pause_{self.guild_id}");skip_btn=discord.ui.Button(emoji="⏭️",style=discord.ButtonStyle.secondary,custom_id=f"ctrl_skip_{self.guild_id}");stop_btn=discord.ui.Button(emoji="⏹️",style=discord.ButtonStyle.danger,custom_id=f"ctrl_stop_{self.guild_id}");loop_btn=discord.ui.Button(emoji="🔁",style=discord.ButtonStyle.secondary,custom_id=f"ctrl_loop_{self.guild_id}");queue_btn=discord.ui.Button(label="Hàng đợi",emoji="📜",style=discord.ButtonStyle.primary,custom_id=f"ctrl_queue_{self.guild_id}");pause_resume_btn.callback=self.pause_resume_callback;skip_btn.callback=self.skip_callback;stop_btn.callback=self.stop_callback;loop_btn.callback=self.loop_callback;queue_btn.callback=self.queue_callback;view.add_item(pause_resume_btn);view.add_item(skip_btn);view.add_item(stop_btn);view.add_item(loop_btn);view.add_item(queue_btn);return view
     async def pause_resume_callback(self,interaction:discord.Interaction):
         if self.voice_client.is_paused():self.voice_client.resume();await interaction.response.send_message("▶️ Đã tiếp tục phát.",ephemeral=True)
         else:self.voice_client.pause();await interaction.response.send_message("⏸️ Đã tạm dừng.",ephemeral=True)
     async def skip_callback(self,interaction:discord.Interaction):
-        if self.voice_client and(self.voice_client.is_playing()or self.voice_client.is_paused()):self.voice_client.stop();await interaction.response.send_message("⏭️ Đã chuyển bài.",ephemeral=True)
+        if self.voice_client and(self.voice_client.is_playing()or self.voice_client.is_paused()):self.skip();await interaction.response.send_message("⏭️ Đã chuyển bài.",ephemeral=True)
         else:await interaction.response.send_message("Không có bài nào đang phát để chuyển.",ephemeral=True)
     async def stop_callback(self,interaction:discord.Interaction):await interaction.response.send_message("⏹️ Đang dừng phát nhạc và dọn dẹp hàng đợi...",ephemeral=True);await self.cleanup()
-    async def loop_callback(self,interaction:discord.Interaction):self.loop_mode=LoopMode((self.loop_mode.value+1)%3);log.info(f"Guild {self.guild_id} đã đổi chế độ lặp thành {self.loop_mode.name}");mode_text={LoopMode.OFF:"Tắt lặp.",LoopMode.SONG:"🔁 Lặp lại bài hát hiện tại.",LoopMode.QUEUE:"🔁 Lặp lại toàn bộ hàng đợi."};await interaction.response.send_message(mode_text[self.loop_mode],ephemeral=True);await self.update_now_playing_message()
-    async def queue_callback(self,interaction:discord.Interaction):
-        embed = self._create_queue_embed()
+    async def loop_callback(self,interaction:discord.Interaction):self.loop_mode=LoopMode((self.loop_mode.value+1)%3);log.info(f"Guild {self.guild_id} đã đổi chế độ lặp thành {self.loop_mode.name}");self.refresh_preroll();self.save();mode_text={LoopMode.OFF:"Tắt lặp.",LoopMode.SONG:"🔁 Lặp lại bài hát hiện tại.",LoopMode.QUEUE:"🔁 Lặp lại toàn bộ hàng đợi."};await interaction.response.send_message(mode_text[self.loop_mode],ephemeral=True);await self.update_now_playing_message()
+    async def queue_callback(self,interaction:discord.Interaction,page:int=1):
+        embed = self._create_queue_embed(page)
         if not embed: return await interaction.response.send_message("Hàng đợi trống!", ephemeral=True)
         await interaction.response.send_message(embed=embed,ephemeral=True)
-    def _create_queue_embed(self) -> discord.Embed | None:
+    def _create_queue_embed(self, page: int = 1) -> discord.Embed | None:
         if self.queue.empty() and not self.current_song: return None
         embed = discord.Embed(title="📜 Hàng đợi bài hát", color=discord.Color.gold())
         if self.current_song: embed.add_field(name="▶️ Đang phát", value=f"[{self.current_song.title}]({self.current_song.url}) - Y/c bởi {self.current_song.requester.mention}", inline=False)
-        queue_list = list(self.queue._queue)
-        if queue_list:
-            queue_text = "\n".join([f"`{i+1}.` [{song.title}]({song.url})" for i, song in enumerate(queue_list[:10])])
-            if len(queue_list) > 10: queue_text += f"\n... và {len(queue_list) - 10} bài hát khác."
-            embed.add_field(name="🎶 Tiếp theo", value=queue_text, inline=False)
-        embed.set_footer(text=f"Tổng cộng: {len(queue_list) + (1 if self.current_song else 0)} bài hát"); return embed
+        queue_size = self.queue.qsize(); total_pages = max(1, math.ceil(queue_size / 10)); page = min(max(page, 1), total_pages); start = (page - 1) * 10
+        if queue_size:
+            queue_text = "\n".join([f"`{i+1}.` [{song.title}]({song.url})" for i, song in enumerate(self.queue.slice(start, start + 10), start=start)])
+            if queue_size > start + 10: queue_text += f"\n... và {queue_size - start - 10} bài hát khác."
+            embed.add_field(name=f"🎶 Tiếp theo (Trang {page}/{total_pages})", value=queue_text, inline=False)
+        embed.set_footer(text=f"Tổng cộng: {queue_size + (1 if self.current_song else 0)} bài hát"); return embed
+    async def _idle_timeout(self):
+        if not self.waiting_for_song or not self.queue.empty(): return # Đã có bài mới ngay lúc hết hạn
+        log.info(f"Guild {self.guild_id} không hoạt động trong {IDLE_TIMEOUT:.0f} giây, bắt đầu dọn dẹp.")
+        if self.last_ctx and self.last_ctx.channel:
+            try: await self.last_ctx.channel.send("😴 Đã tự động ngắt kết nối do không hoạt động.")
+            except discord.Forbidden: pass
+        await self.cleanup()
+
     async def cleanup(self):
         log.info(f"Bắt đầu cleanup cho guild {self.guild_id}");self.bot.dispatch("session_end",self.guild_id)
         if self.player_task:self.player_task.cancel()
+        if self.playlist_task:self.playlist_task.cancel()
+        if self.resume_task:self.resume_task.cancel()
+        if self.preroll_task:self.preroll_task.cancel()
+        TIMERS.cancel(('idle',self.guild_id));TIMERS.cancel(('alone',self.guild_id));TIMERS.cancel(('preroll',self.guild_id));self.chain=None;self.preroll=None;self.handoff=None
+        self.prefetcher.stop();self.now_playing_renderer.stop()
+        if SESSIONS:SESSIONS.delete(self.guild_id)
         if self.current_song:self.current_song.cleanup(); self.current_song = None
-        while not self.queue.empty():
-            try:song=self.queue.get_nowait();song.cleanup()
-            except asyncio.QueueEmpty:break
+        for song in self.queue.clear():song.cleanup()
         if self.voice_client:await self.voice_client.disconnect(force=True);log.info(f"Đã ngắt kết nối voice client khỏi guild {self.guild_id}")
         if self.now_playing_message:
             try:await self.now_playing_message.delete()
@@ -229,18 +786,94 @@ class MainCog(commands.Cog, name="Miku"):
         self.miku_persona = "You are Hatsune Miku, the world-famous virtual singer. You always answer in Vietnamese. Your personality is cheerful, energetic, a bit quirky, and always helpful. Keep your answers very short and cute, like a real person chatting. Use kaomoji like (´• ω •`) ♡, ( ´ ▽ ` )ﾉ, (b ᵔ▽ᵔ)b frequently. Your favorite food is leeks. You are part of Project Galaxy by imnhyneko.dev."
         gemini_key = os.getenv("GEMINI_API_KEY")
         if gemini_key:
-            try: genai.configure(api_key=gemini_key); self.genai_model = genai.GenerativeModel('gemini-2.5-flash'); self.chat_sessions = {}
+            try: genai.configure(api_key=gemini_key); self.genai_model = genai.GenerativeModel('gemini-2.5-flash')
             except Exception as e: log.error(f"Không thể cấu hình Gemini AI: {e}"); self.genai_model = None
         else: self.genai_model = None; log.warning("Không tìm thấy GEMINI_API_KEY. Các chức năng AI sẽ bị vô hiệu hóa.")
+        persona_history = [{'role': 'user', 'parts': [self.miku_persona]}, {'role': 'model', 'parts': ["OK! Miku hiểu rồi! (´• ω •`) ♡"]}]
+        self.chat_sessions = ChatSessionManager(self.genai_model, persona_history, CHAT_MAX_TOKENS, CHAT_TTL, CHAT_MAX_SESSIONS, CHAT_SUMMARIZE)
+        self.saved_sessions: dict[int, dict] = {}; self.checkpoint_task: asyncio.Task | None = None
+        self.loop_lag = metrics.LoopLagMonitor(); self.metrics_runner = None; self._register_gauges()
+
+    def _register_gauges(self):
+        """Các gauge chỉ được tính khi /metrics được đọc, không tốn gì khi bot đang phát nhạc."""
+        registry = metrics.REGISTRY; queue_sizes = lambda: [state.queue.qsize() for state in self.states.values()]
+        registry.gauge('miku_guild_states', 'Số GuildState đang hoạt động', lambda: len(self.states))
+        registry.gauge('miku_voice_clients', 'Số kênh thoại đang kết nối', lambda: len(self.bot.voice_clients))
+        registry.gauge('miku_queue_songs', 'Tổng số bài trong hàng đợi của mọi guild', lambda: sum(queue_sizes()))
+        registry.gauge('miku_queue_depth_max', 'Hàng đợi dài nhất', lambda: max(queue_sizes(), default=0))
+        registry.gauge('miku_extractor_running', 'Số việc yt-dlp đang chạy', lambda: EXTRACTOR.stats()['running'])
+        registry.gauge('miku_extractor_pending', 'Số việc yt-dlp đang chờ', lambda: EXTRACTOR.stats()['pending'])
+        registry.gauge('miku_extractor_workers', 'Số worker yt-dlp tối đa', lambda: EXTRACTOR.stats()['max_workers'])
+        if not EXTRACTOR.use_processes: # Ở chế độ process, pool nằm trong các process con nên số liệu ở đây luôn là 0
+            registry.gauge('miku_ytdl_pool_hits_total', 'Số lần dùng lại instance yt-dlp có sẵn trong pool', lambda: ytdl.pool_stats()['hits'], kind='counter')
+            registry.gauge('miku_ytdl_pool_misses_total', 'Số lần phải tạo instance yt-dlp mới', lambda: ytdl.pool_stats()['misses'], kind='counter')
+            registry.gauge('miku_ytdl_pool_instances', 'Số instance yt-dlp đã tạo', lambda: ytdl.pool_stats()['instances'])
+        registry.gauge('miku_extractor_promoted_total', 'Số việc nền được đưa lên ưu tiên cao vì người dùng đang chờ', lambda: EXTRACTOR.stats()['promoted'], kind='counter')
+        registry.gauge('miku_extractor_rejected_total', 'Số yêu cầu bị từ chối vì scheduler đầy', lambda: EXTRACTOR.stats()['rejected'], kind='counter')
+        registry.gauge('miku_audio_cache_bytes', 'Dung lượng cache âm thanh', lambda: AUDIO_CACHE.stats()['bytes'])
+        registry.gauge('miku_audio_cache_entries', 'Số file trong cache âm thanh', lambda: len(AUDIO_CACHE))
+        registry.gauge('miku_audio_cache_hits_total', 'Số lần trúng cache âm thanh', lambda: AUDIO_CACHE.stats()['hits'], kind='counter')
+        registry.gauge('miku_audio_cache_misses_total', 'Số lần trượt cache âm thanh', lambda: AUDIO_CACHE.stats()['misses'], kind='counter')
+        registry.gauge('miku_search_cache_hits_total', 'Số lần trúng cache tìm kiếm', lambda: SEARCH_CACHE.hits, kind='counter')
+        registry.gauge('miku_lyrics_cache_hits_total', 'Số lần trúng cache lời bài hát', lambda: LYRICS.hits, kind='counter')
+        registry.gauge('miku_lyrics_requests_merged_total', 'Số yêu cầu lời bài hát được gộp vào lần gọi đang chạy', lambda: LYRICS.merged, kind='counter')
+        registry.gauge('miku_chat_sessions', 'Số phiên trò chuyện Gemini đang giữ', lambda: len(self.chat_sessions))
+        registry.gauge('miku_chat_sessions_evicted_total', 'Số phiên trò chuyện bị xóa vì nhàn rỗi hoặc vượt giới hạn', lambda: self.chat_sessions.evicted, kind='counter')
+        registry.gauge('miku_broadcasts', 'Số nguồn radio phát chung đang mở', lambda: len(BROADCASTS))
+        registry.gauge('miku_broadcast_listeners', 'Số voice client đang nghe các nguồn radio phát chung', BROADCASTS.listeners)
+        registry.gauge('miku_broadcasts_stalled', 'Số nguồn radio phát chung không ra dữ liệu quá 0.5s (người nghe đang nhận frame im lặng)', BROADCASTS.stalled)
+        registry.gauge('miku_broadcasts_started_total', 'Số lần mở nguồn radio phát chung (mỗi lần một FFmpeg)', lambda: BROADCASTS.started, kind='counter')
+        registry.gauge('miku_track_index_lookups_total', 'Số lần tra danh mục bài hát (theo link hoặc theo tên)', lambda: TRACKS.lookups, kind='counter')
+        registry.gauge('miku_track_index_hits_total', 'Số lần tra danh mục bài hát có kết quả (không cần gọi yt-dlp)', lambda: TRACKS.hits, kind='counter')
+        registry.gauge('miku_search_speculation_hit_ratio', 'Tỉ lệ bài được chọn trong bảng tìm kiếm đã tải trước xong', lambda: SPECULATION.value('hit') / max(1, sum(SPECULATION.value(r) for r in ('hit', 'partial', 'miss'))))
+        registry.gauge('miku_search_speculation_bytes', 'Dung lượng ước tính đang giữ chỗ cho việc tải trước kết quả tìm kiếm', lambda: SearchView.speculative_bytes)
+        registry.gauge('miku_timers_pending', 'Số hạn chờ đang hẹn trong TIMERS', lambda: len(TIMERS))
+        registry.gauge('miku_search_cache_misses_total', 'Số lần trượt cache tìm kiếm', lambda: SEARCH_CACHE.misses, kind='counter')
+
+    async def cog_load(self):
+        self.loop_lag.start()
+        if METRICS_PORT:
+            try: self.metrics_runner = await metrics.start_http_server(METRICS_HOST, METRICS_PORT)
+            except OSError as e: log.error(f"Không thể mở endpoint metrics trên cổng {METRICS_PORT}: {e}")
+        if not SESSIONS: return
+        try: self.saved_sessions = await SESSIONS.load_all()
+        except Exception as e: log.error("Không thể đọc các phiên đã lưu:", exc_info=e)
+        if self.saved_sessions: log.info(f"Có {len(self.saved_sessions)} phiên nghe nhạc sẽ được khôi phục khi server được dùng lại.")
+        self.checkpoint_task = asyncio.create_task(self._checkpoint_loop())
+
+    async def cog_unload(self):
+        if self.checkpoint_task: self.checkpoint_task.cancel()
+        self.loop_lag.stop(); TIMERS.stop(); BROADCASTS.stop()
+        if self.metrics_runner: await self.metrics_runner.cleanup()
+        await self.session.close(); AUDIO_CACHE.flush(); EXTRACTOR.shutdown(); LOUDNESS.stop(); await LYRICS.close(); await TRACKS.close()
+        if SESSIONS:
+            for state in self.states.values(): state.save()
+            await SESSIONS.close()
+
+    async def _checkpoint_loop(self):
+        """Định kỳ lưu vị trí phát của các guild đang phát, để crash cũng chỉ mất vài giây."""
+        while True:
+            await asyncio.sleep(SESSION_CHECKPOINT_INTERVAL)
+            for state in list(self.states.values()):
+                if state.current_song: state.save()
 
-    def cog_unload(self): self.bot.loop.create_task(self.session.close())
     def get_guild_state(self, guild_id: int) -> GuildState:
-        if guild_id not in self.states: self.states[guild_id] = GuildState(self.bot, guild_id)
+        if guild_id not in self.states:
+            self.states[guild_id] = GuildState(self.bot, guild_id)
+            # Phiên từ lần chạy trước chỉ được khôi phục khi guild được dùng lại
+            snapshot = self.saved_sessions.pop(guild_id, None)
+            if snapshot: self.states[guild_id].restore(snapshot)
         return self.states[guild_id]
+
+    async def get_settled_state(self, guild_id: int) -> GuildState:
+        """Như get_guild_state, nhưng chờ phiên vừa khôi phục vào lại kênh thoại trước khi lệnh điều khiển kiểm tra voice client."""
+        state = self.get_guild_state(guild_id); await state.settle(); return state
     
     @commands.Cog.listener()
     async def on_guild_join(self, guild: discord.Guild):
         log.info(f"Đã tham gia server mới: {guild.name} ({guild.id}). Bắt đầu đồng bộ lệnh...")
+        command_sync = getattr(self.bot, 'command_sync', None)
+        if command_sync: await command_sync.on_guild_join(guild); return
         try: await self.bot.tree.sync(guild=guild); log.info(f"Đã đồng bộ lệnh thành công cho {guild.name}.")
         except Exception as e: log.error(f"Lỗi khi đồng bộ lệnh cho server mới {guild.name}:", exc_info=e)
     @commands.Cog.listener()
@@ -250,16 +883,24 @@ class MainCog(commands.Cog, name="Miku"):
     async def on_voice_state_update(self, member, before, after):
         if not member.guild.voice_client or member.bot: return
         vc = member.guild.voice_client
+        # Mỗi guild chỉ có một hạn chờ, tính từ lúc bắt đầu ở một mình; có người vào lại thì hủy
+        key = ('alone', member.guild.id)
         if len(vc.channel.members) == 1:
-            log.info(f"Bot ở một mình trong kênh {vc.channel.name}, sẽ tự ngắt kết nối sau 5m.")
-            await asyncio.sleep(900)
-            if vc and len(vc.channel.members) == 1:
-                log.info(f"Vẫn chỉ có một mình, đang ngắt kết nối...")
-                state = self.get_guild_state(member.guild.id)
-                if state.last_ctx:
-                    try: await state.last_ctx.channel.send("👋 Tạm biệt! Miku sẽ rời đi vì không có ai nghe cùng.")
-                    except discord.Forbidden: pass
-                await state.cleanup()
+            if key not in TIMERS:
+                log.info(f"Bot ở một mình trong kênh {vc.channel.name}, sẽ tự ngắt kết nối sau {ALONE_TIMEOUT:.0f} giây.")
+                TIMERS.schedule(key, ALONE_TIMEOUT, lambda: self._leave_if_alone(member.guild.id))
+        else: TIMERS.cancel(key)
+
+    async def _leave_if_alone(self, guild_id: int):
+        guild = self.bot.get_guild(guild_id); vc = guild.voice_client if guild else None
+        if not vc or len(vc.channel.members) != 1: return
+        log.info(f"Vẫn chỉ có một mình, đang ngắt kết nối...")
+        state = self.states.get(guild_id)
+        if not state: return await vc.disconnect(force=True)
+        if state.last_ctx:
+            try: await state.last_ctx.channel.send("👋 Tạm biệt! Miku sẽ rời đi vì không có ai nghe cùng.")
+            except discord.Forbidden: pass
+        await state.cleanup()
     
     async def _send_response(self, ctx: AnyContext, *args, **kwargs):
         ephemeral = kwargs.get('ephemeral', False)
@@ -271,43 +912,81 @@ class MainCog(commands.Cog, name="Miku"):
         prefix = self.bot.command_prefix
         embed = discord.Embed(title="✨ Menu trợ giúp của Miku ✨", description="Miku sẵn sàng giúp bạn thưởng thức âm nhạc tuyệt vời nhất! (´• ω •`) ♡", color=0x39d0d6)
         embed.set_author(name=self.bot.user.name, icon_url=self.bot.user.display_avatar.url); embed.set_thumbnail(url="https://cdn.discordapp.com/attachments/1319215782089199616/1384577698315370587/6482863b5c8c3328433411f2-anime-hatsune-miku-plush-toy-series-snow.gif?ex=6852eff7&is=68519e77&hm=c89ddf3b2d3d2801118f537a45a6b67fcdd77cdb5c28d17ec6df791a040bac23&")
-        embed.add_field(name="🎧 Lệnh Âm Nhạc (Cơ bản)", value=f"`play <tên/url>`: Phát hoặc tìm kiếm bài hát.\n`pause`: Tạm dừng/tiếp tục phát.\n`skip`: Bỏ qua bài hát hiện tại.\n`stop`: Dừng nhạc và rời kênh.", inline=False)
-        embed.add_field(name="📜 Lệnh Hàng đợi", value=f"`queue`: Xem hàng đợi hiện tại.\n`shuffle`: Xáo trộn thứ tự hàng đợi.\n`remove <số>`: Xóa bài hát khỏi hàng đợi.\n`clear`: Xóa sạch hàng đợi.", inline=False)
+        embed.add_field(name="🎧 Lệnh Âm Nhạc (Cơ bản)", value=f"`play <tên/url>`: Phát hoặc tìm kiếm bài hát.\n`stream <tên/url>`: Phát trực tiếp không cần chờ tải về.\n`radio <url>`: Nghe radio/livestream chung với các server khác.\n`pause`: Tạm dừng/tiếp tục phát.\n`skip`: Bỏ qua bài hát hiện tại.\n`stop`: Dừng nhạc và rời kênh.", inline=False)
+        embed.add_field(name="📜 Lệnh Hàng đợi", value=f"`queue`: Xem hàng đợi hiện tại.\n`shuffle`: Xáo trộn thứ tự hàng đợi.\n`remove <số>`: Xóa bài hát khỏi hàng đợi.\n`move <số> <vị trí>`: Chuyển bài hát tới vị trí khác.\n`clear`: Xóa sạch hàng đợi.", inline=False)
         embed.add_field(name="⚙️ Lệnh Tiện ích", value=f"`nowplaying`: Hiển thị lại bảng điều khiển.\n`volume <0-200>`: Chỉnh âm lượng.\n`seek <thời gian>`: Tua nhạc (vd: `1:23`).\n`lyrics`: Tìm lời bài hát đang phát.", inline=False)
         embed.add_field(name="💬 Lệnh AI & Chung", value=f"`chat <tin nhắn>`: Trò chuyện với Miku!\n`help`: Hiển thị bảng trợ giúp này.\n`ping`: Kiểm tra độ trễ của Miku.", inline=False)
         embed.set_footer(text=f"Sử dụng lệnh với / (slash) hoặc {prefix} (prefix) • HatsuneMikuv2 | Project Galaxy by imnhyneko.dev", icon_url="https://avatars.githubusercontent.com/u/119964287?v=4")
         return embed
 
-    async def _play_logic(self, ctx: AnyContext, query: Optional[str]):
+    async def _play_logic(self, ctx: AnyContext, query: Optional[str], stream: Optional[bool] = None):
         state = self.get_guild_state(ctx.guild.id); state.last_ctx = ctx; author = ctx.author if isinstance(ctx, commands.Context) else ctx.user
         if not author.voice or not author.voice.channel: return await self._send_response(ctx, "Bạn phải ở trong một kênh thoại để dùng lệnh này!", ephemeral=True)
         if not query:
+            await state.settle()
             if state.voice_client and state.voice_client.is_paused(): state.voice_client.resume(); await self._send_response(ctx, "▶️ Đã tiếp tục phát nhạc.", ephemeral=True)
             elif state.voice_client and state.voice_client.is_playing(): state.voice_client.pause(); await self._send_response(ctx, "⏯️ Đã tạm dừng nhạc.", ephemeral=True)
             else: await self._send_response(ctx, "Không có nhạc nào đang phát hoặc tạm dừng.", ephemeral=True)
             return
+        started = time.perf_counter()
         if isinstance(ctx, discord.Interaction): await ctx.response.defer(ephemeral=False)
         else: await ctx.message.add_reaction("⏳")
-        if not state.voice_client or not state.voice_client.is_connected():
-            state.voice_client = await author.voice.channel.connect()
-        else:
-            if state.voice_client.channel != author.voice.channel:
-                await state.voice_client.move_to(author.voice.channel)
+        with STAGE_SECONDS.time('voice_connect'): await state.connect(author.voice.channel)
         
-        if query.startswith(('http://', 'https://')):
-            song = await Song.from_url_and_download(query, author)
+        try: await self._enqueue_query(ctx, state, author, query, stream)
+        except SchedulerBusy as e: await self._send_response(ctx, e.message)
+        if isinstance(ctx, commands.Context): await ctx.message.remove_reaction("⏳", self.bot.user)
+        STAGE_SECONDS.observe(time.perf_counter() - started, 'play_command')
+
+    async def _enqueue_query(self, ctx: AnyContext, state: GuildState, author: discord.Member, query: str, stream: Optional[bool]):
+        if query.startswith(('http://', 'https://')) and ytdl.looks_like_playlist(query): await self._enqueue_playlist(ctx, state, author, query, stream)
+        elif query.startswith(('http://', 'https://')):
+            song = await Song.resolve(query, author)
             if song:
-                await state.queue.put(song); response_message = f"✅ Đã thêm **{song.title}** vào hàng đợi."
+                if stream is not None: song.stream = stream
+                await state.enqueue(song); response_message = f"✅ Đã thêm **{song.title}** vào hàng đợi."
                 if isinstance(ctx, discord.Interaction) and ctx.response.is_done(): await ctx.followup.send(response_message)
                 else: await self._send_response(ctx, response_message)
-                if state.player_task is None or state.player_task.done(): state.player_task = asyncio.create_task(state.player_loop())
             else: await self._send_response(ctx, f"❌ Không thể tải về từ URL: `{query}`")
         else:
+            # Tên trùng khớp một bài đã có file trong cache: phát luôn, không cần tìm trên YouTube
+            track = await TRACKS.find_exact(query)
+            if track and AUDIO_CACHE.get(track['id']): return await self._enqueue_query(ctx, state, author, track['url'], stream)
             search_results = await Song.search_only(query, author)
             if not search_results: await self._send_response(ctx, f"❓ Không tìm thấy kết quả nào cho: `{query}`")
-            else: search_view = SearchView(music_cog=self, ctx=ctx, results=search_results); await search_view.start()
-        if isinstance(ctx, commands.Context): await ctx.message.remove_reaction("⏳", self.bot.user)
+            else:
+                if stream is not None:
+                    for result in search_results: result.stream = stream
+                search_view = SearchView(music_cog=self, ctx=ctx, results=search_results); await search_view.start()
     
+    async def _radio_logic(self, ctx: AnyContext, url: str):
+        """Thêm một radio/livestream vào hàng đợi. Các guild nghe cùng một URL dùng chung một luồng phát (xem BROADCASTS)."""
+        state = self.get_guild_state(ctx.guild.id); state.last_ctx = ctx; author = ctx.author if isinstance(ctx, commands.Context) else ctx.user
+        if not author.voice or not author.voice.channel: return await self._send_response(ctx, "Bạn phải ở trong một kênh thoại để dùng lệnh này!", ephemeral=True)
+        if not url.startswith(('http://', 'https://')): return await self._send_response(ctx, "Radio cần một URL (livestream, link bài hát hoặc link phát trực tuyến).", ephemeral=True)
+        if isinstance(ctx, discord.Interaction): await ctx.response.defer(ephemeral=False)
+        with STAGE_SECONDS.time('voice_connect'): await state.connect(author.voice.channel)
+        try: song = await Song.resolve(url, author)
+        except SchedulerBusy as e: return await self._send_response(ctx, e.message)
+        if not song: return await self._send_response(ctx, f"❌ Không thể mở radio từ URL: `{url}`")
+        song.radio = True; song.stream = not song.filepath; await state.enqueue(song)
+        await self._send_response(ctx, f"📻 Đã thêm radio **{song.title}** vào hàng đợi. Mọi server nghe cùng radio này sẽ nghe cùng lúc với nhau.")
+
+    async def _enqueue_playlist(self, ctx: AnyContext, state: GuildState, author: discord.Member, url: str, stream: Optional[bool]):
+        if state.playlist_task and not state.playlist_task.done(): return await self._send_response(ctx, "📃 Miku đang nạp một danh sách phát khác, bạn đợi xong rồi thêm tiếp nhé!")
+        # Chỉ lấy trang đầu tiên là đủ để bắt đầu phát, phần còn lại được nạp dần trong nền
+        try: data = await EXTRACTOR.run(ctx.guild.id, Priority.INTERACTIVE, ytdl.extract_playlist_page, YTDL_PLAYLIST_OPTIONS, url, 1, PLAYLIST_PAGE_SIZE)
+        except SchedulerBusy: raise
+        except Exception as e: log.error(f"Lỗi yt-dlp khi ĐỌC PLAYLIST '{url}': {e}", exc_info=True); data = None
+        songs = state.playlist_songs(data, author, stream)[:PLAYLIST_MAX_TRACKS]
+        if not songs: return await self._send_response(ctx, f"❌ Không thể đọc danh sách phát: `{url}`")
+        for song in songs: await state.enqueue(song)
+        response_message = f"📃 Đã thêm **{len(songs)}** bài từ danh sách phát **{data.get('title') or url}**."
+        if len(data['entries']) >= PLAYLIST_PAGE_SIZE and len(songs) < PLAYLIST_MAX_TRACKS:
+            state.playlist_task = asyncio.create_task(state.feed_playlist(url, author, stream, PLAYLIST_PAGE_SIZE + 1, len(songs)))
+            response_message += f" Các bài còn lại (tối đa {PLAYLIST_MAX_TRACKS} bài) sẽ được thêm dần khi hàng đợi gần hết."
+        await self._send_response(ctx, response_message)
+
     async def _lyrics_logic(self, ctx: AnyContext):
         if not self.genai_model: return await self._send_response(ctx, "Chức năng AI chưa được cấu hình bởi chủ bot.", ephemeral=True)
         state = self.get_guild_state(ctx.guild.id)
@@ -316,12 +995,16 @@ class MainCog(commands.Cog, name="Miku"):
         else: await ctx.message.add_reaction("🔍")
         title = state.current_song.title; uploader = state.current_song.uploader
         cleaned_title = re.sub(r'\(.*\)|\[.*\]|official lyric video|official music video|mv|ft\..*', '', title, flags=re.IGNORECASE).strip()
-        cleaned_uploader = re.sub(r' - Topic', '', uploader, flags=re.IGNORECASE).strip()
+        cleaned_uploader = re.sub(r' - Topic', '', uploader or '', flags=re.IGNORECASE).strip()
         prompt = f"Please provide the full, clean lyrics for the song titled '{cleaned_title}' by the artist '{cleaned_uploader}'. Only return the lyrics text, without any extra formatting, titles, or comments like '[Verse]' or '[Chorus]'."
-        try:
+        async def fetch_lyrics() -> Optional[str]:
             log.info(f"Đang gửi yêu cầu lời bài hát đến Gemini cho: {cleaned_title}")
-            response = await self.genai_model.generate_content_async(prompt)
-            lyrics = response.text
+            response = await self.genai_model.generate_content_async(prompt); text = response.text
+            # Câu trả lời kiểu "không tìm thấy" được cache như kết quả rỗng (với TTL ngắn hơn)
+            if not text or "I'm sorry" in text or "cannot find" in text or "I am unable" in text: return None
+            return text
+        try:
+            with STAGE_SECONDS.time('lyrics'): lyrics = await LYRICS.get_or_fetch(cleaned_title, cleaned_uploader, fetch_lyrics)
         except Exception as e:
             log.error(f"Lỗi khi gọi Gemini API cho lời bài hát: {e}")
             if isinstance(ctx, commands.Context): await ctx.message.remove_reaction("🔍", self.bot.user)
@@ -329,8 +1012,8 @@ class MainCog(commands.Cog, name="Miku"):
         if isinstance(ctx, commands.Context): await ctx.message.remove_reaction("🔍", self.bot.user)
         embed = discord.Embed(title=f"🎤 Lời bài hát: {title}", color=0x39d0d6, url=state.current_song.url)
         embed.set_thumbnail(url=state.current_song.thumbnail)
+        if not lyrics: return await self._send_response(ctx, f"Rất tiếc, Miku không tìm thấy lời bài hát cho `{title}`. (´-ω-`)", ephemeral=True)
         if len(lyrics) > 4096: lyrics = lyrics[:4090] + "\n\n**[Lời bài hát quá dài và đã được cắt bớt]**"
-        if not lyrics or "I'm sorry" in lyrics or "cannot find" in lyrics or "I am unable" in lyrics: return await self._send_response(ctx, f"Rất tiếc, Miku không tìm thấy lời bài hát cho `{title}`. (´-ω-`)", ephemeral=True)
         embed.description = lyrics
         await self._send_response(ctx, embed=embed, ephemeral=True)
 
@@ -340,37 +1023,34 @@ class MainCog(commands.Cog, name="Miku"):
         else:
             async with ctx.typing(): await asyncio.sleep(0)
         try:
-            guild_id = ctx.guild.id
-            if guild_id not in self.chat_sessions:
-                self.chat_sessions[guild_id] = self.genai_model.start_chat(history=[{'role': 'user', 'parts': [self.miku_persona]}, {'role': 'model', 'parts': ["OK! Miku hiểu rồi! (´• ω •`) ♡"]}])
-            chat_session = self.chat_sessions[guild_id]
-            response = await chat_session.send_message_async(message)
-            await self._send_response(ctx, response.text)
+            # Tin nhắn cùng guild được xếp hàng, lịch sử gửi kèm luôn nằm trong ngân sách MIKU_CHAT_MAX_TOKENS
+            text = await self.chat_sessions.send(ctx.guild.id, message)
+            await self._send_response(ctx, text)
         except Exception as e:
             log.error(f"Lỗi khi gọi Gemini API: {e}"); await self._send_response(ctx, "Miku đang bị quá tải một chút, bạn thử lại sau nhé! (｡•́︿•̀｡)", ephemeral=True)
     
     async def _stop_logic(self, ctx: AnyContext):
-        state = self.get_guild_state(ctx.guild.id)
-        if state.voice_client: await self._send_response(ctx, "⏹️ Đã dừng phát nhạc và dọn dẹp hàng đợi."); await state.cleanup()
+        state = await self.get_settled_state(ctx.guild.id)
+        # Phiên khôi phục chưa kịp (hoặc không thể) vào kênh thoại cũng phải dừng: hủy việc vào lại và xóa phiên đã lưu
+        if state.voice_client or state.resuming or not state.queue.empty(): await self._send_response(ctx, "⏹️ Đã dừng phát nhạc và dọn dẹp hàng đợi."); await state.cleanup()
         else: await self._send_response(ctx, "Miku không ở trong kênh thoại nào cả.", ephemeral=True)
     async def _skip_logic(self, ctx: AnyContext):
-        state = self.get_guild_state(ctx.guild.id)
-        if state.voice_client and (state.voice_client.is_playing() or state.voice_client.is_paused()): state.voice_client.stop(); await self._send_response(ctx, "⏭️ Đã chuyển bài.", ephemeral=True)
+        state = await self.get_settled_state(ctx.guild.id)
+        if state.voice_client and (state.voice_client.is_playing() or state.voice_client.is_paused()): state.skip(); await self._send_response(ctx, "⏭️ Đã chuyển bài.", ephemeral=True)
         else: await self._send_response(ctx, "Không có bài nào đang phát để chuyển.", ephemeral=True)
     async def _pause_logic(self, ctx: AnyContext):
-        state = self.get_guild_state(ctx.guild.id)
+        state = await self.get_settled_state(ctx.guild.id)
         if state.voice_client and state.voice_client.is_playing(): state.voice_client.pause(); await self._send_response(ctx, "⏸️ Đã tạm dừng nhạc.", ephemeral=True)
         elif state.voice_client and state.voice_client.is_paused(): state.voice_client.resume(); await self._send_response(ctx, "▶️ Đã tiếp tục phát nhạc.", ephemeral=True)
         else: await self._send_response(ctx, "Không có nhạc nào đang phát để tạm dừng/tiếp tục.", ephemeral=True)
     async def _volume_logic(self, ctx: AnyContext, value: int):
-        state = self.get_guild_state(ctx.guild.id)
+        state = await self.get_settled_state(ctx.guild.id)
         if not state.voice_client: return await self._send_response(ctx, "Miku chưa vào kênh thoại.", ephemeral=True)
         if not 0 <= value <= 200: return await self._send_response(ctx, "Âm lượng phải trong khoảng từ 0 đến 200.", ephemeral=True)
-        state.volume = value / 100
-        if state.voice_client.source: state.voice_client.source.volume = state.volume
+        await state.set_volume(value / 100)
         await self._send_response(ctx, f"🔊 Đã đặt âm lượng thành **{value}%**."); await state.update_now_playing_message()
     async def _seek_logic(self, ctx: AnyContext, timestamp: str):
-        state = self.get_guild_state(ctx.guild.id)
+        state = await self.get_settled_state(ctx.guild.id)
         if not state.voice_client or not state.current_song: return await self._send_response(ctx, "Không có bài hát nào đang phát để tua.", ephemeral=True)
         match = re.match(r'(?:(\d+):)?(\d+)', timestamp)
         if not match:
@@ -378,31 +1058,31 @@ class MainCog(commands.Cog, name="Miku"):
             except ValueError: return await self._send_response(ctx, "Định dạng thời gian không hợp lệ. Hãy dùng `phút:giây` hoặc `giây`.", ephemeral=True)
         else:
             minutes = int(match.group(1) or 0); seconds = int(match.group(2)); seconds += minutes * 60
-        if not 0 <= seconds < state.current_song.duration: return await self._send_response(ctx, "Không thể tua đến thời điểm không hợp lệ.", ephemeral=True)
-        state.is_seeking = True
-        ffmpeg_options_seek = FFMPEG_OPTIONS.copy(); ffmpeg_options_seek['before_options'] = f"-ss {seconds}"
-        new_source = discord.PCMVolumeTransformer(discord.FFmpegPCMAudio(state.current_song.filepath, **ffmpeg_options_seek), volume=state.volume)
-        state.voice_client.stop(); state.voice_client.play(new_source, after=lambda e: self.bot.loop.call_soon_threadsafe(state.song_finished_event.set))
+        if state.current_song.duration is None or not 0 <= seconds < state.current_song.duration: return await self._send_response(ctx, "Không thể tua đến thời điểm không hợp lệ.", ephemeral=True)
+        with STAGE_SECONDS.time('seek'): seeked = await state.seek(seconds)
+        if not seeked: return await self._send_response(ctx, "Không thể tua bài hát này lúc này, bạn thử lại sau nhé.", ephemeral=True)
         await self._send_response(ctx, f"⏩ Đã tua đến `{seconds}` giây.")
     async def _shuffle_logic(self, ctx: AnyContext):
         state = self.get_guild_state(ctx.guild.id)
         if state.queue.qsize()<2:return await self._send_response(ctx,"Không đủ bài hát để xáo trộn.", ephemeral=True)
-        queue_list=list(state.queue._queue);random.shuffle(queue_list)
-        while not state.queue.empty(): state.queue.get_nowait()
-        for song in queue_list: await state.queue.put(song)
+        state.queue.shuffle(); state.prefetcher.kick(); state.refresh_preroll(); state.save()
         await self._send_response(ctx,"🔀 Đã xáo trộn hàng đợi!")
     async def _remove_logic(self, ctx: AnyContext, index: int):
         state = self.get_guild_state(ctx.guild.id)
         if index <= 0 or index > state.queue.qsize(): return await self._send_response(ctx,"Số thứ tự không hợp lệ.", ephemeral=True)
-        queue_list=list(state.queue._queue);removed_song=queue_list.pop(index-1);removed_song.cleanup()
-        while not state.queue.empty(): state.queue.get_nowait()
-        for song in queue_list: await state.queue.put(song)
+        removed_song=state.queue.remove(index-1);state.refresh_preroll();removed_song.cleanup();state.prefetcher.kick();state.save()
         await self._send_response(ctx, f"🗑️ Đã xóa **{removed_song.title}** khỏi hàng đợi.")
+    async def _move_logic(self, ctx: AnyContext, index: int, position: int):
+        state = self.get_guild_state(ctx.guild.id); size = state.queue.qsize()
+        if not (0 < index <= size and 0 < position <= size): return await self._send_response(ctx,"Số thứ tự không hợp lệ.", ephemeral=True)
+        moved_song=state.queue.move(index-1, position-1);state.prefetcher.kick();state.refresh_preroll();state.save()
+        await self._send_response(ctx, f"↕️ Đã chuyển **{moved_song.title}** tới vị trí {position} trong hàng đợi.")
     async def _clear_logic(self, ctx: AnyContext):
         state = self.get_guild_state(ctx.guild.id); count = 0
-        while not state.queue.empty():
-            try: song=state.queue.get_nowait();song.cleanup();count+=1
-            except asyncio.QueueEmpty: break
+        if state.playlist_task: state.playlist_task.cancel()
+        songs = state.queue.clear(); state.refresh_preroll()
+        for song in songs: song.cleanup(); count += 1
+        state.save()
         await self._send_response(ctx, f"💥 Đã xóa sạch {count} bài hát khỏi hàng đợi.")
         
     @commands.command(name="ping")
@@ -413,6 +1093,10 @@ class MainCog(commands.Cog, name="Miku"):
     async def prefix_chat(self, ctx: commands.Context, *, message: str): await self._chat_logic(ctx, message=message)
     @commands.command(name="play", aliases=['p'])
     async def prefix_play(self, ctx: commands.Context, *, query: str = None): await self._play_logic(ctx, query)
+    @commands.command(name="stream")
+    async def prefix_stream(self, ctx: commands.Context, *, query: str): await self._play_logic(ctx, query, stream=True)
+    @commands.command(name="radio")
+    async def prefix_radio(self, ctx: commands.Context, *, url: str): await self._radio_logic(ctx, url)
     @commands.command(name="pause", aliases=['resume'])
     async def prefix_pause(self, ctx: commands.Context): await self._pause_logic(ctx)
     @commands.command(name="stop", aliases=['leave', 'disconnect'])
@@ -420,8 +1104,8 @@ class MainCog(commands.Cog, name="Miku"):
     @commands.command(name="skip", aliases=['s', 'fs'])
     async def prefix_skip(self, ctx: commands.Context): await self._skip_logic(ctx)
     @commands.command(name="queue", aliases=['q'])
-    async def prefix_queue(self, ctx: commands.Context):
-        state = self.get_guild_state(ctx.guild.id); embed = state._create_queue_embed()
+    async def prefix_queue(self, ctx: commands.Context, page: int = 1):
+        state = self.get_guild_state(ctx.guild.id); embed = state._create_queue_embed(page)
         if not embed: await self._send_response(ctx, "Hàng đợi trống!"); return
         await self._send_response(ctx, embed=embed)
     @commands.command(name="nowplaying", aliases=['np'])
@@ -433,6 +1117,8 @@ class MainCog(commands.Cog, name="Miku"):
     async def prefix_shuffle(self, ctx: commands.Context): await self._shuffle_logic(ctx)
     @commands.command(name="remove")
     async def prefix_remove(self, ctx: commands.Context, index: int): await self._remove_logic(ctx, index)
+    @commands.command(name="move", aliases=['mv'])
+    async def prefix_move(self, ctx: commands.Context, index: int, position: int): await self._move_logic(ctx, index, position)
     @commands.command(name="clear")
     async def prefix_clear(self, ctx: commands.Context): await self._clear_logic(ctx)
     @commands.command(name="seek")
@@ -449,8 +1135,24 @@ class MainCog(commands.Cog, name="Miku"):
     async def slash_chat(self, interaction: discord.Interaction, message: str): await self._chat_logic(interaction, message=message)
     
     @music_group.command(name="play", description="Phát nhạc, thêm vào hàng đợi, hoặc tạm dừng/tiếp tục.")
-    @app_commands.describe(query="Tên bài hát, URL, hoặc để trống để tạm dừng/tiếp tục.")
-    async def slash_play(self, interaction: discord.Interaction, query: Optional[str] = None): await self._play_logic(interaction, query)
+    @app_commands.describe(query="Tên bài hát, URL, hoặc để trống để tạm dừng/tiếp tục.", stream="Phát trực tiếp không cần chờ tải về (phù hợp với bài dài hoặc livestream).")
+    async def slash_play(self, interaction: discord.Interaction, query: Optional[str] = None, stream: Optional[bool] = None): await self._play_logic(interaction, query, stream)
+    @slash_play.autocomplete('query')
+    async def play_autocomplete(self, interaction: discord.Interaction, current: str) -> list[app_commands.Choice[str]]:
+        """Gợi ý từ danh mục bài đã biết (không gọi mạng). Chọn gợi ý sẽ gửi link của bài, nên bài trong cache được phát ngay."""
+        if current.startswith(('http://', 'https://')): return []
+        try: tracks = await asyncio.wait_for(TRACKS.search(current, 25), AUTOCOMPLETE_TIMEOUT)
+        except Exception as e: log.warning(f"Không thể gợi ý bài hát cho '{current}': {e}"); return []
+        choices = []
+        for track in tracks:
+            if len(track['url']) > 100: continue # Giới hạn độ dài value của Discord
+            label = f"{track['title']} • {track['uploader']}" if track['uploader'] else track['title']
+            if track['duration']: minutes, seconds = divmod(int(track['duration']), 60); label = f"{label[:88]} ({minutes}:{seconds:02d})"
+            choices.append(app_commands.Choice(name=label[:100], value=track['url']))
+        return choices
+    @music_group.command(name="radio", description="Nghe radio/livestream cùng lúc với các server khác.")
+    @app_commands.describe(url="URL của livestream, bài hát hoặc luồng phát trực tuyến.")
+    async def slash_radio(self, interaction: discord.Interaction, url: str): await self._radio_logic(interaction, url)
     @music_group.command(name="pause", description="Tạm dừng hoặc tiếp tục phát bài hát hiện tại.")
     async def slash_pause(self, interaction: discord.Interaction): await self._pause_logic(interaction)
     @music_group.command(name="stop", description="Dừng phát nhạc và ngắt kết nối.")
@@ -458,8 +1160,9 @@ class MainCog(commands.Cog, name="Miku"):
     @music_group.command(name="skip", description="Bỏ qua bài hát hiện tại.")
     async def slash_skip(self, interaction: discord.Interaction): await self._skip_logic(interaction)
     @music_group.command(name="queue", description="Hiển thị hàng đợi bài hát.")
-    async def slash_queue(self, interaction: discord.Interaction):
-        state = self.get_guild_state(interaction.guild.id); state.last_ctx = interaction; await state.queue_callback(interaction)
+    @app_commands.describe(page="Trang cần xem (mỗi trang 10 bài).")
+    async def slash_queue(self, interaction: discord.Interaction, page: app_commands.Range[int, 1] = 1):
+        state = self.get_guild_state(interaction.guild.id); state.last_ctx = interaction; await state.queue_callback(interaction, page)
     @music_group.command(name="nowplaying", description="Hiển thị lại bảng điều khiển nhạc.")
     async def slash_nowplaying(self, interaction: discord.Interaction):
         state = self.get_guild_state(interaction.guild.id); state.last_ctx = interaction; await state.update_now_playing_message(new_song=True); await interaction.response.send_message("Đã hiển thị lại bảng điều khiển.", ephemeral=True)
@@ -471,6 +1174,9 @@ class MainCog(commands.Cog, name="Miku"):
     @music_group.command(name="remove", description="Xóa một bài hát khỏi hàng đợi.")
     @app_commands.describe(index="Số thứ tự của bài hát trong hàng đợi (xem bằng /queue).")
     async def slash_remove(self, interaction: discord.Interaction, index: int): await self._remove_logic(interaction, index)
+    @music_group.command(name="move", description="Chuyển một bài hát tới vị trí khác trong hàng đợi.")
+    @app_commands.describe(index="Số thứ tự hiện tại của bài hát.", position="Vị trí mới (1 là bài phát tiếp theo).")
+    async def slash_move(self, interaction: discord.Interaction, index: int, position: int): await self._move_logic(interaction, index, position)
     @music_group.command(name="clear", description="Xóa tất cả bài hát trong hàng đợi.")
     async def slash_clear(self, interaction: discord.Interaction): await self._clear_logic(interaction)
     @music_group.command(name="seek", description="Tua đến một thời điểm trong bài hát.")
@@ -0,0 +1,135 @@
+"""
+Chạy Miku ở chế độ cluster: chia các shard thành từng dải liên tục cho N process worker.
+Mỗi worker là một MikuBot (AutoShardedBot) độc lập với MainCog.states riêng, nên trạng thái của một guild chỉ nằm ở
+process đang giữ shard của guild đó. Supervisor khởi động lại worker bị crash hoặc ngừng gửi tình trạng.
+Chạy: python launcher.py   (MIKU_CLUSTER_WORKERS, MIKU_SHARD_COUNT)
+"""
+
+import sys
+import asyncio
+if sys.platform == 'win32':
+    asyncio.set_event_loop_policy(asyncio.WindowsProactorEventLoopPolicy())
+
+import logging
+import multiprocessing
+import os
+import queue
+import time
+
+import aiohttp
+from dotenv import load_dotenv
+
+log = logging.getLogger('launcher')
+
+HEALTH_TIMEOUT = 120     # Giây không nhận được nhịp tim thì coi worker bị treo
+RESTART_BACKOFF_MAX = 60 # Thời gian chờ tối đa trước khi khởi động lại một worker liên tục crash
+SUMMARY_INTERVAL = 60
+
+def guild_shard(guild_id: int, shard_count: int) -> int:
+    """Công thức của Discord: shard nhận sự kiện của guild."""
+    return (guild_id >> 22) % shard_count
+
+def shard_ranges(shard_count: int, workers: int) -> list[list[int]]:
+    """Chia shard 0..shard_count-1 thành `workers` dải liên tục, lệch nhau tối đa một shard."""
+    workers = max(1, min(workers, shard_count)); base, extra = divmod(shard_count, workers); ranges = []; start = 0
+    for index in range(workers):
+        size = base + (1 if index < extra else 0); ranges.append(list(range(start, start + size))); start += size
+    return ranges
+
+def worker_for_guild(guild_id: int, shard_count: int, workers: int) -> int:
+    """Worker giữ guild này. Chỉ phụ thuộc vào guild_id, số shard và số worker nên luôn cố định."""
+    shard_id = guild_shard(guild_id, shard_count)
+    return next(index for index, shard_ids in enumerate(shard_ranges(shard_count, workers)) if shard_id in shard_ids)
+
+async def recommended_shard_count(token: str) -> int:
+    """Hỏi Discord số shard được khuyến nghị (GET /gateway/bot)."""
+    async with aiohttp.ClientSession() as session:
+        async with session.get("https://discord.com/api/v10/gateway/bot", headers={"Authorization": f"Bot {token}"}) as response:
+            response.raise_for_status(); return int((await response.json())['shards'])
+
+class _Worker:
+    __slots__ = ('cluster_id', 'shard_ids', 'process', 'last_health', 'last_seen', 'restarts', 'restart_at')
+    def __init__(self, cluster_id: int, shard_ids: list[int]):
+        self.cluster_id = cluster_id; self.shard_ids = shard_ids; self.process = None
+        self.last_health: dict | None = None; self.last_seen = 0.0; self.restarts = 0; self.restart_at = 0.0
+
+class Supervisor:
+    """Tạo, theo dõi và khởi động lại các process worker; gom tình trạng mà mỗi worker gửi về."""
+    def __init__(self, shard_count: int, workers: int):
+        self.shard_count = shard_count; self.context = multiprocessing.get_context('spawn')
+        self.health_queue = self.context.Queue()
+        self.workers = [_Worker(index, shard_ids) for index, shard_ids in enumerate(shard_ranges(shard_count, workers))]
+
+    def _spawn(self, worker: _Worker):
+        from main import run_worker
+        worker.process = self.context.Process(target=run_worker, args=(worker.cluster_id, worker.shard_ids, self.shard_count, self.health_queue), name=f"miku-worker-{worker.cluster_id}", daemon=False)
+        worker.process.start(); worker.last_seen = time.monotonic()
+        log.info(f"Đã khởi động worker {worker.cluster_id} (PID {worker.process.pid}) cho shard {worker.shard_ids[0]}-{worker.shard_ids[-1]}.")
+
+    def _drain_health(self):
+        while True:
+            try: health = self.health_queue.get_nowait()
+            except queue.Empty: return
+            cluster_id = health.get('cluster_id')
+            if cluster_id is None or not 0 <= cluster_id < len(self.workers): continue
+            worker = self.workers[cluster_id]
+            if worker.process and health.get('pid') == worker.process.pid:
+                worker.last_health = health; worker.last_seen = time.monotonic()
+                # Worker chạy ổn định thì quên các lần crash trước
+                if health.get('ready'): worker.restarts = 0
+
+    def _check(self, worker: _Worker, now: float):
+        process = worker.process
+        if process is None:
+            if now >= worker.restart_at: self._spawn(worker)
+            return
+        if process.is_alive() and now - worker.last_seen <= HEALTH_TIMEOUT: return
+        if process.is_alive():
+            log.warning(f"Worker {worker.cluster_id} không phản hồi sau {HEALTH_TIMEOUT}s, đang khởi động lại.")
+            process.terminate(); process.join(10)
+            if process.is_alive(): process.kill(); process.join()
+        else: log.error(f"Worker {worker.cluster_id} đã dừng với mã {process.exitcode}.")
+        worker.restarts += 1; delay = min(RESTART_BACKOFF_MAX, 2 ** worker.restarts)
+        worker.process = None; worker.last_health = None; worker.restart_at = now + delay
+        log.info(f"Sẽ khởi động lại worker {worker.cluster_id} sau {delay}s.")
+
+    def summary(self) -> dict:
+        healths = [worker.last_health for worker in self.workers if worker.last_health]
+        return {
+            'workers': len(self.workers), 'alive': sum(1 for worker in self.workers if worker.process and worker.process.is_alive()),
+            'guilds': sum(h['guilds'] for h in healths), 'voice_clients': sum(h['voice_clients'] for h in healths),
+            'guild_states': sum(h['guild_states'] for h in healths), 'restarts': sum(worker.restarts for worker in self.workers)
+        }
+
+    def run(self):
+        for worker in self.workers: self._spawn(worker)
+        next_summary = time.monotonic() + SUMMARY_INTERVAL
+        try:
+            while True:
+                time.sleep(1); self._drain_health(); now = time.monotonic()
+                for worker in self.workers: self._check(worker, now)
+                if now >= next_summary:
+                    next_summary = now + SUMMARY_INTERVAL; s = self.summary()
+                    log.info(f"Cluster: {s['alive']}/{s['workers']} worker, {s['guilds']} server, {s['voice_clients']} kênh thoại, {s['guild_states']} phiên nhạc.")
+        except KeyboardInterrupt:
+            log.info("Đang tắt cluster theo yêu cầu của người dùng...")
+        finally:
+            for worker in self.workers:
+                if worker.process and worker.process.is_alive(): worker.process.terminate()
+            for worker in self.workers:
+                if worker.process: worker.process.join(10)
+
+def main():
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s [%(levelname)s] %(name)s: %(message)s', handlers=[logging.StreamHandler(sys.stdout)])
+    load_dotenv()
+    token = os.getenv('DISCORD_BOT_TOKEN')
+    if not token:
+        log.critical("LỖI: Vui lòng thiết lập biến DISCORD_BOT_TOKEN trong file .env"); sys.exit()
+    shard_count = os.getenv('MIKU_SHARD_COUNT')
+    shard_count = int(shard_count) if shard_count else asyncio.run(recommended_shard_count(token))
+    workers = int(os.getenv('MIKU_CLUSTER_WORKERS', str(min(os.cpu_count() or 1, shard_count))))
+    log.info(f"Khởi động cluster với {shard_count} shard trên {min(workers, shard_count)} worker.")
+    Supervisor(shard_count, workers).run()
+
+if __name__ == '__main__':
+    main()
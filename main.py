@@ -8,6 +8,8 @@ from discord.ext import commands
 import os
 from dotenv import load_dotenv
 import logging
+import time
+from utils.command_sync import CommandSyncManager
 
 def setup_logging():
     """Thiết lập logging để ghi ra file và console."""
@@ -32,24 +34,62 @@ intents = discord.Intents.default()
 intents.message_content = True
 intents.voice_states = True
 
-class MikuBot(commands.Bot):
-    def __init__(self):
+def parse_shard_ids(value: str | None) -> list[int] | None:
+    """Đọc danh sách shard dạng "0-3,7" từ biến môi trường."""
+    if not value: return None
+    shard_ids = []
+    for part in value.split(','):
+        start, _, end = part.strip().partition('-')
+        shard_ids.extend(range(int(start), int(end or start) + 1))
+    return shard_ids
+
+class MikuBot(commands.AutoShardedBot):
+    """
+    Bot chạy ở chế độ tự chia shard. Mặc định Discord gợi ý số shard; khi chạy trong cluster (launcher.py),
+    mỗi worker chỉ giữ các shard được giao, nên GuildState của một guild luôn nằm trong đúng một process.
+    """
+    def __init__(self, shard_ids: list[int] | None = None, shard_count: int | None = None, health_queue=None, cluster_id: int | None = None):
         super().__init__(
             command_prefix="miku!",
             help_command=None,
-            intents=intents
+            intents=intents,
+            shard_ids=shard_ids,
+            shard_count=shard_count
         )
         self.initial_cogs = ['cogs.music']
         self.synced = False
+        self.health_queue = health_queue; self.cluster_id = cluster_id; self.started_at = time.monotonic(); self.startup_seconds = None
+        # guild: đồng bộ theo từng server như trước | global: một lần cho cả bot | off: không tự đồng bộ
+        self.command_sync = CommandSyncManager(
+            self.tree, os.path.join(os.getenv('MIKU_STATE_DIR', 'data'), 'command_sync.json'), # Không để trong thư mục cache: AudioCache xóa mọi file lạ ở đó
+            mode=os.getenv('MIKU_COMMAND_SYNC', 'guild').lower(), concurrency=int(os.getenv('MIKU_SYNC_CONCURRENCY', '4'))
+        )
 
     async def setup_hook(self):
-        """Chỉ tải cogs, không làm gì khác."""
+        """Tải cogs và bắt đầu gửi tình trạng về supervisor nếu đang chạy trong cluster."""
         for extension in self.initial_cogs:
             try:
                 await self.load_extension(extension)
                 logging.info(f"Đã tải thành công: {extension}")
             except Exception as e:
                 logging.error(f"Lỗi khi tải extension {extension}:", exc_info=e)
+        if self.health_queue is not None:
+            self.loop.create_task(self.report_health())
+
+    def health_snapshot(self) -> dict:
+        music_cog = self.get_cog('Miku')
+        return {
+            'cluster_id': self.cluster_id, 'pid': os.getpid(), 'shard_ids': sorted(self.shards), 'ready': self.is_ready(),
+            'guilds': len(self.guilds), 'voice_clients': len(self.voice_clients), 'guild_states': len(music_cog.states) if music_cog else 0,
+            'latency_ms': round(self.latency * 1000) if self.is_ready() else None, 'startup_seconds': self.startup_seconds, 'uptime': round(time.monotonic() - self.started_at), 'time': time.time()
+        }
+
+    async def report_health(self):
+        """Gửi nhịp tim kèm số liệu về supervisor. Supervisor coi worker bị treo nếu lâu không nhận được."""
+        while not self.is_closed():
+            try: self.health_queue.put_nowait(self.health_snapshot())
+            except Exception as e: logging.warning(f"Không thể gửi tình trạng về supervisor: {e}")
+            await asyncio.sleep(15)
 
     async def on_ready(self):
         """
@@ -58,19 +98,12 @@ class MikuBot(commands.Bot):
         """
         await self.wait_until_ready()
         if not self.synced:
-            logging.info("Bắt đầu đồng bộ lệnh lần đầu cho các server hiện có...")
-            synced_count = 0
-            for guild in self.guilds:
-                try:
-                    await self.tree.sync(guild=guild)
-                    synced_count += 1
-                except discord.errors.Forbidden:
-                    logging.warning(f"Không có quyền đồng bộ lệnh cho server: {guild.name} ({guild.id})")
-                except Exception as e:
-                    logging.error(f"Lỗi khi đồng bộ lệnh cho guild {guild.id}:", exc_info=e)
-
-            logging.info(f"Đã đồng bộ lệnh cho {synced_count}/{len(self.guilds)} server.")
+            if self.command_sync.mode != 'off':
+                logging.info("Bắt đầu đồng bộ lệnh cho các server hiện có...")
+                await self.command_sync.sync_all(list(self.guilds))
             self.synced = True
+            self.startup_seconds = time.monotonic() - self.started_at
+            logging.info(f"Thời gian khởi động: {self.startup_seconds:.2f}s (đồng bộ lệnh {self.command_sync.last_duration:.2f}s).")
 
         logging.info(f'Đăng nhập thành công với tên {self.user} (ID: {self.user.id})')
         logging.info(f'Miku đã sẵn sàng trong {len(self.guilds)} servers!')
@@ -78,16 +111,36 @@ class MikuBot(commands.Bot):
         activity = discord.Activity(type=discord.ActivityType.listening, name=f"{self.command_prefix}help | /help")
         await self.change_presence(activity=activity)
 
-async def main():
-    if not os.path.exists('./cache'):
-        os.makedirs('./cache')
-        logging.info("Đã tạo thư mục './cache")
+async def main(shard_ids: list[int] | None = None, shard_count: int | None = None, health_queue=None, cluster_id: int | None = None):
+    cache_dir = os.getenv('MIKU_CACHE_DIR', 'cache')
+    if not os.path.exists(cache_dir):
+        os.makedirs(cache_dir)
+        logging.info(f"Đã tạo thư mục '{cache_dir}'")
     
-    async with MikuBot() as bot:
+    async with MikuBot(shard_ids=shard_ids, shard_count=shard_count, health_queue=health_queue, cluster_id=cluster_id) as bot:
         await bot.start(TOKEN)
 
+def run_worker(cluster_id: int, shard_ids: list[int], shard_count: int, health_queue):
+    """Điểm vào của một process worker do launcher.py tạo ra."""
+    # Mỗi worker có cache âm thanh riêng vì index cache không được chia sẻ giữa các process
+    os.environ['MIKU_CACHE_DIR'] = os.path.join(os.getenv('MIKU_CACHE_DIR', 'cache'), f"worker-{cluster_id}")
+    os.environ['MIKU_STATE_DIR'] = os.path.join(os.getenv('MIKU_STATE_DIR', 'data'), f"worker-{cluster_id}") # Mỗi worker quản lý các guild khác nhau
+    # Mỗi worker mở endpoint metrics ở cổng riêng: cổng gốc + số thứ tự worker
+    if int(os.getenv('MIKU_METRICS_PORT', '0')): os.environ['MIKU_METRICS_PORT'] = str(int(os.environ['MIKU_METRICS_PORT']) + cluster_id)
+    logging.info(f"Worker {cluster_id} khởi động với shard {shard_ids[0]}-{shard_ids[-1]} / {shard_count}.")
+    try:
+        asyncio.run(main(shard_ids=shard_ids, shard_count=shard_count, health_queue=health_queue, cluster_id=cluster_id))
+    except KeyboardInterrupt:
+        pass
+
 if __name__ == '__main__':
     try:
-        asyncio.run(main())
+        shard_count = int(os.getenv('MIKU_SHARD_COUNT') or 0) or None; shard_ids = parse_shard_ids(os.getenv('MIKU_SHARD_IDS'))
+        # AutoShardedBot chỉ nhận shard_ids khi biết tổng số shard
+        if shard_ids and not shard_count:
+            logging.critical("LỖI: MIKU_SHARD_IDS cần đi kèm MIKU_SHARD_COUNT (tổng số shard của bot)."); sys.exit(1)
+        if shard_ids and max(shard_ids) >= shard_count:
+            logging.critical(f"LỖI: MIKU_SHARD_IDS có shard {max(shard_ids)} nằm ngoài MIKU_SHARD_COUNT={shard_count} (shard đánh số từ 0)."); sys.exit(1)
+        asyncio.run(main(shard_ids=shard_ids, shard_count=shard_count))
     except KeyboardInterrupt:
         logging.info("Bot đã tắt theo yêu cầu của người dùng.")
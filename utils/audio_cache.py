@@ -0,0 +1,179 @@
+# utils/audio_cache.py
+
+import asyncio
+import json
+import logging
+import os
+import re
+import time
+from collections import OrderedDict
+from typing import Awaitable, Callable, Optional
+
+log = logging.getLogger(__name__)
+
+INDEX_FILENAME = "index.json"
+# Các trường metadata được lưu trong index để dựng lại Song khi cache hit mà không cần gọi yt-dlp.
+META_FIELDS = ("id", "title", "uploader", "duration", "thumbnail", "webpage_url")
+_YOUTUBE_ID_RE = re.compile(r'(?:youtube\.com/(?:watch\?(?:.*&)?v=|shorts/|embed/|live/)|youtu\.be/)([A-Za-z0-9_-]{11})')
+
+def extract_video_id(url: str) -> Optional[str]:
+    """Lấy video id từ URL YouTube mà không cần mạng. Trả về None nếu không nhận dạng được."""
+    match = _YOUTUBE_ID_RE.search(url)
+    return match.group(1) if match else None
+
+class AudioCache:
+    """
+    Cache file âm thanh dùng chung cho mọi GuildState, định danh theo video id.
+    Đếm tham chiếu để không xóa file đang được hàng đợi nào đó dùng, lưu index ra đĩa
+    để giữ lại qua các lần khởi động, và loại bỏ theo LRU khi vượt quá dung lượng cho phép.
+    File phụ đi kèm (`<file><suffix>`, vd: kết quả phân tích độ to) được giữ và xóa cùng file chính;
+    `on_remove(path)` được gọi mỗi khi một file bị xóa để nơi khác bỏ dữ liệu đã nhớ về file đó.
+    """
+    UNWANTED_LIMIT = 256
+
+    def __init__(self, directory: str, max_bytes: int, sidecar_suffixes: tuple[str, ...] = (), on_remove: Optional[Callable[[str], None]] = None):
+        self.directory = directory; self.max_bytes = max_bytes; self.sidecar_suffixes = sidecar_suffixes; self.on_remove = on_remove
+        self.index_path = os.path.join(directory, INDEX_FILENAME)
+        self._entries: OrderedDict[str, dict] = OrderedDict(); self._refs: dict[str, int] = {}
+        self._inflight: dict[str, asyncio.Future] = {}; self._loaded = False; self._dirty = False
+        self._unwanted: OrderedDict[str, None] = OrderedDict() # Bị discard khi đang tải: file tới muộn thì xóa luôn
+        self.hits = 0; self.misses = 0
+
+    @property
+    def total_bytes(self) -> int: return sum(entry['size'] for entry in self._entries.values())
+    def __len__(self) -> int: return len(self._entries)
+    def stats(self) -> dict: return {'entries': len(self._entries), 'bytes': self.total_bytes, 'hits': self.hits, 'misses': self.misses}
+
+    def _ensure_loaded(self):
+        if self._loaded: return
+        self._loaded = True; os.makedirs(self.directory, exist_ok=True)
+        try:
+            with open(self.index_path, encoding='utf-8') as f: raw = json.load(f)
+        except FileNotFoundError: raw = []
+        except (OSError, ValueError) as e: log.warning(f"Index cache hỏng, bắt đầu lại từ đầu: {e}"); raw = []
+        for entry in sorted(raw, key=lambda e: e.get('last_used', 0)):
+            if entry.get('path') and os.path.exists(entry['path']): self._entries[entry['id']] = entry
+        # Dọn các file không có trong index (tải dở, hoặc từ phiên bản cũ không có cache)
+        known = {os.path.abspath(entry['path']) for entry in self._entries.values()}
+        for name in os.listdir(self.directory):
+            path = os.path.abspath(os.path.join(self.directory, name))
+            if name == INDEX_FILENAME or path in known or not os.path.isfile(path): continue
+            if any(path.endswith(suffix) and path[:-len(suffix)] in known for suffix in self.sidecar_suffixes): continue
+            try: os.remove(path); log.info(f"Đã xóa file cache mồ côi: {path}")
+            except OSError as e: log.warning(f"Không thể xóa file cache mồ côi {path}: {e}")
+        log.info(f"Đã nạp cache âm thanh: {len(self._entries)} file, {self.total_bytes / 1048576:.1f} MB.")
+        self._evict()
+
+    def _save_index(self):
+        tmp_path = self.index_path + ".tmp"
+        try:
+            with open(tmp_path, 'w', encoding='utf-8') as f: json.dump(list(self._entries.values()), f, ensure_ascii=False)
+            os.replace(tmp_path, self.index_path); self._dirty = False
+        except OSError as e: log.error(f"Lỗi khi ghi index cache {self.index_path}: {e}")
+
+    def flush(self):
+        """Ghi index xuống đĩa nếu có thay đổi chưa lưu (vd: thứ tự LRU sau các lần cache hit)."""
+        if self._loaded and self._dirty: self._save_index()
+
+    def get(self, video_id: Optional[str]) -> Optional[dict]:
+        """Trả về entry nếu file đã có sẵn trong cache, đồng thời cập nhật thứ tự LRU."""
+        if not video_id: return None
+        self._ensure_loaded(); entry = self._entries.get(video_id)
+        if entry is None: return None
+        if not os.path.exists(entry['path']):
+            del self._entries[video_id]; self._save_index()
+            if self.on_remove: self.on_remove(entry['path'])
+            return None
+        entry['last_used'] = time.time(); self._entries.move_to_end(video_id); self._dirty = True
+        return entry
+
+    def add(self, video_id: str, path: str, data: dict) -> dict:
+        """Đăng ký một file vừa tải xong vào cache."""
+        self._ensure_loaded()
+        entry = {key: data.get(key) for key in META_FIELDS}
+        entry.update(id=video_id, path=path, size=os.path.getsize(path), last_used=time.time())
+        self._entries[video_id] = entry; self._entries.move_to_end(video_id)
+        self._save_index(); return entry
+
+    def acquire(self, video_id: str): self._refs[video_id] = self._refs.get(video_id, 0) + 1
+    def release(self, video_id: str):
+        count = self._refs.get(video_id, 0) - 1
+        if count > 0: self._refs[video_id] = count
+        else: self._refs.pop(video_id, None); self._evict()
+
+    def _evict(self):
+        total = self.total_bytes; evicted = False
+        for video_id in list(self._entries):
+            if total <= self.max_bytes: break
+            if self._refs.get(video_id) or video_id in self._inflight: continue
+            entry = self._entries.pop(video_id); total -= entry['size']; evicted = True; self._remove_files(entry, "LRU")
+        if evicted: self._save_index()
+
+    def _remove_files(self, entry: dict, reason: str):
+        if self.on_remove: self.on_remove(entry['path'])
+        for path in (entry['path'], *(entry['path'] + suffix for suffix in self.sidecar_suffixes)):
+            try: os.remove(path); log.info(f"Đã loại bỏ khỏi cache ({reason}): {path}")
+            except FileNotFoundError: pass
+            except OSError as e: log.error(f"Lỗi khi xóa file cache {path}: {e}")
+
+    def discard(self, video_id: Optional[str]) -> bool:
+        """
+        Xóa ngay một file không còn ai cần (vd: tải trước nhưng không được chọn). Bỏ qua nếu đang được dùng.
+        Nếu file còn đang tải (lượt tải vừa bị hủy nhưng thread yt-dlp vẫn chạy) thì file sẽ bị xóa khi `adopt` nhận được.
+        """
+        if not video_id or self._refs.get(video_id): return False
+        self._ensure_loaded()
+        if video_id in self._inflight or video_id not in self._entries:
+            self._unwanted[video_id] = None; self._unwanted.move_to_end(video_id)
+            while len(self._unwanted) > self.UNWANTED_LIMIT: self._unwanted.popitem(last=False)
+            return False
+        entry = self._entries.pop(video_id)
+        self._remove_files(entry, "không dùng tới"); self._save_index(); return True
+
+    def adopt(self, video_id: Optional[str], path: str, data: dict):
+        """Nhận file của một lượt tải đã bị hủy nhưng vẫn chạy xong: đưa vào index (tính vào dung lượng) hoặc xóa nếu đã bị discard."""
+        video_id = data.get('id') or video_id
+        if not video_id or not os.path.exists(path): return
+        if video_id in self._unwanted:
+            del self._unwanted[video_id]
+            if not self._refs.get(video_id) and video_id not in self._inflight:
+                self._ensure_loaded(); entry = self._entries.pop(video_id, None); self._remove_files(entry or {'path': path}, "không dùng tới")
+                if entry: self._save_index()
+                return
+        self.add(video_id, path, data); self._evict()
+
+    async def fetch(self, video_id: Optional[str], downloader: Callable[[], Awaitable[Optional[tuple[str, dict]]]]) -> Optional[dict]:
+        """
+        Trả về entry từ cache (đã giữ một tham chiếu), hoặc gọi `downloader` để tải về.
+        Các yêu cầu đồng thời cho cùng một video id được gộp lại thành một lần tải duy nhất.
+        Người gọi phải `release` entry khi không dùng nữa.
+        """
+        entry = self.get(video_id)
+        if entry: self.hits += 1
+        else: entry = await self._join_or_download(video_id, downloader)
+        if entry: self.acquire(entry['id']); self._evict()
+        return entry
+
+    async def _join_or_download(self, video_id: Optional[str], downloader) -> Optional[dict]:
+        while video_id in self._inflight:
+            shared = self._inflight[video_id]
+            try: entry = await asyncio.shield(shared)
+            except asyncio.CancelledError:
+                # Lần tải chung bị hủy bởi guild khác thì tự tải lại, còn nếu chính mình bị hủy thì dừng
+                if shared.cancelled(): continue
+                raise
+            self.hits += 1; return entry
+        return await self._download(video_id, downloader)
+
+    async def _download(self, video_id: Optional[str], downloader) -> Optional[dict]:
+        self.misses += 1; self._unwanted.pop(video_id, None) # Có người cần lại bài này
+        future = asyncio.get_running_loop().create_future()
+        if video_id: self._inflight[video_id] = future
+        try:
+            result = await downloader()
+            entry = self.add(result[1].get('id') or video_id, *result) if result else None
+            future.set_result(entry); return entry
+        except asyncio.CancelledError: future.cancel(); raise
+        except Exception as e: future.set_exception(e); future.exception(); raise
+        finally:
+            if video_id: self._inflight.pop(video_id, None)
@@ -0,0 +1,122 @@
+# utils/broadcast.py
+
+import logging
+import threading
+import time
+from typing import Callable, Hashable
+
+import discord
+
+log = logging.getLogger(__name__)
+
+FRAME_SECONDS = 0.02 # Mỗi frame của discord.py dài 20ms
+JOIN_DELAY_FRAMES = 3 # Người mới vào bắt đầu sau vị trí trực tiếp vài frame, để bù độ lệch giữa các luồng
+STALL_TIMEOUT = 0.5 # Nguồn không ra frame mới lâu hơn ngần này thì coi là bị nghẽn (chỉ để báo/đếm; người nghe vẫn nhận frame im lặng mỗi 20ms)
+OPUS_SILENCE = b'\xf8\xff\xfe'
+
+class Broadcast:
+    """
+    Một luồng giải mã/mã hóa dùng chung: thread riêng đọc nguồn theo đúng nhịp thời gian thực và ghi frame
+    vào ring buffer `capacity` frame. Mọi người nghe (BroadcastListener) chỉ đọc lại frame từ buffer,
+    nên chi phí FFmpeg và mã hóa Opus không tăng theo số guild.
+    """
+    def __init__(self, key: Hashable, source: discord.AudioSource, capacity: int):
+        self.key = key; self.source = source; self.capacity = capacity; self.opus = source.is_opus()
+        self._frames: list[bytes | None] = [None] * capacity; self.head = 0; self._cond = threading.Condition()
+        self.listeners = 0; self.ended = False; self.closed = False; self.lagged = 0; self._cleanup_lock = threading.Lock(); self._cleaned = False
+        self.last_frame_at = time.perf_counter(); self._stall_logged = False
+        self._thread = threading.Thread(target=self._run, daemon=True, name=f"broadcast-{key}")
+
+    def start(self): self._thread.start()
+
+    def _run(self):
+        started = time.perf_counter(); frames = 0
+        try:
+            while not self.closed:
+                try: data = self.source.read()
+                except Exception as e:
+                    if not self.closed: log.warning(f"Nguồn phát chung {self.key} bị lỗi: {e}")
+                    break
+                if not data: break
+                with self._cond: self._frames[self.head % self.capacity] = data; self.head += 1; self.last_frame_at = time.perf_counter(); self._stall_logged = False; self._cond.notify_all()
+                frames += 1; delay = started + frames * FRAME_SECONDS - time.perf_counter()
+                if delay > 0: time.sleep(delay)
+                elif delay < -1.0: started = time.perf_counter(); frames = 0 # Nguồn bị nghẽn lâu: bắt nhịp lại thay vì xả dồn
+        finally:
+            with self._cond: self.ended = True; self._cond.notify_all()
+            self._cleanup_source()
+
+    def _cleanup_source(self):
+        with self._cleanup_lock:
+            if self._cleaned: return
+            self._cleaned = True
+        self.source.cleanup()
+
+    @property
+    def stalled(self) -> bool: return not self.ended and not self.closed and time.perf_counter() - self.last_frame_at > STALL_TIMEOUT
+
+    def read(self, listener: 'BroadcastListener') -> bytes:
+        with self._cond:
+            # Chạy trên thread AudioPlayer của discord.py (chung nhịp 20ms): chỉ chờ tối đa một frame rồi gửi frame im lặng, không làm lệch nhịp gửi
+            if listener.cursor >= self.head and not self.ended and not self.closed: self._cond.wait(FRAME_SECONDS)
+            if listener.cursor >= self.head:
+                if self.ended or self.closed: return b''
+                if self.stalled and not self._stall_logged: self._stall_logged = True; log.warning(f"Nguồn phát chung {self.key} không ra dữ liệu quá {STALL_TIMEOUT}s, đang phát im lặng.")
+                return OPUS_SILENCE if self.opus else b'\x00' * discord.opus.Encoder.FRAME_SIZE
+            # Người nghe tụt lại quá buffer (tạm dừng lâu, luồng audio bị nghẽn) thì nhảy tới vị trí trực tiếp
+            if self.head - listener.cursor > self.capacity: listener.cursor = max(0, self.head - JOIN_DELAY_FRAMES); self.lagged += 1
+            data = self._frames[listener.cursor % self.capacity]; listener.cursor += 1; return data
+
+    def close(self):
+        with self._cond: self.closed = True; self._cond.notify_all()
+        self._cleanup_source() # Dừng FFmpeg ngay cả khi thread đang chờ dữ liệu từ mạng
+
+class BroadcastListener(discord.AudioSource):
+    """AudioSource nhẹ của một voice client: đọc frame từ Broadcast, bắt đầu ở vị trí trực tiếp."""
+    def __init__(self, hub: 'BroadcastHub', broadcast: Broadcast):
+        self.hub = hub; self.broadcast = broadcast; self.cursor = max(0, broadcast.head - JOIN_DELAY_FRAMES); self._closed = False
+    def read(self) -> bytes: return self.broadcast.read(self)
+    def is_opus(self) -> bool: return self.broadcast.opus
+    def cleanup(self):
+        if self._closed: return
+        self._closed = True; self.hub._unsubscribe(self.broadcast)
+    @property
+    def lag(self) -> float: return (self.broadcast.head - self.cursor) * FRAME_SECONDS
+
+class BroadcastHub:
+    """
+    Gom các guild phát cùng một nguồn (cùng `key`) vào một Broadcast. Broadcast được tạo khi có người nghe đầu tiên
+    (`factory()` mở nguồn) và bị đóng khi người nghe cuối cùng rời đi. Có thể gọi từ bất kỳ thread nào.
+    """
+    def __init__(self, buffer_seconds: float = 10.0):
+        self.capacity = max(JOIN_DELAY_FRAMES + 1, int(buffer_seconds / FRAME_SECONDS)); self._broadcasts: dict[Hashable, Broadcast] = {}
+        self._lock = threading.Lock(); self.started = 0
+
+    def __len__(self) -> int: return len(self._broadcasts)
+
+    def subscribe(self, key: Hashable, factory: Callable[[], discord.AudioSource]) -> BroadcastListener:
+        with self._lock:
+            broadcast = self._broadcasts.get(key)
+            if broadcast is None or broadcast.ended or broadcast.closed:
+                # Nguồn cũ đã phát hết (bài có thời lượng) thì mở lại từ đầu; người nghe cũ vẫn đọc nốt buffer của nguồn cũ
+                broadcast = self._broadcasts[key] = Broadcast(key, factory(), self.capacity); broadcast.start(); self.started += 1
+                log.info(f"Mở nguồn phát chung {key}.")
+            broadcast.listeners += 1
+            return BroadcastListener(self, broadcast)
+
+    def _unsubscribe(self, broadcast: Broadcast):
+        with self._lock:
+            broadcast.listeners -= 1
+            if broadcast.listeners > 0: return
+            if self._broadcasts.get(broadcast.key) is broadcast: del self._broadcasts[broadcast.key]
+        broadcast.close(); log.info(f"Đóng nguồn phát chung {broadcast.key} vì không còn ai nghe.")
+
+    def listeners(self) -> int:
+        with self._lock: return sum(broadcast.listeners for broadcast in self._broadcasts.values())
+
+    def stalled(self) -> int:
+        with self._lock: return sum(1 for broadcast in self._broadcasts.values() if broadcast.stalled)
+
+    def stop(self):
+        with self._lock: broadcasts = list(self._broadcasts.values()); self._broadcasts.clear()
+        for broadcast in broadcasts: broadcast.close()
@@ -0,0 +1,99 @@
+# utils/chat_sessions.py
+
+import asyncio
+import logging
+import time
+from collections import OrderedDict, deque
+from typing import Any, Hashable, Optional
+
+log = logging.getLogger(__name__)
+
+def estimate_tokens(text: str) -> int:
+    """Ước lượng số token (khoảng 4 ký tự một token) mà không cần gọi API count_tokens."""
+    return len(text) // 4 + 1
+
+class _Session:
+    __slots__ = ('turns', 'tokens', 'summary', 'lock', 'last_used', 'unsummarized', 'summary_task')
+    def __init__(self):
+        self.turns: deque[tuple[str, str]] = deque(); self.tokens = 0; self.summary: Optional[str] = None
+        self.lock = asyncio.Lock(); self.last_used = time.monotonic()
+        self.unsummarized: list[tuple[str, str]] = []; self.summary_task: asyncio.Task | None = None
+
+class ChatSessionManager:
+    """
+    Quản lý hội thoại Gemini theo từng guild với lịch sử có giới hạn.
+    Mỗi lần gửi chỉ kèm persona + (tóm tắt nếu có) + các lượt gần nhất vừa đủ `max_tokens`, nên prompt không phình mãi.
+    Khi vượt ngân sách, các lượt cũ bị cắt xuống còn khoảng 60% ngân sách một lần (để không tóm tắt sau mỗi tin nhắn)
+    và được tóm tắt trong nền nếu bật `summarize`. Phiên không dùng quá `ttl` giây hoặc vượt `max_sessions` (LRU) bị xóa.
+    Tin nhắn của cùng một guild được xử lý lần lượt.
+    """
+    def __init__(self, model: Any, persona: list[dict], max_tokens: int = 2000, ttl: float = 1800.0, max_sessions: int = 500, summarize: bool = True):
+        self.model = model; self.persona = persona; self.max_tokens = max_tokens; self.ttl = ttl; self.max_sessions = max_sessions; self.summarize = summarize
+        self._sessions: OrderedDict[Hashable, _Session] = OrderedDict(); self.evicted = 0; self.summaries = 0
+
+    def __len__(self) -> int: return len(self._sessions)
+
+    def _evict(self, keep: Optional[Hashable] = None, limit: Optional[int] = None):
+        """Xóa các phiên nhàn rỗi quá `ttl` hoặc ít được dùng nhất khi vượt `limit`. Phiên đang trả lời thì không bị xóa."""
+        now = time.monotonic(); limit = self.max_sessions if limit is None else limit
+        for key, session in list(self._sessions.items()): # Từ ít được dùng nhất tới mới nhất
+            if now - session.last_used <= self.ttl and len(self._sessions) <= limit: break
+            if key == keep or session.lock.locked(): continue
+            del self._sessions[key]; self.evicted += 1
+
+    def _get(self, key: Hashable) -> _Session:
+        session = self._sessions.get(key)
+        if session is None: self._evict(limit=self.max_sessions - 1); session = self._sessions[key] = _Session()
+        else: self._evict(keep=key)
+        self._sessions.move_to_end(key); session.last_used = time.monotonic(); return session
+
+    def history(self, session: _Session) -> list[dict]:
+        history = list(self.persona)
+        if session.summary:
+            history += [{'role': 'user', 'parts': [f"(Tóm tắt cuộc trò chuyện trước đó: {session.summary})"]}, {'role': 'model', 'parts': ["OK!"]}]
+        for user_text, model_text in session.turns:
+            history += [{'role': 'user', 'parts': [user_text]}, {'role': 'model', 'parts': [model_text]}]
+        return history
+
+    def _trim(self, session: _Session) -> list[tuple[str, str]]:
+        if session.tokens <= self.max_tokens: return []
+        dropped = []; target = int(self.max_tokens * 0.6)
+        # Luôn giữ lại lượt mới nhất, kể cả khi riêng nó đã vượt ngân sách
+        while len(session.turns) > 1 and session.tokens > target:
+            user_text, model_text = turn = session.turns.popleft(); session.tokens -= estimate_tokens(user_text) + estimate_tokens(model_text); dropped.append(turn)
+        return dropped
+
+    async def send(self, key: Hashable, message: str) -> str:
+        session = self._get(key)
+        async with session.lock:
+            chat = self.model.start_chat(history=self.history(session))
+            response = await chat.send_message_async(message); text = response.text
+            session.turns.append((message, text)); session.tokens += estimate_tokens(message) + estimate_tokens(text); session.last_used = time.monotonic()
+            dropped = self._trim(session)
+            if dropped and self.summarize:
+                session.unsummarized.extend(dropped)
+                if session.summary_task is None or session.summary_task.done(): session.summary_task = asyncio.create_task(self._summarize(session))
+        self._evict() # Các phiên bị bỏ qua lúc đang trả lời được dọn ở đây
+        return text
+
+    async def _summarize(self, session: _Session):
+        # Các lượt bị cắt trong lúc đang tóm tắt sẽ được gộp vào lần tóm tắt kế tiếp
+        while session.unsummarized:
+            dropped = session.unsummarized; session.unsummarized = []
+            await self._summarize_turns(session, dropped)
+
+    async def _summarize_turns(self, session: _Session, dropped: list[tuple[str, str]]):
+        transcript = "\n".join(f"User: {user_text}\nMiku: {model_text}" for user_text, model_text in dropped)
+        prompt = ("Summarize the following conversation between a user and Miku in at most 5 short sentences, in Vietnamese. "
+                  "Keep names, facts and preferences the user mentioned.\n"
+                  + (f"Earlier summary: {session.summary}\n" if session.summary else '') + transcript)
+        try: response = await self.model.generate_content_async(prompt)
+        except Exception as e: log.warning(f"Không thể tóm tắt lịch sử trò chuyện: {e}"); return
+        summary = (response.text or '').strip()
+        if summary: session.summary = summary[:self.max_tokens]; self.summaries += 1 # max_tokens ký tự ~ 1/4 ngân sách token
+
+    def clear(self, key: Hashable):
+        session = self._sessions.pop(key, None)
+        if session and session.summary_task: session.summary_task.cancel()
+
+    def stats(self) -> dict: return {'sessions': len(self._sessions), 'evicted': self.evicted, 'summaries': self.summaries}
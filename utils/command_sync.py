@@ -0,0 +1,85 @@
+# utils/command_sync.py
+
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import time
+
+import discord
+
+log = logging.getLogger(__name__)
+
+GLOBAL_KEY = 'global'
+
+class CommandSyncManager:
+    """
+    Đồng bộ lệnh slash mà không gọi lại API cho những nơi đã có đúng bộ lệnh.
+    Mỗi lần đồng bộ thành công, dấu vân tay (SHA-256) của bộ lệnh được lưu theo guild (hoặc một lần cho chế độ global),
+    nên khởi động lại mà không đổi lệnh thì không có request nào. Các guild còn lại được đồng bộ song song,
+    giới hạn bởi semaphore; HTTP client của discord.py tự chờ khi bị rate limit.
+    """
+    def __init__(self, tree: discord.app_commands.CommandTree, state_path: str, mode: str = 'guild', concurrency: int = 4):
+        self.tree = tree; self.state_path = state_path; self.mode = mode
+        self._semaphore = asyncio.Semaphore(max(1, concurrency)); self._hashes: dict[str, str] | None = None
+        self.synced = 0; self.skipped = 0; self.failed = 0; self.last_duration = 0.0
+
+    def _load(self) -> dict[str, str]:
+        if self._hashes is None:
+            try:
+                with open(self.state_path, encoding='utf-8') as f: self._hashes = {str(k): str(v) for k, v in json.load(f).items()}
+            except (OSError, ValueError, AttributeError): self._hashes = {}
+        return self._hashes
+
+    def _save(self):
+        tmp_path = self.state_path + ".tmp"
+        try:
+            os.makedirs(os.path.dirname(self.state_path) or '.', exist_ok=True)
+            with open(tmp_path, 'w', encoding='utf-8') as f: json.dump(self._load(), f)
+            os.replace(tmp_path, self.state_path)
+        except OSError as e: log.warning(f"Không thể lưu trạng thái đồng bộ lệnh: {e}")
+
+    def fingerprint(self, guild: discord.abc.Snowflake | None = None, commands: list | None = None) -> str:
+        """Băm payload mà `tree.sync()` sẽ gửi, kèm application_id để đổi bot thì đồng bộ lại."""
+        if commands is None: commands = self.tree.get_commands(guild=guild)
+        payload = sorted((command.to_dict(self.tree) for command in commands), key=lambda c: (c.get('type', 1), c['name']))
+        raw = json.dumps({'application_id': self.tree.client.application_id, 'commands': payload}, sort_keys=True, separators=(',', ':'), default=str)
+        return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+    async def sync_guild(self, guild: discord.Guild | None, force: bool = False, digest: str | None = None) -> bool:
+        """Đồng bộ một guild (hoặc toàn cục nếu `guild` là None) nếu dấu vân tay đã đổi. Trả về True nếu đã gọi API."""
+        key = GLOBAL_KEY if guild is None else str(guild.id); digest = digest or self.fingerprint(guild); hashes = self._load()
+        if not force and hashes.get(key) == digest: self.skipped += 1; return False
+        async with self._semaphore:
+            try: await self.tree.sync(guild=guild)
+            except discord.Forbidden:
+                self.failed += 1; log.warning(f"Không có quyền đồng bộ lệnh cho {'toàn cục' if guild is None else f'server: {guild.name} ({guild.id})'}"); return False
+            except Exception as e:
+                self.failed += 1; log.error(f"Lỗi khi đồng bộ lệnh cho {'toàn cục' if guild is None else f'guild {guild.id}'}:", exc_info=e); return False
+        hashes[key] = digest; self.synced += 1; return True
+
+    async def sync_all(self, guilds: list[discord.Guild]):
+        """Đồng bộ khi khởi động: một lần toàn cục, hoặc song song cho các guild có bộ lệnh đã đổi."""
+        started = time.perf_counter()
+        if self.mode == 'global': await self.sync_guild(None)
+        else:
+            # Các guild có cùng bộ lệnh thì dùng chung một dấu vân tay: chỉ serialize lại khi danh sách lệnh thật sự khác
+            digests: dict[tuple[int, ...], str] = {}
+            def digest_for(guild: discord.Guild) -> str:
+                commands = self.tree.get_commands(guild=guild); key = tuple(map(id, commands))
+                if key not in digests: digests[key] = self.fingerprint(commands=commands)
+                return digests[key]
+            await asyncio.gather(*(self.sync_guild(guild, digest=digest_for(guild)) for guild in guilds))
+            # Bỏ trạng thái của các guild mà bot đã rời
+            present = {str(guild.id) for guild in guilds} | {GLOBAL_KEY}
+            for key in [key for key in self._load() if key not in present]: del self._hashes[key]
+        self._save(); self.last_duration = time.perf_counter() - started
+        log.info(f"Đồng bộ lệnh ({self.mode}): {self.synced} đã gửi, {self.skipped} bỏ qua vì không đổi, {self.failed} lỗi, mất {self.last_duration:.2f}s.")
+
+    async def on_guild_join(self, guild: discord.Guild):
+        if self.mode != 'guild': return
+        if await self.sync_guild(guild): self._save(); log.info(f"Đã đồng bộ lệnh thành công cho {guild.name}.")
+
+    def stats(self) -> dict:
+        return {'mode': self.mode, 'synced': self.synced, 'skipped': self.skipped, 'failed': self.failed, 'last_duration': self.last_duration}
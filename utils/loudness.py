@@ -0,0 +1,82 @@
+# utils/loudness.py
+
+import asyncio
+import json
+import logging
+import math
+import os
+from typing import Optional
+
+log = logging.getLogger(__name__)
+
+SIDECAR_SUFFIX = ".loudness.json"
+
+def sidecar_path(path: str) -> str: return path + SIDECAR_SUFFIX
+
+class LoudnessAnalyzer:
+    """
+    Đo độ to (EBU R128, bộ lọc loudnorm của FFmpeg) cho file trong cache, chạy nền bằng subprocess nên không chặn event loop.
+    Kết quả được lưu thành file `<file>.loudness.json` cạnh file âm thanh nên mỗi bài chỉ phân tích một lần.
+    Khi phát, nếu chưa có kết quả thì dùng gain 0 dB chứ không bao giờ chờ phân tích.
+    """
+    def __init__(self, target_lufs: float, max_gain_db: float, workers: int = 1, max_queue: int = 256, timeout: float = 120.0):
+        self.target_lufs = target_lufs; self.max_gain_db = max_gain_db; self.workers = workers; self.timeout = timeout
+        self._gains: dict[str, float] = {}; self._queued: set[str] = set()
+        self._queue: asyncio.Queue[str] = asyncio.Queue(max_queue); self._tasks: list[asyncio.Task] = []
+        self.analyzed = 0; self.failed = 0
+
+    def gain_db(self, path: Optional[str]) -> Optional[float]:
+        """Gain đã tính cho file, hoặc None nếu chưa phân tích."""
+        if not path: return None
+        if path in self._gains: return self._gains[path]
+        try:
+            with open(sidecar_path(path), encoding='utf-8') as f: gain = float(json.load(f)['gain_db'])
+        except (OSError, ValueError, KeyError, TypeError): return None
+        self._gains[path] = gain; return gain
+
+    def gain_factor(self, path: Optional[str]) -> float:
+        gain = self.gain_db(path)
+        return 1.0 if gain is None else math.pow(10, gain / 20)
+
+    def submit(self, path: Optional[str]):
+        """Xếp file vào hàng chờ phân tích nếu chưa có kết quả. Hàng chờ đầy thì bỏ qua, lần phát sau sẽ thử lại."""
+        if not path or path in self._queued or self.gain_db(path) is not None: return
+        try: self._queue.put_nowait(path)
+        except asyncio.QueueFull: return
+        self._queued.add(path); self._tasks = [task for task in self._tasks if not task.done()]
+        while len(self._tasks) < self.workers: self._tasks.append(asyncio.create_task(self._worker()))
+
+    def forget(self, path: str):
+        """Bỏ gain đã nhớ của file bị xóa khỏi cache (AudioCache gọi qua `on_remove`), để `_gains` không lớn mãi."""
+        self._gains.pop(path, None)
+
+    def stop(self):
+        for task in self._tasks: task.cancel()
+        self._tasks.clear()
+
+    async def _worker(self):
+        while not self._queue.empty():
+            path = self._queue.get_nowait()
+            try: await self._analyze(path)
+            except asyncio.CancelledError: raise
+            except Exception as e: self.failed += 1; log.warning(f"Không thể phân tích độ to của {path}: {e}")
+            finally: self._queued.discard(path)
+
+    async def _analyze(self, path: str):
+        if not os.path.exists(path): return
+        process = await asyncio.create_subprocess_exec('ffmpeg', '-hide_banner', '-nostats', '-threads', '1', '-i', path, '-vn', '-af', 'loudnorm=print_format=json', '-f', 'null', '-', stdout=asyncio.subprocess.DEVNULL, stderr=asyncio.subprocess.PIPE)
+        try: _, stderr = await asyncio.wait_for(process.communicate(), timeout=self.timeout)
+        except (asyncio.TimeoutError, asyncio.CancelledError):
+            process.kill(); await process.wait(); raise
+        output = stderr.decode('utf-8', errors='ignore'); start = output.rfind('{'); end = output.rfind('}')
+        if process.returncode != 0 or start < 0 or end < start: raise RuntimeError(f"FFmpeg trả về mã {process.returncode}")
+        stats = json.loads(output[start:end + 1]); integrated = float(stats['input_i']); true_peak = float(stats['input_tp'])
+        if math.isinf(integrated): integrated = self.target_lufs # File im lặng, giữ nguyên
+        # Không tăng quá mức cho phép và không đẩy đỉnh thực vượt -1 dBTP
+        gain = max(-self.max_gain_db, min(self.max_gain_db, self.target_lufs - integrated, -1.0 - true_peak))
+        result = {'integrated_lufs': integrated, 'true_peak_db': true_peak, 'target_lufs': self.target_lufs, 'gain_db': round(gain, 2)}
+        tmp_path = sidecar_path(path) + ".tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f: json.dump(result, f)
+        os.replace(tmp_path, sidecar_path(path))
+        self._gains[path] = result['gain_db']; self.analyzed += 1
+        log.info(f"Đã phân tích độ to {os.path.basename(path)}: {integrated:.1f} LUFS, gain {result['gain_db']:+.1f} dB.")
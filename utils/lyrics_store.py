@@ -0,0 +1,97 @@
+# utils/lyrics_store.py
+
+import asyncio
+import concurrent.futures
+import logging
+import os
+import sqlite3
+import time
+from typing import Awaitable, Callable, Optional
+
+from utils.ytdl import normalize_query
+
+log = logging.getLogger(__name__)
+
+_MISS = object()
+
+class LyricsStore:
+    """
+    Cache lời bài hát trên đĩa (SQLite), giới hạn `max_entries` theo LRU.
+    Kết quả "không tìm thấy" cũng được nhớ nhưng chỉ trong `not_found_ttl` giây, để lần sau có thể thử lại.
+    Nhiều yêu cầu cùng lúc cho cùng một bài chỉ tạo một lần gọi model (single-flight); lỗi thì không được cache.
+    """
+    def __init__(self, path: str, max_entries: int = 2000, not_found_ttl: float = 21600.0):
+        self.path = path; self.max_entries = max_entries; self.not_found_ttl = not_found_ttl
+        self._executor = concurrent.futures.ThreadPoolExecutor(1, thread_name_prefix='miku-lyrics')
+        self._conn: sqlite3.Connection | None = None; self._inflight: dict[str, asyncio.Future] = {}
+        self.hits = 0; self.misses = 0; self.merged = 0
+
+    @staticmethod
+    def make_key(title: str, uploader: Optional[str]) -> str:
+        # Chuẩn hóa từng trường rồi mới nối: normalize_query gộp mọi khoảng trắng (kể cả \x1f) nên nối trước sẽ làm ("A B", "C") trùng ("A", "B C")
+        return f"{normalize_query(title)}\x1f{normalize_query(uploader or '')}"
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._conn is None:
+            os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+            self._conn = sqlite3.connect(self.path, check_same_thread=False)
+            self._conn.execute("PRAGMA journal_mode=WAL"); self._conn.execute("PRAGMA synchronous=NORMAL")
+            self._conn.execute("CREATE TABLE IF NOT EXISTS lyrics (key TEXT PRIMARY KEY, lyrics TEXT, created_at REAL NOT NULL, accessed_at REAL NOT NULL)")
+            self._conn.execute("CREATE INDEX IF NOT EXISTS lyrics_accessed ON lyrics (accessed_at)")
+        return self._conn
+
+    def _read(self, key: str):
+        conn = self._connect(); now = time.time()
+        row = conn.execute("SELECT lyrics, created_at FROM lyrics WHERE key = ?", (key,)).fetchone()
+        if row is None: return _MISS
+        lyrics, created_at = row
+        if lyrics is None and now - created_at > self.not_found_ttl:
+            with conn: conn.execute("DELETE FROM lyrics WHERE key = ?", (key,))
+            return _MISS
+        with conn: conn.execute("UPDATE lyrics SET accessed_at = ? WHERE key = ?", (now, key))
+        return lyrics
+
+    def _write(self, key: str, lyrics: Optional[str]):
+        conn = self._connect(); now = time.time()
+        with conn:
+            conn.execute("INSERT OR REPLACE INTO lyrics (key, lyrics, created_at, accessed_at) VALUES (?, ?, ?, ?)", (key, lyrics, now, now))
+            # Vượt giới hạn thì xóa các bài lâu không ai xem nhất
+            conn.execute("DELETE FROM lyrics WHERE key IN (SELECT key FROM lyrics ORDER BY accessed_at DESC LIMIT -1 OFFSET ?)", (self.max_entries,))
+
+    async def _run(self, func, *args):
+        return await asyncio.get_running_loop().run_in_executor(self._executor, func, *args)
+
+    async def get_or_fetch(self, title: str, uploader: Optional[str], fetch: Callable[[], Awaitable[Optional[str]]]) -> Optional[str]:
+        """Trả về lời bài hát (None nếu đã biết là không có). Chỉ gọi `fetch()` khi cache không có và chưa ai đang lấy."""
+        key = self.make_key(title, uploader)
+        while (inflight := self._inflight.get(key)) is not None:
+            self.merged += 1
+            try: return await asyncio.shield(inflight)
+            except asyncio.CancelledError:
+                # Người đang lấy bị hủy chứ không phải mình: tự lấy lại
+                if inflight.cancelled(): continue
+                raise
+        future = asyncio.get_running_loop().create_future(); self._inflight[key] = future
+        try:
+            try: cached = await self._run(self._read, key)
+            except Exception as e: log.warning(f"Không đọc được cache lời bài hát: {e}"); cached = _MISS
+            if cached is not _MISS: self.hits += 1; future.set_result(cached); return cached
+            self.misses += 1; lyrics = await fetch()
+            try: await self._run(self._write, key, lyrics)
+            except Exception as e: log.warning(f"Không ghi được cache lời bài hát: {e}")
+            future.set_result(lyrics); return lyrics
+        except asyncio.CancelledError:
+            if not future.done(): future.cancel()
+            raise
+        except Exception as e:
+            if not future.done(): future.set_exception(e)
+            raise
+        finally:
+            self._inflight.pop(key, None)
+            # Không ai chờ thì đánh dấu đã lấy exception để asyncio không cảnh báo
+            if future.done() and not future.cancelled(): future.exception()
+
+    async def close(self):
+        if self._conn is not None: await self._run(self._conn.close); self._conn = None
+
+    def stats(self) -> dict: return {'hits': self.hits, 'misses': self.misses, 'merged': self.merged, 'inflight': len(self._inflight)}
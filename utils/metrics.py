@@ -0,0 +1,136 @@
+# utils/metrics.py
+
+import asyncio
+import bisect
+import logging
+import math
+import time
+from typing import Callable, Iterable, Optional
+
+from aiohttp import web
+
+log = logging.getLogger(__name__)
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+
+def _format_labels(names: tuple[str, ...], values: tuple, extra: str = '') -> str:
+    parts = [f'{name}="{str(value)}"' for name, value in zip(names, values)]
+    if extra: parts.append(extra)
+    return '{' + ','.join(parts) + '}' if parts else ''
+
+def _format_value(value: float) -> str:
+    if math.isinf(value): return '+Inf' if value > 0 else '-Inf'
+    return repr(float(value))
+
+class _Timer:
+    __slots__ = ('histogram', 'labels', 'started')
+    def __init__(self, histogram: 'Histogram', labels: tuple): self.histogram = histogram; self.labels = labels
+    def __enter__(self): self.started = time.perf_counter(); return self
+    def __exit__(self, *exc): self.histogram.observe(time.perf_counter() - self.started, *self.labels)
+
+class Histogram:
+    """Histogram kiểu Prometheus. `observe` chỉ là một phép tìm nhị phân và vài phép cộng; cộng dồn bucket làm lúc xuất."""
+    kind = 'histogram'
+    def __init__(self, name: str, documentation: str, labelnames: tuple[str, ...] = (), buckets: Iterable[float] = DEFAULT_BUCKETS):
+        self.name = name; self.documentation = documentation; self.labelnames = labelnames; self.buckets = tuple(sorted(buckets))
+        self._series: dict[tuple, list] = {} # labels -> [số lần theo từng bucket (bucket cuối là +Inf), tổng, số lần]
+
+    def observe(self, value: float, *labels):
+        series = self._series.get(labels)
+        if series is None: series = self._series[labels] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+        series[0][bisect.bisect_left(self.buckets, value)] += 1; series[1] += value; series[2] += 1
+
+    def time(self, *labels) -> _Timer: return _Timer(self, labels)
+
+    def samples(self) -> Iterable[str]:
+        for labels, (counts, total, count) in self._series.items():
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (math.inf,), counts):
+                cumulative += bucket_count; le = 'le="' + _format_value(bound) + '"'
+                yield f"{self.name}_bucket{_format_labels(self.labelnames, labels, le)} {cumulative}"
+            yield f"{self.name}_sum{_format_labels(self.labelnames, labels)} {_format_value(total)}"
+            yield f"{self.name}_count{_format_labels(self.labelnames, labels)} {count}"
+
+class Counter:
+    kind = 'counter'
+    def __init__(self, name: str, documentation: str, labelnames: tuple[str, ...] = ()):
+        self.name = name; self.documentation = documentation; self.labelnames = labelnames; self._values: dict[tuple, float] = {}
+    def inc(self, *labels, amount: float = 1.0): self._values[labels] = self._values.get(labels, 0.0) + amount
+    def value(self, *labels) -> float: return self._values.get(labels, 0.0)
+    def samples(self) -> Iterable[str]:
+        for labels, value in self._values.items(): yield f"{self.name}_total{_format_labels(self.labelnames, labels)} {_format_value(value)}"
+
+class Gauge:
+    """
+    Giá trị tức thời. Nếu có `callback`, giá trị chỉ được tính khi có người đọc metrics nên không tốn gì trên đường nóng.
+    `kind='counter'` dùng cho tổng đếm sẵn ở nơi khác: giống Counter, HELP/TYPE mang tên gốc, chỉ mẫu mới có hậu tố `_total`.
+    """
+    def __init__(self, name: str, documentation: str, callback: Optional[Callable[[], float]] = None, kind: str = 'gauge'):
+        if kind == 'counter' and name.endswith('_total'): name = name[:-len('_total')]
+        self.name = name; self.documentation = documentation; self.callback = callback; self.kind = kind; self.value = 0.0
+    def set(self, value: float): self.value = value
+    def samples(self) -> Iterable[str]:
+        value = self.value
+        if self.callback:
+            try: value = self.callback()
+            except Exception as e: log.debug(f"Không đọc được metric {self.name}: {e}"); return
+        if value is not None: yield f"{self.name}{'_total' if self.kind == 'counter' else ''} {_format_value(value)}"
+
+class Registry:
+    def __init__(self): self._metrics: dict[str, Histogram | Counter | Gauge] = {}
+
+    def _register(self, metric):
+        # Nạp lại cog thì metric cùng tên được thay thế thay vì bị trùng
+        self._metrics[metric.name] = metric; return metric
+
+    def histogram(self, name: str, documentation: str, labelnames: tuple[str, ...] = (), buckets: Iterable[float] = DEFAULT_BUCKETS) -> Histogram:
+        existing = self._metrics.get(name)
+        if isinstance(existing, Histogram): return existing
+        return self._register(Histogram(name, documentation, labelnames, buckets))
+
+    def counter(self, name: str, documentation: str, labelnames: tuple[str, ...] = ()) -> Counter:
+        existing = self._metrics.get(name)
+        if isinstance(existing, Counter): return existing
+        return self._register(Counter(name, documentation, labelnames))
+
+    def gauge(self, name: str, documentation: str, callback: Optional[Callable[[], float]] = None, kind: str = 'gauge') -> Gauge:
+        """`kind='counter'`: có thể truyền tên có hoặc không có `_total`, metric luôn được xuất theo quy ước của Counter."""
+        return self._register(Gauge(name, documentation, callback, kind))
+
+    def render(self) -> str:
+        """Xuất toàn bộ metric theo định dạng text của Prometheus (version 0.0.4)."""
+        lines = []
+        for metric in self._metrics.values():
+            lines.append(f"# HELP {metric.name} {metric.documentation}"); lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(metric.samples())
+        return '\n'.join(lines) + '\n'
+
+REGISTRY = Registry()
+
+class LoopLagMonitor:
+    """Đo độ trễ của event loop: ngủ `interval` giây rồi xem thực tế bị đánh thức muộn bao lâu."""
+    def __init__(self, registry: Registry = REGISTRY, interval: float = 0.5):
+        self.interval = interval; self._task: asyncio.Task | None = None
+        self.gauge = registry.gauge('miku_event_loop_lag_seconds', 'Độ trễ event loop đo được gần nhất')
+        self.histogram = registry.histogram('miku_event_loop_lag_histogram_seconds', 'Phân bố độ trễ event loop', buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 5.0))
+
+    def start(self):
+        if self._task is None or self._task.done(): self._task = asyncio.create_task(self._run())
+
+    def stop(self):
+        if self._task: self._task.cancel(); self._task = None
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            expected = loop.time() + self.interval; await asyncio.sleep(self.interval)
+            lag = max(0.0, loop.time() - expected); self.gauge.set(lag); self.histogram.observe(lag)
+
+async def start_http_server(host: str, port: int, registry: Registry = REGISTRY) -> web.AppRunner:
+    """Mở endpoint `/metrics` (mặc định chỉ nghe trên localhost)."""
+    async def handle(request: web.Request) -> web.Response:
+        return web.Response(body=registry.render().encode('utf-8'), headers={'Content-Type': 'text/plain; version=0.0.4; charset=utf-8'})
+    app = web.Application(); app.router.add_get('/metrics', handle)
+    runner = web.AppRunner(app, access_log=None); await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    log.info(f"Metrics có tại http://{host}:{port}/metrics"); return runner
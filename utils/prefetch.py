@@ -0,0 +1,38 @@
+# utils/prefetch.py
+
+import asyncio
+import logging
+from typing import Callable, Iterable
+
+from utils.scheduler import Priority, SchedulerBusy
+
+log = logging.getLogger(__name__)
+
+class Prefetcher:
+    """
+    Tải trước các bài sắp phát của một guild trong nền.
+    `get_upcoming(n)` trả về tối đa n bài theo thứ tự sẽ phát; mỗi bài phải có thuộc tính `is_ready` và coroutine `ensure_ready()`.
+    Semaphore được chia sẻ giữa mọi guild để giới hạn tổng số lượt tải chạy song song.
+    """
+    def __init__(self, guild_id: int, get_upcoming: Callable[[int], Iterable], depth: int, semaphore: asyncio.Semaphore):
+        self.guild_id = guild_id; self.get_upcoming = get_upcoming; self.depth = depth; self.semaphore = semaphore
+        self._task: asyncio.Task | None = None; self._wakeup = asyncio.Event()
+
+    def kick(self):
+        """Báo cho prefetcher biết hàng đợi đã thay đổi."""
+        if self.depth <= 0: return
+        self._wakeup.set()
+        if self._task is None or self._task.done(): self._task = asyncio.create_task(self._run())
+
+    def stop(self):
+        if self._task: self._task.cancel(); self._task = None
+
+    async def _run(self):
+        while self._wakeup.is_set():
+            self._wakeup.clear()
+            for song in list(self.get_upcoming(self.depth)):
+                if song.is_ready: continue
+                async with self.semaphore:
+                    try: ready = await song.ensure_ready(Priority.BACKGROUND)
+                    except SchedulerBusy: return # Scheduler đang đầy, hoãn lại tới lần kick sau
+                    if not ready: log.warning(f"Guild {self.guild_id}: Không thể tải trước '{song.title}'.")
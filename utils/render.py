@@ -0,0 +1,37 @@
+# utils/render.py
+
+import asyncio
+import logging
+import time
+from typing import Awaitable, Callable
+
+log = logging.getLogger(__name__)
+
+class RenderScheduler:
+    """
+    Gộp các yêu cầu vẽ lại một tin nhắn thành tối đa một lần gọi `render` trong mỗi khoảng `min_interval`.
+    Yêu cầu đến liên tục (chuyển bài nhanh, chỉnh âm lượng liên tục) chỉ làm cờ "bẩn" được bật lại;
+    lần vẽ tiếp theo luôn dùng trạng thái mới nhất, nên không có bản cập nhật trung gian nào bị gửi thừa.
+    """
+    def __init__(self, render: Callable[[bool], Awaitable[None]], debounce: float = 0.5, min_interval: float = 2.0):
+        self.render = render; self.debounce = debounce; self.min_interval = min_interval
+        self._dirty = False; self._reposition = False; self._last_render = 0.0; self._task: asyncio.Task | None = None
+        self.requested = 0; self.rendered = 0
+
+    def request(self, reposition: bool = False):
+        """Hẹn vẽ lại. `reposition` được giữ lại cho tới lần vẽ kế tiếp kể cả khi bị gộp với yêu cầu khác."""
+        self._dirty = True; self._reposition = self._reposition or reposition; self.requested += 1
+        if self._task is None or self._task.done(): self._task = asyncio.create_task(self._run())
+
+    async def _run(self):
+        while self._dirty:
+            await asyncio.sleep(max(self.debounce, self._last_render + self.min_interval - time.monotonic()))
+            reposition = self._reposition; self._dirty = False; self._reposition = False
+            try: await self.render(reposition)
+            except asyncio.CancelledError: raise
+            except Exception as e: log.warning(f"Lỗi khi vẽ lại tin nhắn: {e}")
+            self._last_render = time.monotonic(); self.rendered += 1
+
+    def stop(self):
+        if self._task and not self._task.done(): self._task.cancel()
+        self._dirty = False; self._reposition = False
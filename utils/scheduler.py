@@ -0,0 +1,123 @@
+# utils/scheduler.py
+
+import asyncio
+import concurrent.futures
+import logging
+from collections import OrderedDict, deque
+from enum import IntEnum
+from typing import Any, Callable, Hashable
+
+log = logging.getLogger(__name__)
+
+class Priority(IntEnum):
+    INTERACTIVE = 0 # Người dùng đang chờ (tìm kiếm, lấy thông tin, bài sắp phát)
+    BACKGROUND = 1  # Tải trước, không ai đang chờ trực tiếp
+
+class SchedulerBusy(Exception):
+    """Hàng chờ của scheduler đã đầy, yêu cầu bị từ chối thay vì xếp hàng vô hạn."""
+    def __init__(self, message: str = "Miku đang bận xử lý quá nhiều yêu cầu, bạn thử lại sau ít phút nhé! (｡•́︿•̀｡)"):
+        super().__init__(message); self.message = message
+
+class _Job:
+    __slots__ = ('guild_id', 'priority', 'func', 'args', 'future', 'on_abandoned', 'tag')
+    def __init__(self, guild_id, priority, func, args, future, on_abandoned=None, tag=None):
+        self.guild_id = guild_id; self.priority = priority; self.func = func; self.args = args; self.future = future; self.on_abandoned = on_abandoned; self.tag = tag
+
+class ExtractionScheduler:
+    """
+    Executor riêng cho công việc yt-dlp. Giới hạn tổng số worker, chia lượt công bằng giữa các guild (round-robin),
+    ưu tiên việc tương tác hơn việc nền, và từ chối khi hàng chờ đầy.
+    Việc nền không bao giờ chiếm hết worker để luôn còn chỗ cho tìm kiếm.
+    """
+    def __init__(self, max_workers: int, max_pending: int, max_pending_per_guild: int, use_processes: bool = False):
+        self.max_workers = max_workers; self.max_background = max(1, max_workers - 1)
+        self.max_pending = max_pending; self.max_pending_per_guild = max_pending_per_guild; self.use_processes = use_processes
+        self._executor: concurrent.futures.Executor | None = None
+        # Mỗi mức ưu tiên: guild_id -> deque các job; thứ tự của OrderedDict chính là vòng round-robin
+        self._queues: dict[Priority, OrderedDict[int, deque[_Job]]] = {p: OrderedDict() for p in Priority}
+        self._pending_per_guild: dict[int, int] = {}; self.pending = 0; self.running = 0; self.running_background = 0
+        self.rejected = 0; self.promoted = 0
+
+    @property
+    def idle(self) -> int:
+        """Số worker rảnh sau khi tính cả các việc đang chờ (âm nếu đang quá tải)."""
+        return self.max_workers - self.running - self.pending
+
+    @property
+    def executor(self) -> concurrent.futures.Executor:
+        if self._executor is None:
+            if self.use_processes: self._executor = concurrent.futures.ProcessPoolExecutor(self.max_workers)
+            else: self._executor = concurrent.futures.ThreadPoolExecutor(self.max_workers, thread_name_prefix='miku-ytdl')
+        return self._executor
+
+    def shutdown(self):
+        if self._executor: self._executor.shutdown(wait=False, cancel_futures=True); self._executor = None
+
+    async def run(self, guild_id: int, priority: Priority, func: Callable[..., Any], *args, on_abandoned: Callable[[Any], None] | None = None, tag: Hashable = None) -> Any:
+        """
+        Xếp `func(*args)` vào hàng chờ của guild và đợi kết quả. Ném SchedulerBusy nếu hàng chờ đã đầy.
+        Người gọi bị hủy khi việc còn chờ thì việc bị bỏ; khi việc đã chạy (thread không dừng được) thì kết quả được giao cho `on_abandoned`.
+        `tag` cho phép `promote()` tìm lại việc này khi đang chờ.
+        """
+        if self.pending >= self.max_pending or self._pending_per_guild.get(guild_id, 0) >= self.max_pending_per_guild:
+            self.rejected += 1; log.warning(f"Scheduler đầy ({self.pending} việc đang chờ), từ chối yêu cầu của guild {guild_id}.")
+            raise SchedulerBusy()
+        future = asyncio.get_running_loop().create_future()
+        self._queues[priority].setdefault(guild_id, deque()).append(_Job(guild_id, priority, func, args, future, on_abandoned, tag))
+        self.pending += 1; self._pending_per_guild[guild_id] = self._pending_per_guild.get(guild_id, 0) + 1
+        self._dispatch()
+        return await future
+
+    def promote(self, tag: Hashable) -> bool:
+        """Đưa việc nền có `tag` còn đang chờ lên đầu hàng INTERACTIVE của guild đó (người dùng vừa chuyển sang chờ nó). True nếu tìm thấy."""
+        if tag is None: return False
+        queues = self._queues[Priority.BACKGROUND]
+        for guild_id, jobs in queues.items():
+            job = next((job for job in jobs if job.tag == tag and not job.future.done()), None)
+            if job is None: continue
+            jobs.remove(job)
+            if not jobs: del queues[guild_id]
+            job.priority = Priority.INTERACTIVE; self._queues[Priority.INTERACTIVE].setdefault(guild_id, deque()).appendleft(job)
+            self.promoted += 1; self._dispatch(); return True
+        return False
+
+    def _pop_next(self) -> _Job | None:
+        for priority in Priority:
+            if priority == Priority.BACKGROUND and self.running_background >= self.max_background: break
+            queues = self._queues[priority]
+            while queues:
+                guild_id, jobs = next(iter(queues.items()))
+                job = jobs.popleft()
+                # Chuyển guild xuống cuối vòng để các guild khác tới lượt
+                if jobs: queues.move_to_end(guild_id)
+                else: del queues[guild_id]
+                self.pending -= 1; count = self._pending_per_guild[guild_id] - 1
+                if count: self._pending_per_guild[guild_id] = count
+                else: del self._pending_per_guild[guild_id]
+                if not job.future.cancelled(): return job
+        return None
+
+    def _dispatch(self):
+        while self.running < self.max_workers:
+            job = self._pop_next()
+            if job is None: return
+            self.running += 1
+            if job.priority == Priority.BACKGROUND: self.running_background += 1
+            inner = asyncio.get_running_loop().run_in_executor(self.executor, job.func, *job.args)
+            inner.add_done_callback(lambda inner, job=job: self._on_done(job, inner))
+
+    def _on_done(self, job: _Job, inner: asyncio.Future):
+        self.running -= 1
+        if job.priority == Priority.BACKGROUND: self.running_background -= 1
+        exception = None if inner.cancelled() else inner.exception()
+        if not job.future.done():
+            if inner.cancelled(): job.future.cancel()
+            elif exception is not None: job.future.set_exception(exception)
+            else: job.future.set_result(inner.result())
+        elif job.on_abandoned and not inner.cancelled() and exception is None:
+            try: job.on_abandoned(inner.result())
+            except Exception as e: log.error(f"Lỗi khi xử lý kết quả của việc đã bị hủy: {e}", exc_info=True)
+        self._dispatch()
+
+    def stats(self) -> dict:
+        return {'running': self.running, 'pending': self.pending, 'max_workers': self.max_workers, 'rejected': self.rejected, 'promoted': self.promoted}
@@ -0,0 +1,90 @@
+# utils/session_store.py
+
+import asyncio
+import concurrent.futures
+import json
+import logging
+import os
+import sqlite3
+import time
+from typing import Callable, Optional
+
+log = logging.getLogger(__name__)
+
+Snapshot = Callable[[], Optional[dict]]
+
+class SessionStore:
+    """
+    Lưu phiên nghe nhạc của từng guild vào SQLite (chế độ WAL) để khởi động lại không mất hàng đợi.
+    Mỗi thay đổi chỉ đánh dấu guild là "bẩn"; sau `flush_interval` giây, snapshot của mọi guild bẩn được ghi
+    trong một transaction duy nhất trên một thread riêng, nên event loop không bao giờ chờ ổ đĩa.
+    """
+    def __init__(self, path: str, flush_interval: float = 2.0, max_age: float = 86400.0):
+        self.path = path; self.flush_interval = flush_interval; self.max_age = max_age
+        self._executor = concurrent.futures.ThreadPoolExecutor(1, thread_name_prefix='miku-sessions')
+        self._conn: sqlite3.Connection | None = None; self._dirty: dict[int, Snapshot | None] = {}; self._task: asyncio.Task | None = None
+        self.writes = 0; self.batches = 0
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._conn is None:
+            os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+            self._conn = sqlite3.connect(self.path, check_same_thread=False)
+            self._conn.execute("PRAGMA journal_mode=WAL"); self._conn.execute("PRAGMA synchronous=NORMAL")
+            self._conn.execute("CREATE TABLE IF NOT EXISTS sessions (guild_id INTEGER PRIMARY KEY, data TEXT NOT NULL, updated_at REAL NOT NULL)")
+        return self._conn
+
+    def _load_all(self) -> dict[int, dict]:
+        conn = self._connect()
+        # Phiên quá cũ thì không khôi phục nữa
+        with conn: conn.execute("DELETE FROM sessions WHERE updated_at < ?", (time.time() - self.max_age,))
+        sessions = {}
+        for guild_id, data in conn.execute("SELECT guild_id, data FROM sessions"):
+            try: sessions[guild_id] = json.loads(data)
+            except ValueError: log.warning(f"Bỏ qua phiên hỏng của guild {guild_id}.")
+        return sessions
+
+    def _write(self, rows: list[tuple[int, str, float]], deletes: list[tuple[int]]):
+        conn = self._connect()
+        with conn:
+            if rows: conn.executemany("INSERT OR REPLACE INTO sessions (guild_id, data, updated_at) VALUES (?, ?, ?)", rows)
+            if deletes: conn.executemany("DELETE FROM sessions WHERE guild_id = ?", deletes)
+
+    async def load_all(self) -> dict[int, dict]:
+        """Đọc toàn bộ phiên đã lưu (chỉ là dict nhỏ); việc khôi phục thật sự do bên gọi quyết định khi guild được dùng lại."""
+        return await asyncio.get_running_loop().run_in_executor(self._executor, self._load_all)
+
+    def mark_dirty(self, guild_id: int, snapshot: Snapshot):
+        """Hẹn ghi lại phiên của guild. `snapshot()` chỉ được gọi lúc ghi, trả về None nghĩa là xóa phiên."""
+        self._dirty[guild_id] = snapshot; self._schedule()
+
+    def delete(self, guild_id: int): self._dirty[guild_id] = None; self._schedule()
+
+    def _schedule(self):
+        if self._task is None or self._task.done(): self._task = asyncio.create_task(self._flush_later())
+
+    async def _flush_later(self):
+        await asyncio.sleep(self.flush_interval); await self.flush()
+        # Thay đổi đến trong lúc đang ghi thấy task này chưa xong nên không tự hẹn lượt mới: hẹn lại ở đây
+        self._task = None
+        if self._dirty: self._schedule()
+
+    async def flush(self):
+        if not self._dirty: return
+        dirty, self._dirty = self._dirty, {}; now = time.time(); rows = []; deletes = []
+        for guild_id, snapshot in dirty.items():
+            try: data = snapshot() if snapshot else None
+            except Exception as e: log.warning(f"Không thể tạo snapshot phiên cho guild {guild_id}: {e}"); continue
+            if data is None: deletes.append((guild_id,))
+            else: rows.append((guild_id, json.dumps(data, ensure_ascii=False, separators=(',', ':')), now))
+        try: await asyncio.get_running_loop().run_in_executor(self._executor, self._write, rows, deletes)
+        except Exception as e: log.error(f"Lỗi khi ghi phiên vào {self.path}:", exc_info=e); return
+        self.writes += len(rows) + len(deletes); self.batches += 1
+
+    async def close(self):
+        """Ghi nốt các thay đổi còn chờ rồi đóng kết nối."""
+        if self._task and not self._task.done(): self._task.cancel()
+        await self.flush()
+        if self._conn is not None:
+            await asyncio.get_running_loop().run_in_executor(self._executor, self._conn.close); self._conn = None
+
+    def stats(self) -> dict: return {'dirty': len(self._dirty), 'writes': self.writes, 'batches': self.batches}
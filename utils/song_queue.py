@@ -0,0 +1,58 @@
+# utils/song_queue.py
+
+import asyncio
+import itertools
+import random
+from collections import deque
+from typing import Generic, Iterator, TypeVar
+
+T = TypeVar('T')
+
+class SongQueue(Generic[T]):
+    """
+    Hàng đợi của một guild, thay cho asyncio.Queue để thao tác theo chỉ số mà không cần rút ra rồi nạp lại.
+    Thêm/lấy ở hai đầu là O(1); xóa/di chuyển theo chỉ số dựa trên deque.
+    `get()` có thể await như asyncio.Queue để player loop chờ bài tiếp theo.
+    """
+    def __init__(self):
+        self._items: deque[T] = deque(); self._waiters: deque[asyncio.Future] = deque()
+
+    def __len__(self) -> int: return len(self._items)
+    def __iter__(self) -> Iterator[T]: return iter(self._items)
+    def __getitem__(self, index: int) -> T: return self._items[index]
+    def qsize(self) -> int: return len(self._items)
+    def empty(self) -> bool: return not self._items
+
+    def _wakeup(self):
+        while self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done(): waiter.set_result(None); return
+
+    def put_nowait(self, item: T): self._items.append(item); self._wakeup()
+    async def put(self, item: T): self.put_nowait(item)
+
+    def get_nowait(self) -> T:
+        if not self._items: raise asyncio.QueueEmpty
+        return self._items.popleft()
+    async def get(self) -> T:
+        while not self._items:
+            waiter = asyncio.get_running_loop().create_future(); self._waiters.append(waiter)
+            try: await waiter
+            except asyncio.CancelledError:
+                # Nhường lượt đánh thức cho người chờ khác nếu đã được đánh thức mà lại bị hủy
+                if waiter.done() and not waiter.cancelled() and self._items: self._wakeup()
+                raise
+        return self._items.popleft()
+
+    def peek(self, index: int = 0) -> T | None: return self._items[index] if -len(self._items) <= index < len(self._items) else None
+    def remove(self, index: int) -> T:
+        item = self._items[index]; del self._items[index]; return item
+    def move(self, src: int, dst: int) -> T:
+        item = self.remove(src); self._items.insert(dst, item); return item
+    def shuffle(self):
+        items = list(self._items); random.shuffle(items); self._items = deque(items)
+    def clear(self) -> list[T]:
+        items = list(self._items); self._items.clear(); return items
+    def slice(self, start: int, stop: int) -> list[T]:
+        """Lấy một đoạn để hiển thị (phân trang) mà không sao chép toàn bộ hàng đợi."""
+        return list(itertools.islice(self._items, start, stop))
@@ -0,0 +1,73 @@
+# utils/timers.py
+
+import asyncio
+import logging
+import math
+from typing import Any, Callable, Hashable
+
+log = logging.getLogger(__name__)
+
+class _Timer:
+    __slots__ = ('key', 'callback', 'slot', 'rounds')
+    def __init__(self, key: Hashable, callback: Callable[[], Any], slot: int, rounds: int):
+        self.key = key; self.callback = callback; self.slot = slot; self.rounds = rounds
+
+class TimerWheel:
+    """
+    Timing wheel dùng chung cho mọi hạn chờ theo guild (ở một mình trong kênh, hàng đợi trống, hết hạn bảng tìm kiếm).
+    Mỗi hạn chờ có một `key`; hẹn lại cùng key sẽ thay thế hạn cũ. Hẹn, hủy và hẹn lại đều O(1).
+    Chỉ có một task đánh thức mỗi `resolution` giây (và chỉ khi còn hạn chờ), thay vì mỗi hạn chờ một task đang ngủ.
+    Hạn chờ được gọi muộn tối đa một `resolution`. `callback` có thể trả về coroutine; khi đó nó được chạy thành task riêng.
+    """
+    def __init__(self, resolution: float = 1.0, slots: int = 512):
+        self.resolution = resolution; self._slots: list[dict[Hashable, _Timer]] = [{} for _ in range(slots)]
+        self._timers: dict[Hashable, _Timer] = {}; self._cursor = 0; self._last_tick = 0.0; self._task: asyncio.Task | None = None
+        self._wakeup: asyncio.Event | None = None; self._running: set[asyncio.Task] = set(); self.fired = 0
+
+    def __len__(self) -> int: return len(self._timers)
+    def __contains__(self, key: Hashable) -> bool: return key in self._timers
+
+    def schedule(self, key: Hashable, delay: float, callback: Callable[[], Any]):
+        """Hẹn gọi `callback` sau `delay` giây (thay thế hạn chờ cũ cùng `key` nếu có)."""
+        self.cancel(key); now = asyncio.get_running_loop().time()
+        if not self._timers: self._last_tick = now # Bánh xe đang nghỉ: tính lại mốc từ bây giờ
+        # Tính từ mốc tick gần nhất nên hạn chờ không bao giờ bị gọi sớm hơn `delay`
+        ticks = max(1, math.ceil((now - self._last_tick + delay) / self.resolution)); size = len(self._slots)
+        timer = self._timers[key] = _Timer(key, callback, (self._cursor + ticks) % size, (ticks - 1) // size)
+        self._slots[timer.slot][key] = timer
+        if self._task is None or self._task.done(): self._wakeup = asyncio.Event(); self._task = asyncio.create_task(self._run())
+        self._wakeup.set()
+
+    def cancel(self, key: Hashable) -> bool:
+        timer = self._timers.pop(key, None)
+        if timer is None: return False
+        del self._slots[timer.slot][key]; return True
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            if not self._timers: self._wakeup.clear(); await self._wakeup.wait()
+            await asyncio.sleep(max(0.0, self._last_tick + self.resolution - loop.time()))
+            # Event loop bị trễ thì xử lý bù các tick đã lỡ thay vì làm hạn chờ trôi dần
+            while self._timers and self._last_tick + self.resolution <= loop.time():
+                self._cursor = (self._cursor + 1) % len(self._slots); self._last_tick += self.resolution
+                self._fire(self._slots[self._cursor])
+
+    def _fire(self, slot: dict[Hashable, _Timer]):
+        for key, timer in list(slot.items()):
+            if timer.rounds: timer.rounds -= 1; continue
+            del slot[key]; del self._timers[key]; self.fired += 1
+            try: result = timer.callback()
+            except Exception as e: log.error(f"Lỗi trong hạn chờ {key}:", exc_info=e); continue
+            if asyncio.iscoroutine(result):
+                task = asyncio.create_task(result); self._running.add(task); task.add_done_callback(self._done)
+
+    def _done(self, task: asyncio.Task):
+        self._running.discard(task)
+        if not task.cancelled() and task.exception(): log.error("Lỗi trong hạn chờ:", exc_info=task.exception())
+
+    def stop(self):
+        if self._task: self._task.cancel(); self._task = None
+        for task in list(self._running): task.cancel()
+        for slot in self._slots: slot.clear()
+        self._timers.clear()
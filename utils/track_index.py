@@ -0,0 +1,142 @@
+# utils/track_index.py
+
+import asyncio
+import concurrent.futures
+import logging
+import os
+import re
+import sqlite3
+import threading
+import time
+from typing import Optional
+
+from utils.ytdl import normalize_query
+
+log = logging.getLogger(__name__)
+
+_FIELDS = "id, url, title, uploader, duration, thumbnail, plays"
+
+class TrackIndex:
+    """
+    Danh mục (SQLite, FTS5) mọi bài bot đã tìm thấy, lấy thông tin hoặc phát, kèm số lần phát.
+    Dùng cho autocomplete của /music play và để nhận ra bài đã biết mà không cần gọi yt-dlp.
+    Ghi không chặn người gọi (`remember()` chỉ đẩy việc sang thread ghi); đọc chạy song song trên `readers` thread,
+    mỗi thread một kết nối (WAL), để nhiều người gõ cùng lúc không phải xếp hàng. Giữ tối đa `max_entries` bài,
+    bài ít được phát và lâu không gặp lại bị xóa trước. Không có FTS5 thì tìm bằng LIKE.
+    """
+    EVICT_EVERY = 200 # Số lần ghi giữa hai lần dọn bớt bài
+    CANDIDATES = 500
+
+    def __init__(self, path: str, max_entries: int = 20000, readers: int = 4):
+        self.path = path; self.max_entries = max_entries; self.fts = True
+        self._executor = concurrent.futures.ThreadPoolExecutor(1, thread_name_prefix='miku-tracks')
+        self._readers = concurrent.futures.ThreadPoolExecutor(readers, thread_name_prefix='miku-tracks-read')
+        self._conn: sqlite3.Connection | None = None; self._ready = threading.Lock(); self._local = threading.local(); self._read_conns: list[sqlite3.Connection] = []
+        self._writes = 0; self.lookups = 0; self.hits = 0
+
+    def _connect(self) -> sqlite3.Connection:
+        with self._ready:
+            if self._conn is None: self._conn = self._create()
+        return self._conn
+
+    def _reader(self) -> sqlite3.Connection:
+        """Kết nối đọc riêng của thread hiện tại (tạo sau kết nối ghi, khi bảng đã có)."""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            self._connect(); conn = self._local.conn = sqlite3.connect(self.path, check_same_thread=False)
+            with self._ready: self._read_conns.append(conn)
+        return conn
+
+    def _create(self) -> sqlite3.Connection:
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        conn = sqlite3.connect(self.path, check_same_thread=False)
+        conn.execute("PRAGMA journal_mode=WAL"); conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute("CREATE TABLE IF NOT EXISTS tracks (id TEXT PRIMARY KEY, url TEXT NOT NULL, title TEXT NOT NULL, title_key TEXT NOT NULL, uploader TEXT, "
+                     "duration REAL, thumbnail TEXT, plays INTEGER NOT NULL DEFAULT 0, last_played REAL, updated_at REAL NOT NULL)")
+        conn.execute("CREATE INDEX IF NOT EXISTS tracks_title_key ON tracks (title_key)")
+        conn.execute("CREATE INDEX IF NOT EXISTS tracks_popularity ON tracks (plays, updated_at)")
+        try:
+            with conn:
+                # Bảng FTS chỉ chứa chỉ mục (content='tracks'), trigger giữ nó khớp với bảng chính
+                conn.execute("CREATE VIRTUAL TABLE IF NOT EXISTS tracks_fts USING fts5(title, uploader, content='tracks', content_rowid='rowid', tokenize='unicode61 remove_diacritics 2')")
+                conn.execute("CREATE TRIGGER IF NOT EXISTS tracks_ai AFTER INSERT ON tracks BEGIN INSERT INTO tracks_fts (rowid, title, uploader) VALUES (new.rowid, new.title, new.uploader); END")
+                conn.execute("CREATE TRIGGER IF NOT EXISTS tracks_ad AFTER DELETE ON tracks BEGIN INSERT INTO tracks_fts (tracks_fts, rowid, title, uploader) VALUES ('delete', old.rowid, old.title, old.uploader); END")
+                conn.execute("CREATE TRIGGER IF NOT EXISTS tracks_au AFTER UPDATE OF title, uploader ON tracks BEGIN "
+                             "INSERT INTO tracks_fts (tracks_fts, rowid, title, uploader) VALUES ('delete', old.rowid, old.title, old.uploader); "
+                             "INSERT INTO tracks_fts (rowid, title, uploader) VALUES (new.rowid, new.title, new.uploader); END")
+        except sqlite3.OperationalError as e: self.fts = False; log.warning(f"SQLite không hỗ trợ FTS5, tìm bài trong danh mục bằng LIKE: {e}")
+        return conn
+
+    def _write(self, tracks: list[tuple], played: bool):
+        conn = self._connect(); now = time.time()
+        with conn:
+            conn.executemany("INSERT INTO tracks (id, url, title, title_key, uploader, duration, thumbnail, plays, last_played, updated_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?) "
+                             "ON CONFLICT(id) DO UPDATE SET url = excluded.url, title = excluded.title, title_key = excluded.title_key, uploader = COALESCE(excluded.uploader, uploader), "
+                             "duration = COALESCE(excluded.duration, duration), thumbnail = COALESCE(excluded.thumbnail, thumbnail), plays = plays + excluded.plays, "
+                             "last_played = COALESCE(excluded.last_played, last_played), updated_at = excluded.updated_at",
+                             [(*track[:3], normalize_query(track[2]), *track[3:], int(played), now if played else None, now) for track in tracks])
+            self._writes += 1
+            if self._writes % self.EVICT_EVERY == 0:
+                conn.execute("DELETE FROM tracks WHERE id IN (SELECT id FROM tracks ORDER BY plays DESC, updated_at DESC LIMIT -1 OFFSET ?)", (self.max_entries,))
+
+    def remember(self, tracks: list[dict], played: bool = False):
+        """
+        Ghi nhận các bài (dict có id, url, title, uploader, duration, thumbnail) trong nền; `played` tăng số lần phát.
+        Bài thiếu id hoặc tên thì bỏ qua. Lỗi chỉ được ghi log, không làm gián đoạn việc phát nhạc.
+        """
+        rows = [(t['id'], t['url'], t['title'], t.get('uploader'), t.get('duration'), t.get('thumbnail')) for t in tracks if t.get('id') and t.get('url') and t.get('title')]
+        if not rows: return
+        future = self._executor.submit(self._write, rows, played)
+        future.add_done_callback(lambda f: f.exception() and log.warning(f"Không ghi được danh mục bài hát: {f.exception()}"))
+
+    @staticmethod
+    def _match_query(query: str) -> Optional[str]:
+        tokens = re.findall(r'\w+', normalize_query(query))
+        return ' '.join(f'"{token}"*' for token in tokens) if tokens else None # Mọi từ đều phải khớp, từ cuối có thể đang gõ dở
+
+    def _search(self, query: str, limit: int) -> list[dict]:
+        conn = self._reader(); match = self._match_query(query)
+        if match is None: rows = conn.execute(f"SELECT {_FIELDS} FROM tracks ORDER BY plays DESC, updated_at DESC LIMIT ?", (limit,)).fetchall()
+        elif self.fts:
+            # Từ gõ dở quá ngắn có thể khớp hàng nghìn bài: chỉ xếp hạng trong CANDIDATES bài khớp đầu tiên
+            rows = conn.execute(f"SELECT {_FIELDS} FROM tracks WHERE rowid IN (SELECT rowid FROM tracks_fts WHERE tracks_fts MATCH ? LIMIT ?) "
+                                "ORDER BY plays DESC, updated_at DESC LIMIT ?", (match, self.CANDIDATES, limit)).fetchall()
+        else:
+            like = '%' + normalize_query(query).replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_') + '%'
+            rows = conn.execute(f"SELECT {_FIELDS} FROM tracks WHERE title_key LIKE ? ESCAPE '\\' ORDER BY plays DESC LIMIT ?", (like, limit)).fetchall()
+        return [dict(zip(('id', 'url', 'title', 'uploader', 'duration', 'thumbnail', 'plays'), row)) for row in rows]
+
+    def _lookup(self, column: str, value: str) -> Optional[dict]:
+        row = self._reader().execute(f"SELECT {_FIELDS} FROM tracks WHERE {column} = ? ORDER BY plays DESC LIMIT 1", (value,)).fetchone()
+        return dict(zip(('id', 'url', 'title', 'uploader', 'duration', 'thumbnail', 'plays'), row)) if row else None
+
+    async def _read(self, func, *args):
+        return await asyncio.get_running_loop().run_in_executor(self._readers, func, *args)
+
+    async def search(self, query: str, limit: int = 25) -> list[dict]:
+        """Các bài khớp mọi từ trong `query` (từ cuối tính theo tiền tố), bài được phát nhiều đứng trước. `query` rỗng: các bài phổ biến nhất."""
+        return await self._read(self._search, query, limit)
+
+    async def get(self, video_id: Optional[str]) -> Optional[dict]:
+        if not video_id: return None
+        self.lookups += 1; track = await self._read(self._lookup, 'id', video_id)
+        if track: self.hits += 1
+        return track
+
+    async def find_exact(self, query: str) -> Optional[dict]:
+        """Bài có tên trùng khớp `query` (sau khi chuẩn hóa), ưu tiên bài được phát nhiều nhất."""
+        self.lookups += 1; track = await self._read(self._lookup, 'title_key', normalize_query(query))
+        if track: self.hits += 1
+        return track
+
+    async def flush(self):
+        """Chờ các lần ghi đang xếp hàng chạy xong."""
+        await asyncio.get_running_loop().run_in_executor(self._executor, lambda: None)
+
+    async def close(self):
+        loop = asyncio.get_running_loop(); await loop.run_in_executor(None, self._readers.shutdown)
+        with self._ready: conns = self._read_conns; self._read_conns = []
+        for conn in conns: conn.close()
+        if self._conn is not None: await loop.run_in_executor(self._executor, self._conn.close); self._conn = None
+
+    def stats(self) -> dict: return {'lookups': self.lookups, 'hits': self.hits, 'fts': self.fts}
@@ -0,0 +1,28 @@
+# utils/ttl_cache.py
+
+import time
+from collections import OrderedDict
+from typing import Any, Hashable, Optional
+
+class TTLCache:
+    """Cache trong bộ nhớ có thời hạn sống (TTL) và giới hạn số phần tử, loại bỏ theo LRU. Có đếm hit/miss."""
+    def __init__(self, maxsize: int, ttl: float):
+        self.maxsize = maxsize; self.ttl = ttl; self._data: OrderedDict[Hashable, tuple[float, Any]] = OrderedDict()
+        self.hits = 0; self.misses = 0
+
+    def __len__(self) -> int: return len(self._data)
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        item = self._data.get(key)
+        if item is None or item[0] < time.monotonic():
+            if item is not None: del self._data[key]
+            self.misses += 1; return None
+        self._data.move_to_end(key); self.hits += 1; return item[1]
+
+    def set(self, key: Hashable, value: Any, ttl: Optional[float] = None):
+        if self.maxsize <= 0: return
+        self._data[key] = (time.monotonic() + (self.ttl if ttl is None else ttl), value); self._data.move_to_end(key)
+        while len(self._data) > self.maxsize: self._data.popitem(last=False)
+
+    def pop(self, key: Hashable): self._data.pop(key, None)
+    def clear(self): self._data.clear()
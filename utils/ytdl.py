@@ -0,0 +1,84 @@
+# utils/ytdl.py
+
+import json
+import logging
+import os
+import queue
+import threading
+import unicodedata
+import urllib.parse
+from contextlib import contextmanager
+
+import yt_dlp
+
+log = logging.getLogger(__name__)
+
+class YTDLPool:
+    """
+    Pool các instance yt_dlp.YoutubeDL dùng lâu dài cho một bộ tùy chọn.
+    Mỗi instance chỉ được một worker thread dùng tại một thời điểm nên an toàn khi gọi từ executor.
+    """
+    def __init__(self, options: dict, size: int):
+        self.options = options; self.size = size; self._idle: queue.LifoQueue[yt_dlp.YoutubeDL] = queue.LifoQueue()
+        self._lock = threading.Lock(); self.created = 0; self.hits = 0; self.misses = 0
+
+    @contextmanager
+    def borrow(self):
+        try: ytdl = self._idle.get_nowait(); hit = True
+        except queue.Empty: ytdl = yt_dlp.YoutubeDL(self.options); hit = False
+        with self._lock:
+            if hit: self.hits += 1
+            else: self.misses += 1; self.created += 1
+        try: yield ytdl
+        finally:
+            if self._idle.qsize() < self.size: self._idle.put(ytdl)
+
+_pools: dict[str, YTDLPool] = {}
+_pools_lock = threading.Lock()
+POOL_SIZE = int(os.getenv('MIKU_YTDL_POOL_SIZE', '4'))
+
+def get_pool(options: dict) -> YTDLPool:
+    """Trả về pool dùng chung cho bộ tùy chọn này (mỗi bộ tùy chọn một pool, tạo khi cần)."""
+    key = json.dumps(options, sort_keys=True, default=str)
+    with _pools_lock:
+        if key not in _pools: _pools[key] = YTDLPool(options, POOL_SIZE)
+        return _pools[key]
+
+def extract_info(options: dict, url: str, download: bool = False):
+    """
+    Gọi extract_info bằng một instance trong pool. Chạy trong worker thread, không gọi trực tiếp trên event loop.
+    Khi tải về, đường dẫn file được trả kèm trong khóa '_filename' của bài được chọn.
+    """
+    with get_pool(options).borrow() as ytdl:
+        data = ytdl.extract_info(url, download=download)
+        if data and download:
+            if 'entries' in data: data = data['entries'][0]
+            # Sau khi postprocessor (vd: chuyển sang .opus) chạy, đường dẫn thật nằm trong requested_downloads
+            downloads = data.get('requested_downloads') or [{}]
+            data['_filename'] = downloads[-1].get('filepath') or ytdl.prepare_filename(data)
+        return data
+
+def extract_playlist_page(options: dict, url: str, start: int, end: int):
+    """Lấy danh sách bài (dạng flat) từ vị trí start tới end (tính từ 1) của một playlist."""
+    with get_pool(options).borrow() as ytdl:
+        # Instance đang được mượn riêng nên có thể tạm đổi tham số rồi trả lại như cũ
+        ytdl.params['playlist_items'] = f"{start}-{end}"
+        try: data = ytdl.extract_info(url, download=False)
+        finally: ytdl.params.pop('playlist_items', None)
+        if data and data.get('entries') is not None: data['entries'] = list(data['entries'])
+        return data
+
+def looks_like_playlist(url: str) -> bool:
+    """Đoán URL có phải playlist không. Link video nằm trong playlist (watch?v=...&list=...) vẫn được coi là một bài."""
+    parsed = urllib.parse.urlparse(url); params = urllib.parse.parse_qs(parsed.query)
+    if 'list' in params and 'v' not in params: return True
+    return any(part in parsed.path for part in ('/playlist', '/sets/', '/album/'))
+
+def pool_stats() -> dict:
+    """Tổng hợp hit/miss của mọi pool (hit = dùng lại instance có sẵn)."""
+    with _pools_lock: pools = list(_pools.values())
+    return {'hits': sum(p.hits for p in pools), 'misses': sum(p.misses for p in pools), 'instances': sum(p.created for p in pools)}
+
+def normalize_query(query: str) -> str:
+    """Chuẩn hóa câu tìm kiếm để làm khóa cache: NFKC, chữ thường, gộp khoảng trắng."""
+    return ' '.join(unicodedata.normalize('NFKC', query).casefold().split())